@@ -1,20 +1,33 @@
 import os
 import subprocess
 import shutil
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import threading
 import numpy as np
-from scipy.interpolate import interp1d
 import glob
+import hashlib
+import json
 import statistics
-from collections import Counter
 from PIL import Image
 import argparse
+import tempfile
+import time
+import signal
 from pathlib import Path
+from collections import deque
+from dataclasses import dataclass, field
+import psutil
+from batch_manifest import BatchManifest
+from height_store import HeightStore, write_store, load_heights, store_paths
+from file_staging import STAGE_MODES, stage_file, temporary_path, atomic_write
+from folder_watch import PairWatcher, list_files
+from leases import LeaseDirectory, default_node_name, holds_lease
+from stage_trace import StageTrace, TraceWriter, NULL_TRACE
+from video_decoders import FRAME_WIDTH, FRAME_HEIGHT, CREATION_FLAGS, DECODERS, create_decoder, find_tool
 
 def run_command(command):
     """隐藏终端窗口运行命令"""
-    subprocess.run(command, check=True, creationflags=subprocess.CREATE_NO_WINDOW)
+    subprocess.run(command, check=True, creationflags=CREATION_FLAGS, start_new_session=True)
 
 def delete_file(files):
     files_to_delete = glob.glob(files)
@@ -22,18 +35,36 @@ def delete_file(files):
     for file in files_to_delete:
         os.remove(file)
 
-# 创建透明度模板
-def create_template(row_width, middle_line_index, template_path):
-    width = 640
-    height = row_width
+# 每帧保留的中间条带行数
+ROW_WIDTH = 29
 
+# 内存估算参数: 元数据中无帧数时的默认帧数(约 7.8 秒 x 30 fps), 以及每个工作进程的固定开销
+DEFAULT_FRAME_COUNT = 240
+WORKER_BASE_MEMORY = 64 * 1024 ** 2
+BOUNDED_WORKER_MEMORY = 48 * 1024 ** 2
+
+# 透明度模板每一行的 Alpha 值(三角渐变的闭式解, 中间行为 255, 首尾行为 0)
+def alpha_ramp(row_width, middle_line_index):
     # 生成 y 坐标网格
-    y_indices = np.arange(height)
+    y_indices = np.arange(row_width)
     alpha = 1 - np.abs(y_indices - middle_line_index) / middle_line_index
 
+    return (alpha * 255).astype(np.uint8)
+
+# 生成透明度渐变矩阵
+def template_alpha(row_width, middle_line_index, width=FRAME_WIDTH):
+    alpha = alpha_ramp(row_width, middle_line_index)
+
     # 扩展为 640xH 的渐变矩阵
     alpha_matrix = np.tile(alpha, (width, 1)).T  # 转置为 HxW
-    alpha_matrix = (alpha_matrix * 255).astype(np.uint8)
+
+    return alpha_matrix
+
+# 创建透明度模板
+def create_template(row_width, middle_line_index, template_path):
+    width = FRAME_WIDTH
+    height = row_width
+    alpha_matrix = template_alpha(row_width, middle_line_index, width)
 
     # 创建透明模板图像 (RGBA)
     img = Image.new("RGBA", (width, height), (0, 0, 0, 0))
@@ -75,63 +106,87 @@ def apply_alpha_mask(pixel_paths, template_path, output_pattern):
             # 保存结果
             new_img.save(output_pattern % frame_idx, "PNG")
 
-def process_file(full_run_with_extension, height_file, pic_path, target_video_path, target_height_path, model_path):
-    # Remove file extension
-    full_path = Path(full_run_with_extension)
+def estimate_video_memory(frame_count, row_width=ROW_WIDTH, pipeline='stream', bounded=False, segmented=False):
+    """根据帧数估算单个视频处理时的峰值内存(字节)"""
+    if bounded:
+        # 有界内存拼接: 画布窗口、分块缩放的行数据和缩放结果, 与帧数无关
+        return BOUNDED_WORKER_MEMORY + WORKER_BASE_MEMORY
+    canvas_height = row_width + max(frame_count - 1, 0) * (row_width // 2)
+    # 流式: 画布(RGB + Alpha)、RGBA 结果及其 RGB 副本; png: 增长中的拼接图、临时画布、裁剪图及 RGB 副本;
+    # 分段拼接时各段的结果在接合前还需另占一份
+    bytes_per_pixel = 12 if pipeline == 'stream' else 16
+    if segmented:
+        bytes_per_pixel += 4
+
+    return canvas_height * FRAME_WIDTH * bytes_per_pixel + WORKER_BASE_MEMORY
+
+def probe_video_frames(decoder, video_path):
+    """通过容器元数据(不解码)读取视频帧数, 无法读取时返回默认帧数"""
+    try:
+        return decoder.frame_count(video_path, fallback=False) or DEFAULT_FRAME_COUNT
+    except Exception:
+        return DEFAULT_FRAME_COUNT
+
+def ignore_interrupt():
+    """进程池工作进程的初始化函数: 忽略 SIGINT"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def create_pool(executor, max_workers):
+    """
+    创建线程池(executor 为 'thread')或进程池。终端中的 Ctrl+C 会发给整个前台进程组, 进程池的工作进程忽略 SIGINT,
+    由主进程停止领取新任务并等待正在处理的视频完成、写入清单后再退出
+    """
+    if executor == 'process':
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=ignore_interrupt)
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+def run_admitted_tasks(executor, tasks, options, estimates, max_workers, memory_budget, on_success=None):
+    """
+    按内存预算提交任务(所有任务共用处理参数 options): 在途任务的预估峰值内存之和不超过预算(至少保证一个任务在运行),
+    任务完成后立即释放其预算并逐个报告结果; 成功的任务会以 (task, 返回值) 调用 on_success
+    """
+    pending = deque(zip(tasks, estimates))
+    running = {}
+    memory_in_use = 0
+
+    while pending or running:
+        while pending and len(running) < max_workers:
+            task, estimate = pending[0]
+            if running and memory_in_use + estimate > memory_budget:
+                break
+            pending.popleft()
+            future = executor.submit(process_file, task, options)
+            running[future] = (task, estimate)
+            memory_in_use += estimate
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            task, estimate = running.pop(future)
+            memory_in_use -= estimate
+            try:
+                result = future.result()  # 等待任务完成，如果有异常，会在这里抛出
+            except Exception as e:
+                line = f"Error processing {task.file}: {e}"
+                print(line)
+                continue
+            if on_success:
+                on_success(task, result)
+
+def splice_video_png(ffmpeg, full_path, video_path, row_width, keep_intermediates=True, trace=NULL_TRACE):
+    """
+    原始流程: 每一帧依次以 PNG 形式落盘(_frame/_P/_A)到 full_path 所在的临时目录, 再读回拼接。
+    keep_intermediates 为 False 时不再写出拼接结果的 _temp_composite_A.png / _raw.png, 直接返回内存中的图像。
+    """
     run = full_path.stem
     full_run = full_path.parent / run
 
-    os.makedirs(pic_path, exist_ok=True)
-
-    FFMPEG = Path(model_path) / "ffmpeg.exe"
-    FFPROBE = Path(model_path) / "ffprobe.exe"
-
-    line = f"Processing started for {run}"
-    print(line)
-
-    # Check if the height file exists
-    if not os.path.exists(height_file):
-        line = f"Skipping {run} - height file does not exist"
-        print(line)
-        return
-
-    # Reverse video and heights if needed
-    with open(height_file, 'r') as f:
-        heights = [float(line.strip()) for line in f.readlines()]
-    reverse_video = heights[0] < heights[-1]
-
-    if reverse_video:
-        # 删除原有的 target_video_path 和 target_height_path 文件（如果存在）
-        if os.path.exists(target_video_path):
-            os.remove(target_video_path)
-        if os.path.exists(target_height_path):
-            os.remove(target_height_path)
-
+    # Extract frames from video
+    with trace.stage('extract'):
         run_command(
-            [FFMPEG, '-i', full_run_with_extension, '-vf', 'reverse', target_video_path]
+            [ffmpeg, '-i', video_path, f'{full_run}_frame%03d.png']
         )
-        reversed_heights = heights[::-1]
-        with open(target_height_path, 'w') as rf:
-            rf.writelines([f"{dist}\n" for dist in reversed_heights])
-    else:
-        shutil.copy(height_file, target_height_path)
-        shutil.copy(full_run_with_extension, target_video_path)
-
-    # Extract frames from video
-    full_run_with_extension = target_video_path
-    run_command(
-        [FFMPEG, '-i', full_run_with_extension, f'{full_run}_frame%03d.png']
-    )
-
-    # Use ffprobe to get the number of frames
-    ffprobe_output = subprocess.check_output(
-        [FFPROBE, '-v', 'error', '-count_frames', '-select_streams', 'v:0', '-show_entries', 'stream=nb_read_frames',
-         '-of', 'default=nokey=1:noprint_wrappers=1', target_video_path], creationflags=subprocess.CREATE_NO_WINDOW
-    )
-    frames = int(ffprobe_output.strip()) - 1
 
     # Generate transparency template
-    row_width = 29
     template_path = os.path.join(os.path.dirname(full_run), run + '_template.png')
     middle_line_index = (row_width - 1) / 2
     create_template(row_width, middle_line_index, template_path)
@@ -141,44 +196,62 @@ def process_file(full_run_with_extension, height_file, pic_path, target_video_pa
     pattern = f"{run}_frame*.png"
     frame_files = sorted(full_path.parent.glob(pattern))
 
-    crop_frames(
-        frame_files=frame_files,
-        output_pattern=f"{full_run}_P%03d.png",
-        row_width=row_width,
-        crop_offset=int(240 - (row_width - 1) // 2)
-    )
+    # 以实际抽出的帧数作为拼接帧数, 无需再次解码计数
+    frames = len(frame_files) - 1
+
+    with trace.stage('crop'):
+        crop_frames(
+            frame_files=frame_files,
+            output_pattern=f"{full_run}_P%03d.png",
+            row_width=row_width,
+            crop_offset=int(240 - (row_width - 1) // 2)
+        )
 
-    delete_file(f'{full_run}_frame*.png')
+        delete_file(f'{full_run}_frame*.png')
 
     # Apply alpha mask to each pixel pic
     pattern = f"{run}_P*.png"
     pixel_paths = sorted(full_path.parent.glob(pattern))
 
-    apply_alpha_mask(
-        pixel_paths=pixel_paths,
-        template_path=template_path,
-        output_pattern=f"{full_run}_A%03d.png"
-    )
+    with trace.stage('mask'):
+        apply_alpha_mask(
+            pixel_paths=pixel_paths,
+            template_path=template_path,
+            output_pattern=f"{full_run}_A%03d.png"
+        )
 
-    delete_file(f'{full_run}_P*.png')
-    delete_file(template_path)
+        delete_file(f'{full_run}_P*.png')
+        delete_file(template_path)
 
     # Iterate through frames and add them to the composite image
-    composite_image = Image.open(f'{full_run}_A000.png')
-    splice_offset = row_width // 2
-    for frame in range(1, frames + 1):
-        frame_image = Image.open(f'{full_run}_A{frame:03d}.png')
+    with trace.stage('composite'):
+        composite_image = Image.open(f'{full_run}_A000.png')
+        splice_offset = row_width // 2
+        for frame in range(1, frames + 1):
+            frame_image = Image.open(f'{full_run}_A{frame:03d}.png')
+
+            # Create a new image with the appropriate size for the current frame
+            new_size = (640, row_width + frame * splice_offset)
+            temp_composite = Image.new('RGBA', new_size, (0, 0, 0, 0))
+
+            # Paste the current frame into the composite image
+            temp_composite.alpha_composite(composite_image, (0, 0))
+            temp_composite.alpha_composite(frame_image, (0, frame * splice_offset))
 
-        # Create a new image with the appropriate size for the current frame
-        new_size = (640, row_width + frame * splice_offset)
-        temp_composite = Image.new('RGBA', new_size, (0, 0, 0, 0))
+            # Update the composite image to the new one
+            composite_image = temp_composite
 
-        # Paste the current frame into the composite image
-        temp_composite.alpha_composite(composite_image, (0, 0))
-        temp_composite.alpha_composite(frame_image, (0, frame * splice_offset))
+    if not keep_intermediates:
+        delete_file(f'{full_run}_A*.png')
+        return composite_image
 
-        # Update the composite image to the new one
-        composite_image = temp_composite
+    with trace.stage('intermediates'):
+        composite_image = save_intermediates(composite_image, full_run, splice_offset)
+
+    return composite_image
+
+def save_intermediates(composite_image, full_run, splice_offset):
+    """写出拼接结果的中间文件(_temp_composite_A.png / _raw.png)后再读回"""
     # Save the final composite image
     temp_composite_path = f"{full_run}_temp_composite_A.png"
     composite_image.save(temp_composite_path)
@@ -200,27 +273,866 @@ def process_file(full_run_with_extension, height_file, pic_path, target_video_pa
     shutil.move(temp_composite_path, f'{full_run}_raw.png')
     delete_file(f'{full_run}_A*.png')
 
-    # resize and save the image
-    target_size = (640, 1440)
     with Image.open(final_output_path) as img:
-        # 移除 Alpha 通道（转换为 RGB）
-        rgb_img = img.convert("RGB")
+        composite_image = img.copy()
+    delete_file(f'{full_run}_raw.png')
+
+    return composite_image
+
+class SpliceCompositor:
+    """
+    预分配画布的线性拼接器: 按帧数一次性分配最终画布, 逐条将 row_width 行的条带混合到对应位置。
+    模板的 Alpha 只随行变化, 因此混合系数按行计算后向量化作用于整行, 运算与
+    PIL alpha_composite 的整数实现逐位一致。
+
+    reverse=True 时条带按到达顺序自下而上放置, 结果等同于对倒放视频按正序拼接,
+    只需保留与尚未完成的行重叠的少量条带, 无需倒放整段视频。
+    """
+    PRECISION_BITS = 7
+
+    def __init__(self, frame_count, row_width, width=FRAME_WIDTH, reverse=False):
+        self.row_width = row_width
+        self.width = width
+        self.splice_offset = row_width // 2
+        self.ramp = alpha_ramp(row_width, (row_width - 1) / 2).astype(np.uint32)
+        self.reverse = reverse
+        self.frames = 0
+        self.first_strip = None
+
+        height = self.canvas_height(max(frame_count, 1))
+        self.rgb = np.zeros((height, width, 3), dtype=np.uint8)
+        self.alpha = np.zeros(height, dtype=np.uint8)
+
+        # 倒序放置时: 第 j 帧的虚拟顶端为 -j * splice_offset, 画布行号 = 虚拟行号 + shift
+        self.shift = height - row_width if reverse else 0
+        self.pending = []
+        self.done = row_width
+
+    def canvas_height(self, frame_count):
+        return self.row_width + (frame_count - 1) * self.splice_offset
+
+    def _grow(self, height, front=False):
+        # 实际帧数超过预估时按倍数扩容, 保证总拷贝量仍为线性
+        old_height = self.alpha.shape[0]
+        height = max(height, 2 * old_height)
+        offset = height - old_height if front else 0
+        rgb = np.zeros((height, self.width, 3), dtype=np.uint8)
+        alpha = np.zeros(height, dtype=np.uint8)
+        rgb[offset:offset + old_height] = self.rgb
+        alpha[offset:offset + old_height] = self.alpha
+        self.rgb, self.alpha = rgb, alpha
+        self.shift += offset
+
+    def _blend(self, strip, top, rows):
+        """将条带中指定的行混合到画布 top 起始的位置"""
+        # 只处理 Alpha 非零的行, Alpha 为 0 的行保持画布原值
+        rows = rows[self.ramp[rows] > 0]
+        src_a = self.ramp[rows]
+        dst_a = self.alpha[top + rows].astype(np.uint32)
+
+        blend = dst_a * (255 - src_a)
+        outa255 = src_a * 255 + blend
+        coef1 = src_a * 255 * 255 * (1 << self.PRECISION_BITS) // outa255
+        coef2 = 255 * (1 << self.PRECISION_BITS) - coef1
+
+        tmp = (strip[rows].astype(np.uint32) * coef1[:, None, None]
+               + self.rgb[top + rows].astype(np.uint32) * coef2[:, None, None]
+               + (0x80 << self.PRECISION_BITS))
+        self.rgb[top + rows] = (((tmp >> 8) + tmp) >> 8) >> self.PRECISION_BITS
+        self.alpha[top + rows] = (((outa255 + 0x80) >> 8) + outa255 + 0x80) >> 8
+
+    def _flush(self, low):
+        """倒序放置时, 将虚拟行 [low, done) 按自上而下的条带顺序混合完成"""
+        rows = np.arange(self.row_width)
+        for top, strip in sorted(self.pending, key=lambda item: item[0]):
+            virtual_rows = top + rows
+            mask = (virtual_rows >= low) & (virtual_rows < self.done)
+            self._blend(strip, top + self.shift, rows[mask])
+
+        self.done = low
+        self.pending = [item for item in self.pending if item[0] < low]
+
+    def add(self, strip):
+        """将一条 row_width x width x 3 的 RGB 条带混合到下一帧的位置"""
+        if self.first_strip is None:
+            self.first_strip = strip.copy()
+
+        if self.reverse:
+            top = -self.frames * self.splice_offset
+            if top + self.shift < 0:
+                self._grow(self.alpha.shape[0] - (top + self.shift), front=True)
+            self.pending.append((top, strip.copy()))
+            # 后续条带不会再覆盖到 top - splice_offset + row_width 以下的行
+            self._flush(top - self.splice_offset + self.row_width)
+        else:
+            top = self.frames * self.splice_offset
+            bottom = top + self.row_width
+            if bottom + self.shift > self.alpha.shape[0]:
+                self._grow(bottom + self.shift)
+            self._blend(strip, top + self.shift, np.arange(self.row_width))
+
+        self.frames += 1
+
+    def canvas(self):
+        """完成全部混合, 返回整个画布按拼接方向的 (RGB, 逐行 Alpha) 数组(单帧时也不做特殊处理)"""
+        height = self.canvas_height(self.frames)
+        if self.reverse:
+            top = -(self.frames - 1) * self.splice_offset
+            self._flush(top)
+            start = top + self.shift
+        else:
+            start = 0
+        return self.rgb[start:start + height], self.alpha[start:start + height]
+
+    def result(self):
+        """返回最终的 RGBA 拼接图像"""
+        if self.frames == 0:
+            raise ValueError("No frames were added to the compositor")
+
+        alpha_matrix = np.tile(self.ramp.astype(np.uint8), (self.width, 1)).T
+        if self.frames == 1:
+            # 单帧时与原始流程一致, 直接返回带透明度的条带
+            return Image.fromarray(np.dstack([self.first_strip, alpha_matrix]), mode="RGBA")
+
+        rgb, alpha = self.canvas()
+        alpha = np.broadcast_to(alpha[:, None], (alpha.shape[0], self.width))
+        return Image.fromarray(np.dstack([rgb, alpha]), mode="RGBA")
+
+class SpilledRows:
+    """
+    写入文件的 RGB 拼接行: 每次切片只以内存映射读取所需的行并复制出来, 映射随即释放, 常驻内存不随图像高度增长。
+    reverse 为 True 时文件中的行按自下而上的顺序存放。
+    """
+
+    def __init__(self, path, height, width, reverse=False):
+        self.path = path
+        self.shape = (height, width, 3)
+        self.reverse = reverse
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        start, stop, _ = rows.indices(self.shape[0])
+        stop = max(start, stop)
+        if self.reverse:
+            start, stop = self.shape[0] - stop, self.shape[0] - start
+        if stop == start:
+            return np.empty((0,) + self.shape[1:], dtype=np.uint8)
+
+        row_bytes = self.shape[1] * 3
+        mapped = np.memmap(self.path, dtype=np.uint8, mode='r', offset=start * row_bytes,
+                           shape=(stop - start,) + self.shape[1:])
+        block = np.array(mapped[::-1] if self.reverse else mapped)
+        del mapped
+        return block
+
+    def __array__(self, dtype=None, copy=None):
+        rows = self[:]
+        return rows if dtype is None else rows.astype(dtype)
+
+class SpillingCompositor(SpliceCompositor):
+    """
+    有界内存的拼接器: 画布只保留 window 行, 后续条带不会再覆盖的行即已完成, 画布写满时将其追加写入 spill_path 文件,
+    结束后返回按需读取该文件的整幅 RGB 拼接图(SpilledRows, 不含 Alpha, 与 resize_composite 转换后的结果一致)。
+    每个视频的峰值内存与帧数无关。倒序放置时完成的行自下而上产生, 文件中按相反的顺序存放。
+    """
+
+    def __init__(self, spill_path, row_width, width=FRAME_WIDTH, reverse=False, window=1024):
+        super().__init__(1, row_width, width, reverse)
+        window = max(window, 4 * row_width)
+        self.rgb = np.zeros((window, width, 3), dtype=np.uint8)
+        self.alpha = np.zeros(window, dtype=np.uint8)
+        self.shift = window - row_width if reverse else 0
+        self.spill_path = spill_path
+        self.spill_file = open(spill_path, 'wb')
+        self.spilled_rows = 0
+        # 倒序放置时已写入文件的最上方的虚拟行
+        self.spilled_low = row_width
+
+    def _spill(self, rows):
+        self.spill_file.write(np.ascontiguousarray(rows).tobytes())
+        self.spilled_rows += rows.shape[0]
+
+    def add(self, strip):
+        window = self.alpha.shape[0]
+        if self.reverse:
+            top = -self.frames * self.splice_offset
+            if top + self.shift < 0:
+                # 虚拟行 [done, spilled_low) 已完成, 按自下而上的顺序写出; done 以上的行尚未混合, 画布整体清空
+                self._spill(self.rgb[self.done + self.shift:self.spilled_low + self.shift][::-1])
+                self.rgb[:] = 0
+                self.alpha[:] = 0
+                self.shift = window - self.done
+                self.spilled_low = self.done
+        else:
+            top = self.frames * self.splice_offset
+            if top + self.row_width + self.shift > window:
+                # top 以上的行已完成; 其余(已部分混合的)行移到画布顶端
+                finished = top + self.shift
+                self._spill(self.rgb[:finished])
+                self.rgb[:window - finished] = self.rgb[finished:]
+                self.alpha[:window - finished] = self.alpha[finished:]
+                self.rgb[window - finished:] = 0
+                self.alpha[window - finished:] = 0
+                self.shift = -top
+        super().add(strip)
+
+    def result(self):
+        """返回最终的 RGB 拼接图(SpilledRows; 单帧时为条带数组)"""
+        if self.frames == 0:
+            raise ValueError("No frames were added to the compositor")
+        if self.frames == 1:
+            self.spill_file.close()
+            return self.first_strip
+
+        height = self.canvas_height(self.frames)
+        if self.reverse:
+            self._flush(-(self.frames - 1) * self.splice_offset)
+            self._spill(self.rgb[self.done + self.shift:self.spilled_low + self.shift][::-1])
+        else:
+            self._spill(self.rgb[:height + self.shift])
+        self.spill_file.close()
+        self.rgb = self.alpha = None
+        return SpilledRows(self.spill_path, height, self.width, self.reverse)
+
+def splice_video_stream(decoder, video_path, row_width, frame_count, reverse=False, frame_indices=None,
+                        trace=NULL_TRACE, spill_path=None):
+    """
+    流式流程: 解码器只返回每帧中间的 row_width 行, 直接在内存中混合到预分配的画布上, 不产生任何中间 PNG;
+    给定 frame_indices 时只拼接这些帧。
+    给定 spill_path 时使用有界内存的拼接器, 返回 SpilledRows(RGB)而不是 RGBA 图像。
+    """
+    crop_offset = int(FRAME_HEIGHT // 2 - (row_width - 1) // 2)
+    frames = decoder.frames(video_path, rows=(crop_offset, crop_offset + row_width), frame_indices=frame_indices)
+
+    if spill_path:
+        compositor = SpillingCompositor(spill_path, row_width, reverse=reverse)
+    else:
+        compositor = SpliceCompositor(frame_count, row_width, reverse=reverse)
+    while True:
+        # 解码与混合交替进行, 分别计时
+        with trace.stage('decode'):
+            pixels = next(frames, None)
+        if pixels is None:
+            break
+        with trace.stage('composite'):
+            compositor.add(pixels)
+
+    if compositor.frames == 0:
+        raise ValueError(f"No frames decoded from {video_path}")
+
+    with trace.stage('composite'):
+        return compositor.result()
+
+# 每段至少包含的帧数, 过短的视频不再分段
+SEGMENT_MIN_FRAMES = 32
+# 相邻两段在接缝处额外重复解码的帧数, 用于校验按时间戳定位(seek)得到的帧是否准确
+SEGMENT_VERIFY_FRAMES = 4
+
+def segment_bounds(frame_count, segments, min_frames=SEGMENT_MIN_FRAMES):
+    """将 frame_count 帧(按视频中的顺序)均分为最多 segments 段, 返回各段的起始位置"""
+    segments = max(1, min(segments, frame_count // min_frames))
+    return [round(index * frame_count / segments) for index in range(segments)]
+
+def composite_segment(decoder, video_path, rows, row_width, reverse, start, stop, lead, total, frame_indices=None,
+                      verify=SEGMENT_VERIFY_FRAMES):
+    """
+    拼接一段帧: 在拼接方向上额外混合该段之前的 lead 帧(其条带与该段的首行重叠), 从空白画布开始拼接;
+    这些行经历的混合与整段串行拼接完全相同。stop 为 None 时拼接到视频末尾, total 为预估的总帧数。
+    与相邻段重叠的一侧再多解码 verify 帧(不参与混合)用于校验接缝。
+    返回 (RGB, Alpha, 该段自身的帧数, 最先解码的条带, 最后解码的条带), 其中 RGB / Alpha 从该段拥有的首行开始;
+    没有解码到该段自身的帧时返回 None。
+    """
+    overlap = lead + verify
+    # 拼接方向上位于该段之前的帧: 正放时为视频中更早的帧, 倒放时为更晚的帧
+    if reverse:
+        first, last = start, None if stop is None else stop + overlap
+        blend_first, blend_last = start, None if stop is None else stop + lead
+    else:
+        first, last = max(start - overlap, 0), stop
+        blend_first, blend_last = max(start - lead, 0), stop
+    if frame_indices is not None:
+        selected = frame_indices[first:last]
+        if not selected:
+            return None
+        frame_kwargs = {'frame_indices': selected, 'frame_range': (selected[0], selected[-1] + 1)}
+    else:
+        frame_kwargs = {'frame_range': (first, last)}
+
+    compositor = SpliceCompositor(max((blend_last or total) - blend_first, 1), row_width, reverse=reverse)
+    head, tail = [], deque(maxlen=overlap)
+    for position, pixels in enumerate(decoder.frames(video_path, rows=rows, **frame_kwargs), first):
+        if len(head) < overlap:
+            head.append(pixels)
+        tail.append(pixels)
+        if position >= blend_first and (blend_last is None or position < blend_last):
+            compositor.add(pixels)
+    if compositor.frames == 0:
+        return None
+
+    # 实际混合的前导帧数(视频比预估短时可能不足)
+    if reverse:
+        own_frames = min(compositor.frames, stop - start) if stop is not None else compositor.frames
+        lead_frames = compositor.frames - own_frames
+    else:
+        lead_frames = start - blend_first
+        own_frames = compositor.frames - lead_frames
+    if own_frames <= 0:
+        return None
+
+    rgb, alpha = compositor.canvas()
+    skip = lead_frames * compositor.splice_offset
+    return rgb[skip:].copy(), alpha[skip:].copy(), own_frames, head, list(tail)
+
+def seams_match(parts, overlap):
+    """
+    按视频中的顺序检查相邻两段: 前一段最后解码的 overlap 帧与后一段最先解码的 overlap 帧是同一组帧,
+    必须逐位相同且不全相同(画面静止时无法确认定位准确)。视频比预估短时末尾的段可以为空。
+    """
+    while parts and parts[-1] is None:
+        parts = parts[:-1]
+    if any(part is None for part in parts):
+        return False
+
+    for previous, current in zip(parts, parts[1:]):
+        tail, head = previous[4], current[3]
+        if len(tail) != overlap or len(head) != overlap:
+            return False
+        if not all(np.array_equal(a, b) for a, b in zip(tail, head)):
+            return False
+        if all(np.array_equal(head[0], strip) for strip in head[1:]):
+            return False
+    return True
+
+def splice_video_segments(decoder, video_path, row_width, frame_count, segments, reverse=False, frame_indices=None):
+    """
+    段内并行: 将视频按帧分为若干段, 各段在线程中分别定位、解码和拼接, 再按拼接方向依次接合各段拥有的行。
+    每段从空白画布开始并额外混合与其首行重叠的前几帧, 接缝处的 Alpha 混合与串行拼接逐位一致。
+    frame_count 可为预估值, 最后一段始终拼接到视频末尾。
+    接缝处重复解码的帧不一致(解码器定位不准确)或分段解码失败时, 退回到串行拼接整个视频。
+    """
+    crop_offset = int(FRAME_HEIGHT // 2 - (row_width - 1) // 2)
+    rows = (crop_offset, crop_offset + row_width)
+    splice_offset = row_width // 2
+    # 与某一条带首行重叠的前序条带数
+    lead = (row_width - 1) // splice_offset
+
+    total = len(frame_indices) if frame_indices is not None else frame_count
+    starts = segment_bounds(total, segments)
+    stops = starts[1:] + [None]
+    try:
+        with ThreadPoolExecutor(max_workers=len(starts)) as pool:
+            parts = list(pool.map(lambda bounds: composite_segment(decoder, video_path, rows, row_width, reverse,
+                                                                   bounds[0], bounds[1], lead, total, frame_indices),
+                                  zip(starts, stops)))
+        matched = seams_match(parts, lead + SEGMENT_VERIFY_FRAMES)
+    except Exception as e:
+        line = f"Segmented decoding of {video_path} failed ({e})"
+        print(line)
+        matched = False
+    if not matched:
+        line = f"Segments of {video_path} could not be verified, splicing it serially"
+        print(line)
+        return splice_video_stream(decoder, video_path, row_width, frame_count, reverse, frame_indices)
+
+    # 按拼接方向排列; 除最后一段外各段只保留自身帧对应的行, 最后一段保留到画布末尾
+    parts = [part for part in (parts[::-1] if reverse else parts) if part is not None]
+    if not parts:
+        raise ValueError(f"No frames decoded from {video_path}")
+    if sum(part[2] for part in parts) == 1:
+        # 整个视频只有一帧时与串行流程一致, 直接返回带透明度的条带
+        return splice_video_stream(decoder, video_path, row_width, 1, reverse, frame_indices)
+
+    rgb = np.concatenate([part[0][:part[2] * splice_offset] for part in parts[:-1]] + [parts[-1][0]])
+    alpha = np.concatenate([part[1][:part[2] * splice_offset] for part in parts[:-1]] + [parts[-1][1]])
+    alpha = np.broadcast_to(alpha[:, None], alpha.shape + (FRAME_WIDTH,))
+    return Image.fromarray(np.dstack([rgb, alpha]), mode="RGBA")
+
+def select_frames(heights, min_height_step):
+    """按高度变化抽帧: 与上一保留帧的高度差小于 min_height_step 的帧被跳过(首尾帧始终保留)"""
+    kept = [0]
+    for index in range(1, len(heights)):
+        if abs(heights[index] - heights[kept[-1]]) >= min_height_step or index == len(heights) - 1:
+            kept.append(index)
+
+    return kept
+
+def publish_file(source, destination):
+    """
+    将临时文件发布为最终输出: 先移动(跨文件系统时为复制)到目标目录中的临时文件, 再原子替换目标文件,
+    其他进程或节点不会读到写了一半的输出
+    """
+    temp_path = temporary_path(destination)
+    shutil.move(source, temp_path)
+    os.replace(temp_path, destination)
+    return destination
+
+def write_processed_heights(target_height_path, processed_heights):
+    """以文本形式写入与拼接方向一致的高度文件"""
+    with atomic_write(target_height_path) as rf:
+        rf.writelines([f"{dist}\n" for dist in processed_heights])
+
+# PIL 重采样使用的定点精度
+RESAMPLE_PRECISION_BITS = 22
+# 分块缩放时每块读入的行数据上限(字节)
+RESIZE_TILE_BYTES = 16 * 1024 ** 2
+
+def lanczos_coefficients(in_size, out_size):
+    """
+    与 PIL 的 LANCZOS 重采样(Resample.c)相同的纵向定点系数:
+    返回每个输出行的起始输入行、输入行数及系数矩阵(每行 ksize 个系数)
+    """
+    scale = in_size / out_size
+    filter_scale = max(scale, 1.0)
+    support = 3.0 * filter_scale
+    ksize = int(np.ceil(support)) * 2 + 1
+
+    center = (np.arange(out_size) + 0.5) * scale
+    first = np.maximum((center - support + 0.5).astype(np.int64), 0)
+    count = np.minimum((center + support + 0.5).astype(np.int64), in_size) - first
+
+    x = (first[:, None] + np.arange(ksize) - center[:, None] + 0.5) / filter_scale
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sinc = np.where(x == 0, 1.0, np.sin(np.pi * x) / (np.pi * x))
+        sinc3 = np.where(x == 0, 1.0, np.sin(np.pi * x / 3) / (np.pi * x / 3))
+    weights = np.where((x >= -3.0) & (x < 3.0), sinc * sinc3, 0.0)
+    weights[np.arange(ksize) >= count[:, None]] = 0.0
+
+    total = weights.sum(axis=1, keepdims=True)
+    weights = np.divide(weights, total, out=weights, where=total != 0)
+    return first, count, np.trunc(np.where(weights < 0, -0.5, 0.5) + weights * (1 << RESAMPLE_PRECISION_BITS))
+
+def resize_rows(rgb_rows, target_size=(640, 1440)):
+    """
+    按水平分块对 HxWx3 的 RGB 数组(或 SpilledRows)做纵向 LANCZOS 缩放, 每次只读入一块所需的行,
+    结果与 PIL 对整幅图像 resize 逐像素一致。定点乘加用 float64 矩阵乘法完成, 整数运算在 2^53 以内无舍入误差。
+    """
+    width, out_height = target_size
+    in_height = rgb_rows.shape[0]
+    if rgb_rows.shape[1] != width:
+        # 需要横向缩放时退回到整幅图像缩放
+        return Image.fromarray(np.ascontiguousarray(rgb_rows)).resize(target_size, Image.Resampling.LANCZOS)
+    if in_height == out_height:
+        return Image.fromarray(np.array(rgb_rows))
+
+    first, count, kernel = lanczos_coefficients(in_height, out_height)
+    row_bytes = width * 3 * 8
+    rows_per_tile = max(1, int((RESIZE_TILE_BYTES // row_bytes - kernel.shape[1]) / max(in_height / out_height, 1.0)))
+
+    resized = np.empty((out_height, width, 3), dtype=np.uint8)
+    for start in range(0, out_height, rows_per_tile):
+        stop = min(start + rows_per_tile, out_height)
+        low = first[start]
+        high = int((first[start:stop] + count[start:stop]).max())
+
+        weights = np.zeros((stop - start, high - low))
+        for index in range(start, stop):
+            offset = first[index] - low
+            weights[index - start, offset:offset + count[index]] = kernel[index, :count[index]]
+
+        tile = np.asarray(rgb_rows[low:high], dtype=np.float64).reshape(high - low, -1)
+        sums = weights @ tile + (1 << (RESAMPLE_PRECISION_BITS - 1))
+        resized[start:stop] = np.clip(np.floor(sums / (1 << RESAMPLE_PRECISION_BITS)), 0, 255).reshape(
+            stop - start, width, 3)
+    return Image.fromarray(resized)
+
+def resize_composite(composite_image, target_size=(640, 1440)):
+    # 有界内存拼接器返回的 RGB 行分块缩放
+    if not isinstance(composite_image, Image.Image):
+        return resize_rows(composite_image, target_size)
+
+    # 移除 Alpha 通道（转换为 RGB）
+    rgb_img = composite_image.convert("RGB")
+
+    # 强制拉伸到目标尺寸（LANCZOS 重采样保持质量）
+    return rgb_img.resize(target_size, Image.Resampling.LANCZOS)
+
+def image_difference(image_a, image_b):
+    """两张同尺寸图像的平均绝对像素差(0-255)"""
+    return float(np.mean(np.abs(np.asarray(image_a, dtype=np.int16) - np.asarray(image_b, dtype=np.int16))))
+
+def stage_processed_video(ffmpeg, video_path, target_video_path, reverse_video, stage_mode='auto'):
+    """
+    在 processed 文件夹中生成与拼接方向一致的视频: 倒放时重新编码, 正放时按 stage_mode 链接原视频(见 file_staging),
+    同一文件系统内不再完整复制
+    """
+    if not reverse_video:
+        stage_file(video_path, target_video_path, stage_mode)
+        return
+
+    # 先写入临时文件再替换, 中途失败不会留下不完整的视频
+    temp_path = temporary_path(target_video_path)
+    run_command(
+        [ffmpeg, '-i', video_path, '-vf', 'reverse', temp_path]
+    )
+    os.replace(temp_path, target_video_path)
+
+# 合成图像的输出格式: png 为原有的 optimize 压缩(最慢), png_fast 使用固定压缩级别, webp 为无损 WebP,
+# jpeg 为有损 JPEG, npy 直接保存与 PNG 像素相同的 RGB 数组(1440 x 640 x 3, uint8)
+OUTPUT_EXTENSIONS = {'png': '.png', 'png_fast': '.png', 'webp': '.webp', 'jpeg': '.jpg', 'npy': '.npy'}
+
+def encoder_options(output_format='png', png_level=1, jpeg_quality=95):
+    return {'format': output_format, 'png_level': png_level, 'jpeg_quality': jpeg_quality}
+
+def save_composite(image, output_stem, encoder=None):
+    """按所选的编码器保存合成图像, 返回保存的文件路径"""
+    encoder = encoder or encoder_options()
+    output_format = encoder['format']
+    output_path = f"{output_stem}{OUTPUT_EXTENSIONS[output_format]}"
+
+    if output_format == 'png':
+        image.save(output_path, "PNG", optimize=True)
+    elif output_format == 'png_fast':
+        image.save(output_path, "PNG", compress_level=encoder['png_level'])
+    elif output_format == 'webp':
+        # 无损模式下 quality 表示压缩耗时; 低耗时设置已比 optimize 的 PNG 更小
+        image.save(output_path, "WEBP", lossless=True, method=1, quality=0)
+    elif output_format == 'jpeg':
+        # JPEG 不支持透明通道, 与推理时读入的 RGB 图像一致
+        image.convert('RGB').save(output_path, "JPEG", quality=encoder['jpeg_quality'])
+    elif output_format == 'npy':
+        np.save(output_path, np.asarray(image))
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+    return output_path
+
+@dataclass(frozen=True)
+class ProcessOptions:
+    """
+    一次运行中所有视频共用的处理参数, 由命令行参数构建后原样交给每个视频的 process_file。
+    trace 为 True 时记录各处理阶段的耗时和读写字节数(否则计时记录为空列表)。
+    decoder 为流式流程使用的解码后端(见 video_decoders.DECODERS)。
+    bounded_memory 为 True 时流式流程将已完成的拼接行写入临时目录并分块缩放, 峰值内存与视频长度无关。
+    processed_video 为 True 时在 processed 文件夹中生成拼接方向的视频, stage_mode 为正放视频的暂存方式。
+    segments 大于 1 时流式流程将视频分为多段并行解码和拼接(有界内存模式下不分段), 结果与串行拼接相同。
+    """
+    model_folder: str = './models/'
+    pipeline: str = 'stream'
+    band_decode: bool = True
+    processed_video: bool = False
+    scratch_folder: str = None
+    min_height_step: float = None
+    decimate_tolerance: float = None
+    height_text: bool = False
+    encoder: dict = field(default_factory=encoder_options)
+    skip_intermediates: bool = False
+    trace: bool = False
+    decoder: str = 'ffmpeg'
+    bounded_memory: bool = False
+    stage_mode: str = 'auto'
+    segments: int = 1
+
+@dataclass
+class VideoTask:
+    """单个视频的输入文件、预先读取的平滑高度序列和各输出路径"""
+    file: str
+    height_file: str
+    pic_path: str
+    target_video_path: str
+    target_height_path: str
+    heights: object = None
+    # 分布式模式下为 (租约文件, 节点名称), 发布输出前确认本节点仍持有租约
+    lease: tuple = None
+    # 批量流程估算内存时已读取的帧数, 未读取时由 process_file 自行读取
+    frame_count: int = None
+
+    @property
+    def label(self):
+        return os.path.basename(self.file).split('.')[0]
+
+def process_file(task, options):
+    """
+    处理单个视频(task 为 VideoTask, options 为 ProcessOptions), 返回 (输出图像路径, 拼接方向的高度序列, 各阶段计时记录);
+    缺少高度数据时返回 None。task.heights 为预先从高度存储中读取的平滑高度序列, 未给出时读取 task.height_file 文本文件。
+    """
+    # Remove file extension
+    full_run_with_extension = task.file
+    full_path = Path(full_run_with_extension)
+    run = full_path.stem
+    trace = StageTrace(run, enabled=options.trace)
+
+    os.makedirs(task.pic_path, exist_ok=True)
 
-        # 强制拉伸到目标尺寸（LANCZOS 重采样保持质量）
-        resized = rgb_img.resize(target_size, Image.Resampling.LANCZOS)
+    FFMPEG = find_tool(options.model_folder, 'ffmpeg')
+    decoder = create_decoder(options.decoder, options.model_folder, options.band_decode)
+
+    line = f"Processing started for {run}"
+    print(line)
+
+    # Check if the height file exists
+    heights = task.heights
+    if heights is None:
+        if not os.path.exists(task.height_file):
+            line = f"Skipping {run} - height file does not exist"
+            print(line)
+            return
+
+        with trace.stage('read_heights'), open(task.height_file, 'r') as f:
+            heights = [float(line.strip()) for line in f.readlines()]
+    else:
+        heights = list(heights)
+
+    # Reverse video and heights if needed
+    reverse_video = heights[0] < heights[-1]
+    processed_heights = heights[::-1] if reverse_video else heights
+
+    # 按高度变化抽帧(仅流式流程): 在拼接方向的高度序列上选帧, 再换算为原视频中的帧序号
+    kept = None
+    frame_indices = None
+    if options.pipeline == 'stream' and options.min_height_step:
+        kept = select_frames(processed_heights, options.min_height_step)
+        frame_indices = sorted(len(heights) - 1 - k for k in kept) if reverse_video else kept
+
+    # 拼接方向(及抽帧结果)的高度序列, 由调用方写入 processed 高度存储, 供后续分析使用
+    spliced_heights = [processed_heights[index] for index in kept] if kept else processed_heights
+
+    # 仅在需要时生成 processed 视频; png 流程从拼接方向的视频中抽帧
+    spliced_video = full_run_with_extension
+    if options.processed_video:
+        with trace.stage('stage_video'):
+            stage_processed_video(FFMPEG, full_run_with_extension, task.target_video_path, reverse_video,
+                                  options.stage_mode)
+        spliced_video = task.target_video_path
+
+    # 每个视频使用独立的临时目录存放中间文件, 结束后整体删除
+    scratch_root = options.scratch_folder or full_path.parent
+    os.makedirs(scratch_root, exist_ok=True)
+    scratch_dir = Path(tempfile.mkdtemp(prefix=f"{run}_", dir=scratch_root))
+    scratch_run = scratch_dir / run
+
+    def spill_path(name):
+        # 有界内存拼接时, 已完成的拼接行写入临时目录
+        return scratch_dir / name if options.bounded_memory else None
+
+    def splice(frame_count, frame_indices=None, spill_name=None, trace=NULL_TRACE):
+        if options.segments > 1 and not options.bounded_memory:
+            # 各段在线程中同时解码和拼接, 整体计入 composite 阶段
+            with trace.stage('composite'):
+                return splice_video_segments(decoder, full_run_with_extension, row_width, frame_count,
+                                             options.segments, reverse=reverse_video, frame_indices=frame_indices)
+        return splice_video_stream(decoder, full_run_with_extension, row_width, frame_count, reverse=reverse_video,
+                                   frame_indices=frame_indices, trace=trace,
+                                   spill_path=spill_path(spill_name) if spill_name else None)
+
+    try:
+        # Splice the frames into a composite image
+        row_width = ROW_WIDTH
+        if options.pipeline == 'stream':
+            # 直接解码原始视频, 倒放方向在拼接时处理; 帧数仅用于预分配画布, 最终以实际解码的帧数为准
+            if frame_indices:
+                frame_count = len(frame_indices)
+            elif task.frame_count:
+                frame_count = task.frame_count
+            else:
+                # 与批量流程相同, 不逐帧解码计数, 无法读取帧数时按默认帧数预分配
+                with trace.stage('probe'):
+                    frame_count = probe_video_frames(decoder, full_run_with_extension)
+            composite_image = splice(frame_count, frame_indices, f"{run}_composite.rgb", trace)
+        else:
+            if reverse_video and not options.processed_video:
+                # 不保留 processed 视频时, 倒放的视频只写入临时目录
+                spliced_video = scratch_dir / f"{run}_reversed.mp4"
+                with trace.stage('stage_video'):
+                    run_command([FFMPEG, '-i', full_run_with_extension, '-vf', 'reverse', spliced_video])
+            composite_image = splice_video_png(FFMPEG, scratch_dir / full_path.name, spliced_video, row_width,
+                                               keep_intermediates=not options.skip_intermediates, trace=trace)
+
+        # resize and save the image
+        with trace.stage('resize'):
+            resized = resize_composite(composite_image)
+        # 释放拼接图(及其内存映射文件)
+        composite_image = None
+
+        # 抽帧容差检查: 与全部帧的拼接结果对比, 超出容差时改用全部帧的结果
+        if frame_indices and options.decimate_tolerance is not None:
+            with trace.stage('tolerance_check'):
+                full_image = splice(len(heights), spill_name=f"{run}_full.rgb")
+                full_resized = resize_composite(full_image)
+                full_image = None
+                difference = image_difference(resized, full_resized)
+            line = f"{run}: kept {len(frame_indices)}/{len(heights)} frames, mean difference {difference:.2f}"
+            print(line)
+            if difference > options.decimate_tolerance:
+                line = f"{run}: difference exceeds tolerance {options.decimate_tolerance}, using all frames"
+                print(line)
+                resized = full_resized
+                spliced_heights = processed_heights
 
         # 保存最终结果
-        resized.save(f"{full_run}.png", "PNG", optimize=True, quality=95)
-        
-    shutil.move(f'{full_run}.png', pic_path)
-    delete_file(f'{full_run}_raw.png')
+        with trace.stage('encode'):
+            saved_path = save_composite(resized, scratch_run, options.encoder)
+
+        # 租约已被其他节点回收时不发布输出, 由持有租约的节点写出
+        if task.lease and not holds_lease(*task.lease):
+            line = f"Discarding {run} - the lease was lost"
+            print(line)
+            return
+
+        with trace.stage('move'):
+            output_path = publish_file(saved_path, os.path.join(task.pic_path, os.path.basename(saved_path)))
+    finally:
+        with trace.stage('cleanup'):
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    # 仅在需要时额外写出文本格式的高度文件
+    if options.height_text:
+        with trace.stage('height_text'):
+            write_processed_heights(task.target_height_path, spliced_heights)
 
     line = f"Processing completed for {run}"
     print(line)
 
-def process_video_thread(video_path, height_path, projection_path, max_workers, model_folder):
+    return output_path, spliced_heights, trace.finish()
+
+def processing_params(options):
+    """清单中记录的、影响输出结果的处理参数"""
+    params = {'pipeline': options.pipeline, 'row_width': ROW_WIDTH, 'processed_video': options.processed_video,
+              'min_height_step': options.min_height_step, 'decimate_tolerance': options.decimate_tolerance,
+              'encoder': options.encoder}
+    # 不同解码后端的结果可能有少量像素差异
+    if options.pipeline == 'stream' and options.decoder != 'ffmpeg':
+        params['decoder'] = options.decoder
+    return params
+
+def video_task(file, heights, height_path, video_path, projection_path):
+    """组装单个视频的 VideoTask"""
+    label = os.path.basename(file).split('.')[0]
+    return VideoTask(file=file,
+                     height_file=os.path.join(height_path, 'smoothed', label + ".txt"),
+                     pic_path=projection_path,
+                     target_video_path=os.path.join(video_path, 'processed', label + ".mp4"),
+                     target_height_path=os.path.join(height_path, 'processed', label + ".txt"),
+                     heights=heights)
+
+def task_outputs(task, options):
+    """任务完成后应当存在的输出文件"""
+    outputs = [os.path.join(task.pic_path, Path(task.file).stem + OUTPUT_EXTENSIONS[options.encoder['format']])]
+    if options.processed_video:
+        outputs.append(task.target_video_path)
+    if options.height_text:
+        outputs.append(task.target_height_path)
+    return outputs
+
+class BatchState:
+    """
+    一次运行中所有样本共用的处理参数、批处理清单、高度存储和计时记录, 由 process_video_thread、watch_folders 和
+    process_video_shard 共用: 组装任务并按清单判断是否需要处理, 筛查新输入的高度文件, 记录完成的样本。
+    node 不为 None 时(分布式模式)清单、高度存储和计时记录按节点分片写入。
+    """
+    def __init__(self, video_path, height_path, projection_path, options, force=False, node=None):
+        self.video_path = video_path
+        self.height_path = height_path
+        self.projection_path = projection_path
+        self.options = options
+        self.force = force
+        self.raw_video_path = os.path.join(video_path, 'raw')
+        self.raw_height_path = os.path.join(height_path, 'raw')
+        self.smoothed_height_path = os.path.join(height_path, 'smoothed')
+        self.report_path = os.path.join(height_path, HEIGHT_REPORT_NAME)
+
+        self.params = processing_params(options)
+        os.makedirs(projection_path, exist_ok=True)
+        self.manifest = BatchManifest(projection_path, node=node)
+        self.smoothed_store = HeightStore(self.smoothed_height_path, node=node)
+        self.processed_store = HeightStore(os.path.join(height_path, 'processed'), node=node)
+        # 分布式模式下各节点的计时轨迹分别写入输出文件夹下的 trace/<node>
+        trace_folder = os.path.join(projection_path, 'trace', node) if node else projection_path
+        self.trace_writer = TraceWriter(trace_folder, enabled=options.trace)
+        # label -> 输入指纹; 高度文件缺失的样本没有指纹, 不写入清单
+        self.fingerprints = {}
+        self.smoothed_changed = False
+
+    def plan(self, file, heights):
+        """组装单个视频的任务, 高度已知时计算输入指纹; 样本已处理且输入、参数和输出均未变化时第二个返回值为 True"""
+        task = video_task(file, heights, self.height_path, self.video_path, self.projection_path)
+        if heights is None:
+            return task, False
+
+        label = task.label
+        self.fingerprints[label] = self.manifest.fingerprint(label, file, heights)
+        unchanged = not self.force and label in self.processed_store and \
+            self.manifest.is_up_to_date(label, self.fingerprints[label], self.params, task_outputs(task, self.options))
+        if unchanged:
+            line = f"Skipping {label} - already processed and unchanged"
+            print(line)
+        return task, unchanged
+
+    def ingest(self, label, video_file, height_file):
+        """
+        将一对新输入文件移入 raw 文件夹并筛查高度, 返回 (任务, 状态): 状态为 'queued' 时需要处理, 'unchanged' 表示已处理且未变化;
+        高度筛查未通过时任务为 None, 状态为筛查结果('abnormal' 或 'error')
+        """
+        raw_video_file = os.path.join(self.raw_video_path, os.path.basename(video_file))
+        raw_height_file = os.path.join(self.raw_height_path, os.path.basename(height_file))
+        # 分布式模式下扫描之后其他节点可能已移走了新文件, 此时直接使用 raw 中的文件
+        if os.path.exists(video_file) and video_file != raw_video_file:
+            os.replace(video_file, raw_video_file)
+        if os.path.exists(height_file) and height_file != raw_height_file:
+            os.replace(height_file, raw_height_file)
+
+        report = smooth_height_file(raw_height_file, self.smoothed_height_path, self.options.height_text)
+        if report['status'] != 'smoothed':
+            with open(self.report_path, 'a') as f:
+                f.write(json.dumps(report, ensure_ascii=False) + '\n')
+            line = f"Skipping {label} - height file is {report['status']}"
+            print(line)
+            return None, report['status']
+
+        self.smoothed_store.append(label, report['heights'])
+        self.smoothed_changed = True
+        task, unchanged = self.plan(raw_video_file, report['heights'])
+        return task, 'unchanged' if unchanged else 'queued'
+
+    def record(self, task, result):
+        """记录完成的样本(拼接方向的高度序列、清单和计时记录); 没有结果或没有输入指纹时返回 False"""
+        if not result or task.label not in self.fingerprints:
+            return False
+        output_path, spliced_heights, stage_records = result
+        self.processed_store.append(task.label, spliced_heights)
+        self.manifest.record(task.label, self.fingerprints[task.label], self.params, output_path)
+        self.trace_writer.write(stage_records)
+        return True
+
+    def done_record(self, task):
+        """分布式模式下写入租约的完成记录"""
+        return {'status': 'processed', **self.fingerprints[task.label], 'params': self.params,
+                'outputs': task_outputs(task, self.options)}
+
+    def close(self):
+        self.manifest.compact()
+        if self.smoothed_changed:
+            self.smoothed_store.compact()
+        self.processed_store.compact()
+        self.trace_writer.close()
+
+def collect_results(finished, running, state, on_success=None, on_failure=None, accept=None):
+    """
+    取回已完成的任务(running 为 future -> VideoTask)并由 state 记录结果;
+    记录成功时以任务调用 on_success, 出错或没有结果时调用 on_failure。
+    accept 对任务返回 False 时(如分布式模式下已失去租约)不记录结果, 按失败处理
+    """
+    for future in finished:
+        task = running.pop(future)
+        try:
+            result = future.result()
+        except Exception as e:
+            line = f"Error processing {task.label}: {e}"
+            print(line)
+            result = None
+        if result and accept and not accept(task):
+            line = f"Discarding the result of {task.label} - the lease was lost"
+            print(line)
+            result = None
+        if state.record(task, result):
+            if on_success:
+                on_success(task)
+        elif on_failure:
+            on_failure(task)
+
+def process_video_thread(video_path, height_path, projection_path, max_workers, options, executor='thread',
+                         memory_limit=None, force=False):
     smoothed_height_path = os.path.join(height_path, 'smoothed')
-    processed_height_path = os.path.join(height_path, 'processed')
 
     all_video_folder = video_path
     raw_video_path = os.path.join(all_video_folder, 'raw')
@@ -243,109 +1155,348 @@ def process_video_thread(video_path, height_path, projection_path, max_workers,
     def run():
         vid_path = raw_video_path
         all_files = [os.path.join(vid_path, f) for f in os.listdir(vid_path) if f.endswith(('.mp4', '.avi'))]
+
+        # 根据输出文件夹中的清单跳过输入和参数均未变化的样本
+        # 平滑高度序列从高度存储中一次性读取(缺失时退回到文本文件), 拼接方向的序列写入 processed 高度存储
+        state = BatchState(all_video_folder, height_path, projection_path, options, force)
+
         tasks = []
         for file in all_files:
             label = os.path.basename(file).split('.')[0]
-            height_file = os.path.join(smoothed_height_path, label + ".txt")
-
-            target_video_path = os.path.join(processed_video_path, label + ".mp4")
-            target_height_path = os.path.join(processed_height_path, label + ".txt")
-            tasks.append((file, height_file, projection_path, target_video_path, target_height_path, model_folder))
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_file = {executor.submit(process_file, *task): task[0] for task in tasks}
-
-            for future in as_completed(future_to_file):
-                file_name = future_to_file[future]
-                try:
-                    future.result()  # 等待任务完成，如果有异常，会在这里抛出
-                except Exception as e:
-                    line = f"Error processing {file_name}: {e}"
-                    print(line)
+            task, unchanged = state.plan(file, load_heights(smoothed_height_path, label, state.smoothed_store))
+            if not unchanged:
+                tasks.append(task)
+
+        # 通过容器元数据(不解码)并行读取帧数, 估算每个视频的峰值内存, 用于控制同时运行的任务数;
+        # 流式流程的帧数随任务传给 process_file, 不再重复读取
+        stream = options.pipeline == 'stream'
+        probe = create_decoder(options.decoder if stream else 'ffmpeg', options.model_folder, options.band_decode)
+        with ThreadPoolExecutor(max_workers=max_workers) as probe_pool:
+            frame_counts = list(probe_pool.map(lambda task: probe_video_frames(probe, task.file), tasks))
+        estimates = []
+        for task, frame_count in zip(tasks, frame_counts):
+            if stream:
+                task.frame_count = frame_count
+            estimates.append(estimate_video_memory(frame_count, pipeline=options.pipeline,
+                                                   bounded=options.bounded_memory and stream,
+                                                   segmented=options.segments > 1 and stream))
+
+        if memory_limit:
+            memory_budget = memory_limit * 1024 ** 3
+        else:
+            memory_budget = psutil.virtual_memory().available * 0.8
+
+        # 线程池适用于以解码为主的任务; 进程池可绕开 GIL 让裁剪、拼接和缩放真正并行
+        with create_pool(executor, max_workers) as pool:
+            run_admitted_tasks(pool, tasks, options, estimates, max_workers, memory_budget, on_success=state.record)
+        state.close()
 
         line = "All video processing complete!"
         print(line)
 
     run()
 
+def watch_folders(video_path, height_path, projection_path, max_workers, options, executor='thread', force=False,
+                  settle_time=2.0, poll_interval=1.0):
+    """
+    持续监视视频和高度文件夹: 每当一对同名的视频与高度文件写入完成, 立即筛查该高度文件并将视频交给有界的进程/线程池处理,
+    合成图像在每个视频完成时输出。按 Ctrl+C 停止, 停止前会等待正在处理的视频完成。
+    """
+    for folder in (os.path.join(video_path, 'raw'), os.path.join(video_path, 'processed'),
+                   os.path.join(height_path, 'raw'), os.path.join(height_path, 'smoothed'),
+                   os.path.join(height_path, 'processed'), projection_path):
+        os.makedirs(folder, exist_ok=True)
+
+    state = BatchState(video_path, height_path, projection_path, options, force)
+    queued = deque()
+    running = {}
+    with create_pool(executor, max_workers) as pool, \
+            PairWatcher(video_path, height_path, settle_time, poll_interval) as watcher:
+        line = f"Watching {video_path} and {height_path} ({watcher.mode}), press Ctrl+C to stop"
+        print(line)
+
+        try:
+            while True:
+                for label, video_file, height_file in watcher.ready_pairs():
+                    try:
+                        task, status = state.ingest(label, video_file, height_file)
+                    except Exception as e:
+                        line = f"Error when ingesting {label}: {e}"
+                        print(line)
+                        continue
+                    if status == 'queued':
+                        queued.append(task)
+
+                # 同时处理的视频数不超过 max_workers, 其余在队列中等待
+                while queued and len(running) < max_workers:
+                    task = queued.popleft()
+                    future = pool.submit(process_file, task, options)
+                    future.add_done_callback(lambda _: watcher.wake())
+                    running[future] = task
+
+                collect_results([future for future in running if future.done()], running, state)
+                watcher.wait()
+        except KeyboardInterrupt:
+            line = f"Stopping - waiting for {len(running)} running videos ({len(queued)} queued videos are left in raw)"
+            print(line)
+            collect_results(list(wait(running).done) if running else [], running, state)
+        finally:
+            state.close()
+
+def shard_order(labels, node):
+    """按节点名旋转样本顺序, 多个节点同时启动时从不同位置开始领取, 减少租约冲突"""
+    labels = sorted(labels)
+    if not labels:
+        return labels
+    start = int(hashlib.sha256(node.encode()).hexdigest(), 16) % len(labels)
+    return labels[start:] + labels[:start]
+
+def process_video_shard(video_path, height_path, projection_path, max_workers, options, node, lease_ttl=300.0,
+                        executor='thread', force=False, poll_interval=5.0):
+    """
+    分布式模式: 多台机器(或同一台机器上的多个进程)以不同的 node 名称同时运行, 共用网络文件夹中的视频、高度和输出文件夹。
+    每个样本在处理前先获取租约(见 leases.py), 只有持有租约的节点会移动输入文件并处理该样本;
+    清单和高度存储按节点分片写入, 读取时自动合并。所有样本都已完成且其他节点不再持有有效租约时退出。
+    """
+    raw_video_path = os.path.join(video_path, 'raw')
+    raw_height_path = os.path.join(height_path, 'raw')
+    for folder in (raw_video_path, os.path.join(video_path, 'processed'), raw_height_path,
+                   os.path.join(height_path, 'smoothed'), os.path.join(height_path, 'processed'), projection_path):
+        os.makedirs(folder, exist_ok=True)
+
+    state = BatchState(video_path, height_path, projection_path, options, force, node=node)
+    params = state.params
+    started = time.time()
+    # 本节点处理失败的样本不再重试, 留给其他节点或下一次运行
+    failed = set()
+
+    def candidates():
+        """label -> (视频文件, 高度文件, 是否为新输入); 顶层文件夹中的新文件优先于 raw 中的同名文件"""
+        raw_videos = list_files(raw_video_path, ('.mp4', '.avi'))
+        raw_heights = list_files(raw_height_path, ('.txt',))
+        new_videos = list_files(video_path, ('.mp4', '.avi'))
+        new_heights = list_files(height_path, ('.txt',))
+
+        pairs = {}
+        for label in set(raw_videos) | set(new_videos):
+            video_file = new_videos.get(label) or raw_videos[label]
+            height_file = new_heights.get(label) or raw_heights.get(label)
+            if height_file is not None:
+                pairs[label] = (video_file, height_file, label in new_videos or label in new_heights)
+        return pairs
+
+    def is_finished(record, new_input):
+        """完成记录对应当前的输入和参数且输出仍然存在时返回 True"""
+        if new_input or record.get('params') != params:
+            return False
+        if force and record.get('time', 0) < started:
+            return False
+        return all(os.path.exists(output) for output in record.get('outputs', []))
+
+    running = {}
+    interrupted = False
+
+    def fail(task):
+        failed.add(task.label)
+        leases.release(task.label)
+
+    def finish(task):
+        # 清单和高度写入完成后才将租约改写为完成记录
+        leases.complete(task.label, state.done_record(task))
+
+    def owned(task):
+        # 已失去租约的样本由回收租约的节点处理, 本节点不写入清单和高度存储
+        return leases.owns(task.label)
+
+    leases = LeaseDirectory(projection_path, node, lease_ttl)
+    line = f"Node {node} started on {video_path} (lease timeout {lease_ttl:.0f} s)"
+    print(line)
+    try:
+        with create_pool(executor, max_workers) as pool, leases:
+            try:
+                while True:
+                    pairs = candidates()
+                    saturated = False
+                    for label in shard_order(pairs, node):
+                        if label in failed or label in leases.held:
+                            continue
+                        if len(running) >= max_workers:
+                            saturated = True
+                            break
+
+                        video_file, height_file, new_input = pairs[label]
+                        claimed, record = leases.claim(label)
+                        if not claimed and record is not None and record.get('state') == 'done':
+                            if is_finished(record, new_input):
+                                continue
+                            claimed = leases.reclaim_done(label)
+                        if not claimed:
+                            # 其他节点正在处理
+                            continue
+
+                        # 持有租约后才移动输入文件并筛查高度; 不需要处理的样本直接写入完成记录
+                        try:
+                            task, status = state.ingest(label, video_file, height_file)
+                            if status == 'unchanged':
+                                leases.complete(label, state.done_record(task))
+                            elif status != 'queued':
+                                leases.complete(label, {'status': status, 'params': params, 'outputs': []})
+                        except Exception as e:
+                            line = f"Error when preparing {label}: {e}"
+                            print(line)
+                            failed.add(label)
+                            leases.release(label)
+                            continue
+                        if status == 'queued':
+                            task.lease = (leases.path(label), node)
+                            running[pool.submit(process_file, task, options)] = task
+
+                    if running:
+                        finished = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED).done
+                        collect_results(finished, running, state, on_success=finish, on_failure=fail,
+                                        accept=owned)
+                    elif not saturated:
+                        # 其他节点仍持有有效租约时继续等待, 以便在其崩溃后回收其样本
+                        if not leases.active():
+                            break
+                        time.sleep(poll_interval)
+            except KeyboardInterrupt:
+                # 停止领取新样本, 等待正在处理的视频完成并写入清单和完成记录; 未完成的租约退出时释放
+                interrupted = True
+                line = f"Node {node} stopping - waiting for {len(running)} running videos"
+                print(line)
+                collect_results(list(wait(running).done) if running else [], running, state, on_success=finish,
+                                on_failure=fail, accept=owned)
+    finally:
+        state.close()
+
+    if interrupted:
+        line = f"Node {node}: stopped"
+    else:
+        line = f"Node {node}: all video processing complete!"
+    print(line)
+
 ################################################## 高度信息筛查部分 #######################################################
-def check_abnormal_file(data, file_name):
-    # 计数每个数字出现的次数
-    count = Counter(data)
-    # 初始化判断文件是否无效的参数
-    check = True
-    # 检查是否有任何数字出现次数超过100
-    for number, frequency in count.items():
-        if frequency > 100:
-            print(f"文件 {file_name} 中数字 {number} 出现了 {frequency} 次，可能异常。")
-            check = False
-            break  # 跳出循环
+HEIGHT_REPORT_NAME = 'abnormal_heights.jsonl'
+
+def find_abnormal_patterns(data):
+    """返回高度数据中的异常模式列表, 空列表表示数据正常"""
+    data = np.asarray(data, dtype=float)
+    reasons = []
+
+    # 检查是否有任何数字出现次数超过100(多个时取最先出现的数字)
+    values, first_index, counts = np.unique(data, return_index=True, return_counts=True)
+    frequent = np.nonzero(counts > 100)[0]
+    if frequent.size:
+        k = frequent[np.argmin(first_index[frequent])]
+        reasons.append({'check': 'frequency', 'value': float(values[k]), 'count': int(counts[k])})
 
     # 检查开头是否有连续出现 30 次以上的相同数字
-    if len(data) >= 30:
-        first_number = data[0]
-        if all(data[i] == first_number for i in range(30)):
-            print(f"文件 {file_name} 的头部数字 {first_number} 连续出现 30 次以上，可能异常。")
-            check = False
+    if len(data) >= 30 and np.all(data[:30] == data[0]):
+        reasons.append({'check': 'head_repeat', 'value': float(data[0]), 'count': 30})
 
     # 检查结尾是否有连续出现 50 次以上的相同数字
-    if len(data) >= 50:
-        last_number = data[-1]
-        if all(data[-i-1] == last_number for i in range(50)):
-            print(f"文件 {file_name} 的尾部数字 {last_number} 连续出现 50 次以上，可能异常。")
-            check = False
+    if len(data) >= 50 and np.all(data[-50:] == data[-1]):
+        reasons.append({'check': 'tail_repeat', 'value': float(data[-1]), 'count': 50})
+
+    return reasons
 
-    return check
+def check_abnormal_file(data, file_name):
+    reasons = find_abnormal_patterns(data)
+    for reason in reasons:
+        if reason['check'] == 'frequency':
+            print(f"文件 {file_name} 中数字 {reason['value']} 出现了 {reason['count']} 次，可能异常。")
+        elif reason['check'] == 'head_repeat':
+            print(f"文件 {file_name} 的头部数字 {reason['value']} 连续出现 30 次以上，可能异常。")
+        else:
+            print(f"文件 {file_name} 的尾部数字 {reason['value']} 连续出现 50 次以上，可能异常。")
+
+    return not reasons
 
 def replace_abnormal_data(data):
     #  先确定数据变化趋势，再将违反正常变化趋势的点清除
-    replaced_data = []
+    data = np.asarray(data, dtype=float)
     # 通过比较起止位置大小多个数值的中位数(避免单个的数据异常情况)，来判断相机是上升还是下降
-    start_position_median = statistics.median(data[0:4])
-    end_position_median = statistics.median(data[-5:-1])
-    replaced_data.append(data[0])
+    start_position_median = statistics.median(data[0:4].tolist())
+    end_position_median = statistics.median(data[-5:-1].tolist())
 
-    # 将违反数据变化趋势的点出
+    # 将违反数据变化趋势的点标为 NaN
     if start_position_median > end_position_median:
-        for i in range(len(data) - 1):
-            if data[i] > data[i + 1]:
-                replaced_data.append(data[i + 1])
-            else:
-                replaced_data.append(np.nan)
+        keep = data[:-1] > data[1:]
     elif start_position_median < end_position_median:
-        for i in range(len(data) - 1):
-            if data[i] < data[i + 1]:
-                replaced_data.append(data[i + 1])
-            else:
-                replaced_data.append(np.nan)
-
+        keep = data[:-1] < data[1:]
     # 如果数据开头和结尾(全程)保持一致，说明距离传感器异常，该样本全部标为NA
     else:
-        for i in range(len(data) - 1):
-            replaced_data.append(np.nan)
+        keep = np.zeros(len(data) - 1, dtype=bool)
+
+    replaced_data = np.empty_like(data)
+    replaced_data[0] = data[0]
+    replaced_data[1:] = np.where(keep, data[1:], np.nan)
 
     return replaced_data
 
 def fill_nan(data):
+    data = np.asarray(data, dtype=float)
     nan_indices = np.isnan(data)
     indices = np.arange(len(data))
     # 找到非缺失值的索引和值
     non_nan_indices = indices[~nan_indices]
-    non_nan_values = np.array(data)[~nan_indices]
-    # 创建插值函数
-    interp_func = interp1d(non_nan_indices, non_nan_values, kind='linear', fill_value='extrapolate')
-    # 生成插值后的完整数据
-    filled_values = interp_func(indices)
-    # 找到最后一个非NaN值的索引
-    last_valid_index = np.max(non_nan_indices)
+    non_nan_values = data[~nan_indices]
+    if len(non_nan_indices) < 2:
+        # 只有一个有效值时无法确定斜率, 与原 interp1d 的结果一致, 全部为 NaN
+        return np.full(len(data), np.nan)
+
+    # 线性插值(含外推), 与 scipy interp1d(kind='linear') 的计算方式逐位一致
+    hi = np.clip(np.searchsorted(non_nan_indices, indices), 1, len(non_nan_indices) - 1)
+    lo = hi - 1
+    slope = (non_nan_values[hi] - non_nan_values[lo]) / (non_nan_indices[hi] - non_nan_indices[lo])
+    filled_values = slope * (indices - non_nan_indices[lo]) + non_nan_values[lo]
+
     # 如果有缺失值在末尾，替换末尾的NaN值为最后一个有效值
     if nan_indices[-1]:
-        last_valid_value = filled_values[non_nan_indices[-1]]  # 获取最后一个有效插值值
-        filled_values[last_valid_index:] = last_valid_value  # 替换末端所有NaN为最后一个有效值
+        last_valid_index = non_nan_indices[-1]
+        filled_values[last_valid_index:] = filled_values[last_valid_index]
 
     return filled_values
 
-def filter_heights(height_path):
+def smooth_height_file(height_file_path, smoothed_height_path, write_text=False):
+    """筛查并平滑单个高度文件, 返回该文件的筛查报告(平滑成功时附带平滑后的序列)"""
+    file_label = os.path.basename(height_file_path).split('.')[0]
+    try:
+        # 从txt文件中读取距离数据
+        heights = np.loadtxt(height_file_path, dtype=float, ndmin=1)
+
+        # 检查文件是否异常
+        if not check_abnormal_file(heights, file_label):
+            return {'label': file_label, 'status': 'abnormal', 'reasons': find_abnormal_patterns(heights)}
+
+        # 替换差异过大的值
+        replaced_heights = replace_abnormal_data(heights)
+        # 有效值少于两个时无法拟合, 平滑结果全部为 NaN, 同样视为异常文件
+        valid_count = int(np.count_nonzero(~np.isnan(replaced_heights)))
+        if valid_count < 2:
+            line = f"文件 {file_label} 中只有 {valid_count} 个有效数值，无法平滑，可能异常。"
+            print(line)
+            reasons = [{'check': 'valid_values', 'count': valid_count}]
+            return {'label': file_label, 'status': 'abnormal', 'reasons': reasons}
+        # 拟合数据补齐缺失值, 保留一位小数
+        filled_heights = np.round(fill_nan(replaced_heights), 1)
+        if write_text:
+            # 将列表中的数据转换为字符串形式，每个元素一行
+            data_str = '\n'.join(map(str, filled_heights))
+            # 指定要保存的文件名
+            file_name = os.path.join(smoothed_height_path, file_label + '.txt')
+            # 将数据写入文件
+            with open(file_name, 'w') as file:
+                file.write(data_str)
+    except Exception as e:
+        line = f"Error processing {height_file_path}: {e}"
+        print(line)
+        return {'label': file_label, 'status': 'error', 'error': str(e)}
+
+    return {'label': file_label, 'status': 'smoothed', 'heights': filled_heights}
+
+def filter_heights(height_path, max_workers=None, write_text=False):
     all_height_folder = height_path
     raw_height_path = os.path.join(all_height_folder, 'raw')
     smoothed_height_path = os.path.join(all_height_folder, 'smoothed')
@@ -365,36 +1516,30 @@ def filter_heights(height_path):
             line = f"Error when moving {file_path}: {e}"
             print(line)
 
-    height_file_paths = glob.glob(os.path.join(raw_height_path, '*.txt'))
-    for height_file_path in sorted(height_file_paths):
-        try:
-            # 从txt文件中读取距离数据
-            with open(height_file_path, 'r') as file:
-                heights = [float(line.strip()) for line in file.readlines()]
-
-            file_label = os.path.basename(height_file_path).split('.')[0]
-            # 检查文件是否异常
-            check = check_abnormal_file(heights, file_label)
-
-            if check:
-                # 替换差异过大的值
-                replaced_heights = replace_abnormal_data(heights)
-                # 拟合数据补齐缺失值
-                filled_heights = fill_nan(replaced_heights)
-                # 将列表中的数据转换为字符串形式，每个元素一行
-                data_str = '\n'.join(str(round(x, 1)) for x in filled_heights)
-                # 指定要保存的文件名
-                file_name = os.path.join(smoothed_height_path, file_label + '.txt')
-                # 将数据写入文件
-                with open(file_name, 'w') as file:
-                    file.write(data_str)
-            else:
-                continue
-        except Exception as e:
-            line = f"Error processing {height_file_path}: {e}"
-            print(linee)
-
-    line = f"All smoothed height files are saved to : {smoothed_height_path}."
+    # 多进程并行筛查, 每个进程一次领取一批文件以减少调度开销
+    height_file_paths = sorted(glob.glob(os.path.join(raw_height_path, '*.txt')))
+    max_workers = max_workers or os.cpu_count()
+    chunksize = max(1, len(height_file_paths) // (max_workers * 4))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        reports = list(executor.map(smooth_height_file, height_file_paths,
+                                    [smoothed_height_path] * len(height_file_paths),
+                                    [write_text] * len(height_file_paths), chunksize=chunksize))
+
+    # 平滑后的序列统一写入二进制高度存储
+    write_store(smoothed_height_path, {entry['label']: entry['heights'] for entry in reports
+                                       if entry['status'] == 'smoothed'})
+
+    # 异常及出错文件的筛查报告(JSON Lines), 便于后续程序读取
+    report_path = os.path.join(all_height_folder, HEIGHT_REPORT_NAME)
+    with open(report_path, 'w') as report:
+        for entry in reports:
+            if entry['status'] != 'smoothed':
+                report.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    if write_text:
+        line = f"All smoothed height files are saved to : {smoothed_height_path}."
+    else:
+        line = f"All smoothed heights are saved to the height store : {store_paths(smoothed_height_path)[0]}."
     print(line)
 
 if __name__ == "__main__":
@@ -411,12 +1556,88 @@ if __name__ == "__main__":
     parser.add_argument('-c', '--thread', default=5, type=int, required=False,
                         help='Number of cores used for parallel processing')
     parser.add_argument('-o', '--output_folder', default='./images/', type=str, required=False, help='Output folder')
+    parser.add_argument('-p', '--pipeline', default='stream', choices=['stream', 'png'], required=False,
+                        help='Frame pipeline: decode and splice frames in memory (stream) or via PNG intermediates (png)')
+    parser.add_argument('--band_decode', default=True, action=argparse.BooleanOptionalAction,
+                        help='Crop the central band inside the decoder so only those rows are transferred (stream pipeline)')
+    parser.add_argument('--decoder', default='ffmpeg', choices=list(DECODERS), required=False,
+                        help='Frame decoder of the stream pipeline: ffmpeg subprocess, or in-process OpenCV / PyAV')
+    parser.add_argument('--bounded_memory', default=False, action='store_true',
+                        help='Spill finished composite rows to the scratch folder and resize in tiles, so memory per '
+                             'video does not grow with the clip length (stream pipeline)')
+    parser.add_argument('--segments', default=1, type=int, required=False,
+                        help='Split each video into this many segments that are decoded and spliced in parallel, with '
+                             'a bit-identical result (stream pipeline, ignored with --bounded_memory)')
+    parser.add_argument('--processed_video', default=None, action=argparse.BooleanOptionalAction,
+                        help='Write the video in splicing direction to the processed folder '
+                             '(default is on for the png pipeline and off for the stream pipeline)')
+    parser.add_argument('--stage_mode', default='auto', choices=STAGE_MODES, required=False,
+                        help='How forward videos are staged into the processed folder: hardlink, reflink or symlink '
+                             'instead of a full copy (auto tries hardlink then reflink); falls back to copy')
+    parser.add_argument('-e', '--executor', default='thread', choices=['thread', 'process'], required=False,
+                        help='Parallel backend used for the videos: thread pool or process pool')
+    parser.add_argument('--memory_limit', default=None, type=float, required=False,
+                        help='Memory budget in GB shared by running videos (default is 80%% of the available memory)')
+    parser.add_argument('-s', '--scratch_folder', default=None, type=str, required=False,
+                        help='Folder for per-video temporary files, e.g. /dev/shm (default is the raw video folder)')
+    parser.add_argument('-f', '--force', default=False, action='store_true',
+                        help='Reprocess every video even if the manifest shows it is up to date')
+    parser.add_argument('--min_height_step', default=None, type=float, required=False,
+                        help='Leave frames whose height changed less than this since the last kept frame out of the '
+                             'composite; intra-only videos (MJPG) skip decoding them (stream pipeline)')
+    parser.add_argument('--decimate_tolerance', default=None, type=float, required=False,
+                        help='Also build the all-frame composite and fall back to it when the mean pixel difference '
+                             'of the decimated one exceeds this value')
+    parser.add_argument('--height_text', default=False, action='store_true',
+                        help='Also write smoothed and processed heights as text files next to the binary height store')
+    parser.add_argument('-x', '--output_format', default='png', choices=list(OUTPUT_EXTENSIONS), required=False,
+                        help='Composite encoder: optimized PNG (png), fixed-level PNG (png_fast), lossless WebP (webp), '
+                             'JPEG (jpeg) or the raw RGB pixels as a 1440x640x3 uint8 array (npy)')
+    parser.add_argument('--png_level', default=1, type=int, choices=range(10), metavar='0-9', required=False,
+                        help='zlib compression level used by png_fast')
+    parser.add_argument('--jpeg_quality', default=95, type=int, required=False, help='Quality used by jpeg')
+    parser.add_argument('--skip_intermediates', default=False, action='store_true',
+                        help='Do not write the pre-resize composite PNGs (png pipeline)')
+    parser.add_argument('-t', '--trace', default=False, action='store_true',
+                        help='Record per-stage wall time, CPU time and bytes read/written of every video '
+                             '(stage_trace.jsonl and stage_summary.json in the output folder)')
+    parser.add_argument('-w', '--watch', default=False, action='store_true',
+                        help='Keep running and process each video/height pair as soon as it has been fully written')
+    parser.add_argument('--settle_time', default=2.0, type=float, required=False,
+                        help='Seconds a video/height pair must stay unchanged before it is processed (watch mode)')
+    parser.add_argument('--poll_interval', default=1.0, type=float, required=False,
+                        help='Seconds between folder scans when file events are unavailable (watch mode)')
+    parser.add_argument('-n', '--node', default=None, nargs='?', const=default_node_name(), type=str, required=False,
+                        help='Run as one of several nodes sharing the folders: videos are claimed through lease files '
+                             'in OUTPUT_FOLDER/.leases (name defaults to <hostname>-<pid>)')
+    parser.add_argument('--lease_ttl', default=300.0, type=float, required=False,
+                        help='Seconds without a heartbeat after which the lease of a crashed node is reclaimed')
 
     # Parse the arguments
     args = parser.parse_args()
 
     max_workers = args.thread
-
-    # 处理视频之前，先对高度信息文件进行筛选
-    filter_heights(args.height_folder)
-    process_video_thread(args.video_folder, args.height_folder, args.output_folder, max_workers, args.model_folder)
+    # png 流程默认保留 processed 视频(原有行为)
+    if args.processed_video is None:
+        args.processed_video = args.pipeline == 'png'
+    options = ProcessOptions(
+        model_folder=args.model_folder, pipeline=args.pipeline, band_decode=args.band_decode,
+        processed_video=args.processed_video, scratch_folder=args.scratch_folder,
+        min_height_step=args.min_height_step, decimate_tolerance=args.decimate_tolerance,
+        height_text=args.height_text, encoder=encoder_options(args.output_format, args.png_level, args.jpeg_quality),
+        skip_intermediates=args.skip_intermediates, trace=args.trace, decoder=args.decoder,
+        bounded_memory=args.bounded_memory, stage_mode=args.stage_mode, segments=args.segments)
+
+    if args.node:
+        # 分布式模式: 与其他节点共享文件夹, 通过租约领取视频
+        process_video_shard(args.video_folder, args.height_folder, args.output_folder, max_workers, options,
+                            args.node, args.lease_ttl, args.executor, args.force)
+    elif args.watch:
+        # 持续监视模式: 每对文件到达后分别筛查和处理
+        watch_folders(args.video_folder, args.height_folder, args.output_folder, max_workers, options,
+                      args.executor, args.force, args.settle_time, args.poll_interval)
+    else:
+        # 处理视频之前，先对高度信息文件进行筛选
+        filter_heights(args.height_folder, max_workers, args.height_text)
+        process_video_thread(args.video_folder, args.height_folder, args.output_folder, max_workers, options,
+                             args.executor, args.memory_limit, args.force)
@@ -1,55 +1,90 @@
 # 定义函数
-def polygon_to_bbox(polygon):
-    # Convert polygon to bounding box
-    x_coords, y_coords = zip(*polygon)
-    min_x, max_x = min(x_coords), max(x_coords)
-    min_y, max_y = min(y_coords), max(y_coords)
-    w = round(max_x - min_x, 7)
-    h = round(max_y - min_y, 7)
-
-    return min_y, max_y, h, min_x, max_x, w
-
-
-def process_label_file(label_file):
+def polygon_geometry(polygons):
+    """
+    批量计算多边形的外接框范围和面积加权重心(鞋带公式), 所有多边形的点拼接为一个数组后按段求和, 不逐个构造几何对象。
+    返回 (min_y, max_y, min_x, max_x, centroid_x, centroid_y) 六个数组; 面积为 0 的多边形与 shapely 一致,
+    退回到各边长度加权的中点, 边长也为 0 时取各点的平均值。
+    """
+    counts = np.array([len(polygon) for polygon in polygons])
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    points = np.concatenate(polygons)
+
+    # 以每个多边形的首点为原点, 减少浮点误差
+    origin = np.repeat(points[starts], counts, axis=0)
+    x, y = (points - origin).T
+    # 每个点的下一个点, 最后一点与首点闭合
+    following = np.arange(len(points)) + 1
+    following[starts + counts - 1] = starts
+    x1, y1 = x[following], y[following]
+
+    cross = x * y1 - x1 * y
+    area2 = np.add.reduceat(cross, starts)
+    lengths = np.hypot(x1 - x, y1 - y)
+    total_length = np.add.reduceat(lengths, starts)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        area_x = np.add.reduceat((x + x1) * cross, starts) / (3 * area2)
+        area_y = np.add.reduceat((y + y1) * cross, starts) / (3 * area2)
+        line_x = np.add.reduceat((x + x1) * lengths, starts) / (2 * total_length)
+        line_y = np.add.reduceat((y + y1) * lengths, starts) / (2 * total_length)
+    point_x = np.add.reduceat(x, starts) / counts
+    point_y = np.add.reduceat(y, starts) / counts
+
+    centroid_x = np.where(area2 != 0, area_x, np.where(total_length > 0, line_x, point_x)) + points[starts, 0]
+    centroid_y = np.where(area2 != 0, area_y, np.where(total_length > 0, line_y, point_y)) + points[starts, 1]
+
+    return (np.minimum.reduceat(points[:, 1], starts), np.maximum.reduceat(points[:, 1], starts),
+            np.minimum.reduceat(points[:, 0], starts), np.maximum.reduceat(points[:, 0], starts),
+            centroid_x, centroid_y)
+
+
+def read_label_polygons(label_file):
+    """
+    读取 YOLO 分割标签文件, 每行为 "类别 x1 y1 x2 y2 ..."(归一化坐标)。
+    返回 (类别列表, 多边形点坐标数组列表), 无法解析的行被跳过。
+    """
     # 读取标签文件
     with open(label_file, 'r') as infile:
         lines = infile.read().splitlines()
 
-    # 创建空列表已保存bbox内容
-    bounding_boxes_data = []
-    i = 0
-    for line in lines:
+    categories = []
+    polygons = []
+    for i, line in enumerate(lines):
         try:
-            data = line.split()
             # 0--auricle; 1--ear; 2--tassel
-            category = data[0]
-            polygon = []
-            # 正确设置读取点的区间
-            for i in range(1, len(data) - 1, 2):
-                x = float(data[i])
-                y = float(data[i + 1])
-                polygon.append((x, y))
-
-            # 把所有信息打包成元组, *号的作用是解包
-            # 将点格式转换为多边形格式
-            converted_polygon = Polygon(polygon)
-            bbox = tuple((category, *polygon_to_bbox(polygon), converted_polygon))
-
-            i = i + 1
-
-            bounding_boxes_data.append(bbox)
-        except:
-            print(label_file + str(i) + "行出现问题！" + str(lines[i]))
-            i = i + 1
+            data = line.split(maxsplit=1)
+            if len(data) < 2:
+                raise ValueError("no polygon")
+            category, coordinates = data
+            values = np.array(coordinates.split(), dtype=float)
+            # 坐标个数为奇数时舍弃最后一个值
+            polygon = values[:len(values) // 2 * 2].reshape(-1, 2)
+            if len(polygon) < 3:
+                raise ValueError("a polygon needs at least 3 points")
+        except ValueError:
+            print(label_file + str(i) + "行出现问题！" + line)
             continue
 
-    return bounding_boxes_data
+        categories.append(category)
+        polygons.append(polygon)
 
+    return categories, polygons
 
-def get_height_from_y(y, heights):
-    # 将图像的 y 坐标转换为实际高度
-    height_index = int(y * len(heights))
-    return float(heights[height_index]) / 10
+
+def process_label_file(label_file):
+    """返回标签文件中每个目标的 (类别, min_y, max_y, h, min_x, max_x, w, 重心 y) 元组"""
+    categories, polygons = read_label_polygons(label_file)
+    if not polygons:
+        return []
+
+    # 把所有信息打包成元组
+    bounding_boxes_data = []
+    for category, min_y, max_y, min_x, max_x, _, centroid_y in zip(categories, *polygon_geometry(polygons)):
+        bbox = (category, float(min_y), float(max_y), round(float(max_y - min_y), 7),
+                float(min_x), float(max_x), round(float(max_x - min_x), 7), float(centroid_y))
+        bounding_boxes_data.append(bbox)
+
+    return bounding_boxes_data
 
 
 def leaf_imputate(leaf_height_list, tassel_bottom_height, ear_height, remove_ratio=0.3, impute_ratio=1.7,
@@ -123,6 +158,7 @@ def leaf_imputate(leaf_height_list, tassel_bottom_height, ear_height, remove_rat
 def extract_plant_architecture_data(label_file):
     """
     根据所获取到的label，提取植株结构数据信息
+    (逐株的参考实现; 分析流程使用结果相同的批量引擎 extract_architecture_batch)
     """
     # 检测这一帧文件是否存在---模型是否在这一帧检测到了目标物
     file_exists = os.path.isfile(label_file)
@@ -153,16 +189,14 @@ def extract_plant_architecture_data(label_file):
 
             elif category == 1:  # 如果该bbox是雌穗的话
                 # 获取穗多边形的重心高记下
-                polygon = bbox[7]
-                ear_height_i = polygon.centroid.y
+                ear_height_i = bbox[7]
                 ear_bottom_i = bbox[2]
                 ear_data = {'index': i, 'ear_height': ear_height_i, 'ear_bottom': ear_bottom_i}
                 plant_architecture_data['ear'].append(ear_data)
 
             elif category == 0:  # 如果该bbox是叶节点的话
                 # 获取叶节点的重心高记下
-                polygon = bbox[7]
-                leaf_height_i = polygon.centroid.y
+                leaf_height_i = bbox[7]
                 leaf_data = {'index': i, 'leaf_height': leaf_height_i}
                 plant_architecture_data['auricle'].append(leaf_data)
             else:
@@ -227,16 +261,294 @@ def save_results_to_json(label, tassel_height, processed_leaf_heights, ear_heigh
     except:
         return None
 
+# 批量引擎中每个目标的记录: 所属植株(在本批中的序号)、在该植株标签文件中的序号、类别、多边形的顶端 y、底端 y 和重心 y
+DETECTION_DTYPE = [('plant', 'i8'), ('index', 'i8'), ('category', 'i8'), ('top', 'f8'), ('bottom', 'f8'),
+                   ('centroid', 'f8')]
+
+
+def load_detections(label_files):
+    """
+    读取多个植株的标签文件, 返回 (按植株和文件中的顺序排列的目标记录数组, 各植株的标签文件是否存在);
+    所有多边形的几何量一次计算。
+    """
+    found = np.array([os.path.isfile(label_file) for label_file in label_files], dtype=bool)
+    plants, indices, categories, polygons = [], [], [], []
+    for plant in np.flatnonzero(found):
+        file_categories, file_polygons = read_label_polygons(label_files[plant])
+        plants += [plant] * len(file_polygons)
+        indices += range(len(file_polygons))
+        categories += [int(category) for category in file_categories]
+        polygons += file_polygons
+
+    detections = np.zeros(len(polygons), dtype=DETECTION_DTYPE)
+    if polygons:
+        min_y, max_y, _, _, _, centroid_y = polygon_geometry(polygons)
+        detections['plant'], detections['index'], detections['category'] = plants, indices, categories
+        detections['top'], detections['bottom'], detections['centroid'] = min_y, max_y, centroid_y
+    return detections, found
+
+
+def group_bounds(groups, group_count):
+    """已按组号排序的数组中各组的起始位置和元素个数"""
+    counts = np.bincount(groups, minlength=group_count)
+    return np.cumsum(counts) - counts, counts
+
+
+def grouped_median(values, groups, group_count):
+    """按组求中位数(与逐组调用 np.median 的结果相同), 空组为 NaN"""
+    order = np.lexsort((values, groups))
+    values = values[order]
+    starts, counts = group_bounds(groups[order], group_count)
+    median = np.full(group_count, np.nan)
+    present = counts > 0
+    low = starts[present] + (counts[present] - 1) // 2
+    high = starts[present] + counts[present] // 2
+    median[present] = (values[low] + values[high]) / 2
+    return median
+
+
+def impute_leaves_batch(leaf_plants, leaf_heights, tassel_bottom_height, ear_height, remove_ratio=0.3, impute_ratio=1.7,
+                        edge_impute_ratio=1.15):
+    """
+    leaf_imputate 的批量版本: leaf_plants / leaf_heights 为所有植株的叶节点, tassel_bottom_height / ear_height 为各植株的边界
+    (缺失时为 NaN)。筛选、去噪和插补均按植株分组以数组运算完成, 插入的值与逐株计算逐位相同。
+    返回 (values, offsets, valid): 第 p 个植株的结果为 values[offsets[p]:offsets[p + 1]],
+    valid[p] 为 False 时对应 leaf_imputate 返回 None。
+    """
+    plant_count = len(ear_height)
+    bounded = (np.nan_to_num(tassel_bottom_height) != 0) & (np.nan_to_num(ear_height) != 0)
+
+    # 过滤出处于主穗基部高和雄穗顶部间的叶节点高度值, 并在每个植株内排序
+    keep = bounded[leaf_plants] & (ear_height[leaf_plants] + 0.04 > leaf_heights) & \
+        (leaf_heights > tassel_bottom_height[leaf_plants] - 0.05)
+    plants, heights = leaf_plants[keep], leaf_heights[keep]
+    order = np.lexsort((heights, plants))
+    plants, heights = plants[order], heights[order]
+    # 少于两个叶节点的植株不处理
+    valid = bounded & (np.bincount(plants, minlength=plant_count) > 1)
+    plants, heights = plants[valid[plants]], heights[valid[plants]]
+
+    # 去噪: 与前一个叶节点的间距不大于间距中位数的 remove_ratio 倍时视为重复识别
+    same = plants[1:] == plants[:-1]
+    differences = heights[1:] - heights[:-1]
+    spacing = grouped_median(differences[same], plants[1:][same], plant_count)
+    kept = np.concatenate([[True], ~same | (differences > remove_ratio * spacing[plants[1:]])])[:len(plants)]
+    plants, heights = plants[kept], heights[kept]
+
+    # 将穗位高和雄穗基部高度作为边界: 每个植株的序列为 [雄穗基部, 叶节点..., 穗位]
+    valid_plants = np.flatnonzero(valid)
+    sequence_plants = np.concatenate([valid_plants, plants, valid_plants])
+    sequence = np.concatenate([tassel_bottom_height[valid_plants], heights, ear_height[valid_plants]])
+    kinds = np.repeat([0, 1, 2], [len(valid_plants), len(plants), len(valid_plants)])
+    # lexsort 是稳定排序, 叶节点保持升序
+    order = np.lexsort((kinds, sequence_plants))
+    sequence_plants, sequence = sequence_plants[order], sequence[order]
+    starts, counts = group_bounds(sequence_plants, plant_count)
+    positions = np.arange(len(sequence)) - starts[sequence_plants]
+
+    # 相邻两值之间的间隔, 以间隔起点的位置编号
+    same = sequence_plants[1:] == sequence_plants[:-1]
+    gap_plants, gap_positions = sequence_plants[:-1][same], positions[:-1][same]
+    gap_starts, gap_ends = sequence[:-1][same], sequence[1:][same]
+    gaps = gap_ends - gap_starts
+    spacing = grouped_median(gaps, gap_plants, plant_count)[gap_plants]
+    last = gap_positions == counts[gap_plants] - 2
+
+    # 雄穗下: 第一个间隔过大时按照实际的叶节点向上填充一个值
+    bottom = (gap_positions == 0) & (gaps > edge_impute_ratio * spacing)
+    inserted = [(gap_plants[bottom], gap_positions[bottom], np.ones(bottom.sum(), dtype=int),
+                 gap_ends[bottom] - spacing[bottom])]
+
+    # 常规叶填充: 根据间隔大小决定分割点数, 均匀插入
+    regular = np.flatnonzero((gap_positions > 0) & ~last & (gaps > impute_ratio * spacing) & (spacing != 0))
+    num_segments = (gaps[regular] / (impute_ratio * spacing[regular])).astype(int) + 1
+    # 间隔中位数为负时分割点数可能不足两段, 与逐株计算相同不做插入
+    regular, num_segments = regular[num_segments > 1], num_segments[num_segments > 1]
+    segment_spacing = gaps[regular] / num_segments
+    gap_index = np.repeat(np.arange(len(num_segments)), num_segments - 1)
+    steps = np.arange(len(gap_index)) - np.repeat(np.cumsum(num_segments - 1) - (num_segments - 1), num_segments - 1) + 1
+    inserted.append((gap_plants[regular][gap_index], gap_positions[regular][gap_index], steps,
+                     gap_starts[regular][gap_index] + steps * segment_spacing[gap_index]))
+
+    # 雌穗上: 最后一个间隔过大时逐个向下填充, 直到剩余的间隔不再过大(与逐株计算相同的逐次累加)
+    top = last & (spacing > 0)
+    top_plants, top_positions, top_ends, top_spacing = gap_plants[top], gap_positions[top], gap_ends[top], spacing[top]
+    current = gap_starts[top]
+    active = top_ends - current > edge_impute_ratio * top_spacing
+    step = 0
+    while active.any():
+        step += 1
+        current = current + top_spacing
+        inserted.append((top_plants[active], top_positions[active], np.full(active.sum(), step), current[active]))
+        active &= top_ends - current > edge_impute_ratio * top_spacing
+
+    # 合并原序列和插入的值: 插入值位于其间隔起点之后
+    all_plants = np.concatenate([sequence_plants] + [part[0] for part in inserted])
+    all_positions = np.concatenate([positions] + [part[1] for part in inserted])
+    all_steps = np.concatenate([np.zeros(len(sequence), dtype=int)] + [part[2] for part in inserted])
+    all_values = np.concatenate([sequence] + [part[3] for part in inserted])
+    order = np.lexsort((all_steps, all_positions, all_plants))
+    all_plants, all_values = all_plants[order], all_values[order]
+
+    # 从序列中去除穗位高和雄穗基部高度值
+    keep = (all_values != ear_height[all_plants]) & (all_values != tassel_bottom_height[all_plants])
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(all_plants[keep], minlength=plant_count))])
+    return all_values[keep], offsets, valid
+
+
+def extract_architecture_batch(detections, found):
+    """
+    extract_plant_architecture_data 的批量引擎: detections 为多个植株的目标记录(DETECTION_DTYPE),
+    found 为各植株的标签文件是否存在。雄穗、雌穗和叶节点的选取以及叶节点的去噪和插补均按植株分组以数组运算完成,
+    返回按列存放的结果字典, 第 p 个植株的结果由 plant_architecture(batch, p) 取出。
+    """
+    plant_count = len(found)
+
+    # 1. 雄穗高度和雄穗基部高度: 取顶部最高(y 最小)的雄穗, 相同时取文件中靠前的
+    tassels = detections[detections['category'] == 2]
+    tassels = tassels[np.lexsort((tassels['index'], tassels['top'], tassels['plant']))]
+    first = np.concatenate([[True], tassels['plant'][1:] != tassels['plant'][:-1]])[:len(tassels)]
+    tassel_height = np.full(plant_count, np.nan)
+    tassel_base_height = np.full(plant_count, np.nan)
+    tassel_height[tassels['plant'][first]] = tassels['top'][first]
+    tassel_base_height[tassels['plant'][first]] = tassels['bottom'][first]
+
+    # 2. 雌穗高度和雌穗个数: 取最高(y 最小)的雌穗作为穗位高度
+    ears = detections[detections['category'] == 1]
+    ear_number = np.bincount(ears['plant'], minlength=plant_count)
+    ear_height = np.full(plant_count, np.inf)
+    np.minimum.at(ear_height, ears['plant'], ears['centroid'])
+    ear_height[ear_number == 0] = np.nan
+
+    # 3. 叶耳数据处理
+    leaves = detections[detections['category'] == 0]
+    leaf_heights, leaf_offsets, leaf_valid = impute_leaves_batch(leaves['plant'], leaves['centroid'],
+                                                                 tassel_base_height, ear_height)
+
+    return {'found': found, 'tassel_height': tassel_height, 'ear_height': ear_height, 'ear_number': ear_number,
+            'ear_heights': ears['centroid'], 'ear_offsets': np.concatenate([[0], np.cumsum(ear_number)]),
+            'leaf_heights': leaf_heights, 'leaf_offsets': leaf_offsets, 'leaf_valid': leaf_valid}
+
+
+def plant_architecture(batch, plant):
+    """取出批量结果中一个植株的数据, 与 extract_plant_architecture_data 的返回值相同"""
+    if not batch['found'][plant]:
+        return None, None, None, None, None, None
+
+    tassel_height = None if np.isnan(batch['tassel_height'][plant]) else float(batch['tassel_height'][plant])
+    ear_number = int(batch['ear_number'][plant])
+    if ear_number:
+        ear_height = float(batch['ear_height'][plant])
+        ear_heights = batch['ear_heights'][batch['ear_offsets'][plant]:batch['ear_offsets'][plant + 1]].tolist()
+    else:
+        ear_height = None
+        ear_heights = None
+
+    if batch['leaf_valid'][plant]:
+        processed_leaf_heights = \
+            batch['leaf_heights'][batch['leaf_offsets'][plant]:batch['leaf_offsets'][plant + 1]].tolist()
+        above_ear_leaf_number = len(processed_leaf_heights) or None
+    else:
+        processed_leaf_heights = None
+        above_ear_leaf_number = None
+
+    return tassel_height, processed_leaf_heights, above_ear_leaf_number, ear_height, ear_number, ear_heights
+
+
+# 每个进程只读取一次高度存储的索引
+HEIGHT_STORES = {}
+# 批量引擎每次处理的植株数
+ANALYSIS_BATCH_SIZE = 512
+
+# 结果表格的列及其类型(见 result_writers.py)
+RESULT_COLUMNS = [("Labels", 'str'), ("Plant_Height", 'float'), ("Height_of_Each_Above_ear_Leaf", 'list'),
+                  ("Above_ear_Leaf_Number", 'int'), ("Ear_Height", 'float'), ("Ear_Number", 'int')]
+
+
+def plant_row(label, heights, architecture, visualize_path, interpolate=False):
+    """
+    保存一个植株的 JSON 并返回写入表格的一行; architecture 为 extract_plant_architecture_data 格式的表型数据。
+    interpolate 为 True 时在相邻两帧的高度之间插值换算实际高度(见 height_store.heights_at)。
+    """
+    tassel_height, heights_of_each_above_ear_Leaf, above_ear_leaf_number, ear_height, ear_number, ear_heights \
+        = architecture
+
+    save_results_to_json(label, tassel_height, heights_of_each_above_ear_Leaf, ear_heights, visualize_path)
+
+    # 将数据转换为真实值: 雄穗、雌穗和各叶节点的坐标一次换算
+    real_heights = heights_at([tassel_height or 0, ear_height or 0, *(heights_of_each_above_ear_Leaf or [])],
+                              heights, interpolate).tolist()
+    plant_height = None
+    if tassel_height:
+        plant_height = round(real_heights[0], 2)
+
+    if ear_height:
+        ear_height = round(real_heights[1], 2)
+
+    if heights_of_each_above_ear_Leaf:
+        heights_of_each_above_ear_Leaf = [round(h, 2) for h in real_heights[2:]]
+
+    # 结果表格中的一行(各列见 RESULT_COLUMNS), 叶片高度保留为列表, 由写出器按格式转换
+    row = [label, plant_height, heights_of_each_above_ear_Leaf, above_ear_leaf_number, ear_height, ear_number]
+
+    return [item if not (isinstance(item, list) and not item) else None for item in row]
+
+
+def analyze_batch(label_files, height_folder, visualize_path, interpolate=False):
+    """
+    分析一批植株: 读取各植株的高度(缺少高度数据的植株被跳过), 将其余植株的全部目标一次交给批量引擎,
+    按 label_files 的顺序返回各植株的表格行, 同时保存各植株的 JSON。
+    """
+    # 读入样本height数据, 优先从二进制高度存储中读取, 不存在时退回到文本文件
+    if height_folder not in HEIGHT_STORES:
+        HEIGHT_STORES[height_folder] = HeightStore(height_folder)
+    plants = []
+    for label_file in label_files:
+        label = os.path.basename(label_file).split('.')[0]
+        heights = load_heights(height_folder, label, HEIGHT_STORES[height_folder])
+        if heights is None:
+            line = f"Skipping {label} - height data does not exist"
+            print(line)
+            continue
+        plants.append((label_file, label, heights))
+
+    # 调用批量引擎提取表型数据
+    batch = extract_architecture_batch(*load_detections([label_file for label_file, _, _ in plants]))
+    return [plant_row(label, heights, plant_architecture(batch, plant), visualize_path, interpolate)
+            for plant, (_, label, heights) in enumerate(plants)]
+
+
+def analyze_plants(label_files, height_folder, visualize_path, max_workers=1, interpolate=False):
+    """
+    按 label_files 的顺序逐个返回各植株的表格行(跳过缺少高度数据的植株)。植株按批交给批量引擎;
+    max_workers 大于 1 时各批由进程池并行分析, 结果仍按原顺序返回, 与串行分析得到的表格相同。
+    """
+    # 并行时每个进程至少领取几批, 以均衡负载
+    batch_size = ANALYSIS_BATCH_SIZE if max_workers <= 1 else \
+        max(1, min(ANALYSIS_BATCH_SIZE, -(-len(label_files) // (max_workers * 4))))
+    batches = [label_files[start:start + batch_size] for start in range(0, len(label_files), batch_size)]
+    if max_workers <= 1:
+        for batch in batches:
+            yield from analyze_batch(batch, height_folder, visualize_path, interpolate)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for rows in executor.map(analyze_batch, batches, repeat(height_folder), repeat(visualize_path),
+                                 repeat(interpolate)):
+            yield from rows
+
 #################################################################################
 # 主程序
 # 加载所需的库
 import os
 import glob
 import numpy as np
-from shapely.geometry import Polygon
-from openpyxl import Workbook, load_workbook
 import argparse
 import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from height_store import HeightStore, heights_at, load_heights
+from result_writers import RESULT_FORMATS, open_result_writer
 
 if __name__ == "__main__":
     # Create the parser
@@ -246,58 +558,29 @@ if __name__ == "__main__":
     parser.add_argument('-l', '--label_folder', default='./labels/', type=str, required=False, help='Path to the label folder')
     parser.add_argument('-d', '--height_folder', default='./heights/', type=str, required=False, help='Path to the height folder')
     parser.add_argument('-o', '--output_path', default='./output/', type=str, required=False, help='Output file path')
+    parser.add_argument('-c', '--workers', default=1, type=int, required=False,
+                        help='Number of processes used to analyze the plants (default 1 analyzes them in this '
+                             'process, more than 1 uses a process pool)')
+    parser.add_argument('--interpolate_heights', default=False, action='store_true',
+                        help='Interpolate linearly between the heights of neighbouring frames instead of taking the '
+                             'height of the frame a position falls in')
+    parser.add_argument('--format', default='xlsx', choices=RESULT_FORMATS, required=False,
+                        help='Result file format: Excel workbook, CSV, or Parquet / Arrow stream with a list column '
+                             'for the leaf heights (Parquet and Arrow need pyarrow)')
 
     # Parse the arguments
     args = parser.parse_args()
 
-    # 创建一个新的工作表
-    output_file = os.path.join(args.output_path, 'plant_architecture.xlsx')
+    # 结果文件随分析进度分批写出
+    output_file = os.path.join(args.output_path, f'plant_architecture.{args.format}')
     visualize_path = os.path.join(args.output_path, 'visualize/')
     os.makedirs(visualize_path, exist_ok=True)
 
-    wb = Workbook()
-
-    ws = wb.active
-    ws.append(["Labels", "Plant_Height", "Height_of_Each_Above_ear_Leaf", "Above_ear_Leaf_Number",
-               "Ear_Height", "Ear_Number"])
-
-
     # 定义高度和多边形图像文件夹路径
     label_files = sorted(glob.glob(os.path.join(args.label_folder, '*.txt')))
 
-    # 通过遍历标签信息文件夹来获取表型数据
-    for label_file in label_files:
-        label = os.path.basename(label_file).split('.')[0]
-        height_file = os.path.join(args.height_folder, label + '.txt')
-
-        # 读入样本height数据
-        with open(height_file, 'r') as infile:
-            heights = infile.read().splitlines()
-        # 调用分析函数提取表型数据
-        tassel_height, heights_of_each_above_ear_Leaf, above_ear_leaf_number, ear_height, ear_number, ear_heights \
-            = extract_plant_architecture_data(label_file)
-
-        save_results_to_json(label, tassel_height, heights_of_each_above_ear_Leaf, ear_heights, visualize_path)
-
-        # 将数据转换为真实值
-        if tassel_height:
-            plant_height = round(get_height_from_y(tassel_height, heights), 2)
-
-        if ear_height:
-            ear_height = round(get_height_from_y(ear_height, heights), 2)
-
-        if heights_of_each_above_ear_Leaf:
-            heights_of_each_above_ear_Leaf = [round(get_height_from_y(h, heights), 2) for h in heights_of_each_above_ear_Leaf]
-            heights_of_each_above_ear_Leaf = ', '.join(map(str, heights_of_each_above_ear_Leaf))
-
-        # 添加数据到Excel表格
-        row = [label, plant_height, heights_of_each_above_ear_Leaf, above_ear_leaf_number, ear_height, ear_number]
-
-        processed_row = [
-            item if not (isinstance(item, list) and not item) else None for item in row
-        ]
-        ws.append(processed_row)
-
-        label, plant_height, heights_of_each_above_ear_Leaf, above_ear_leaf_number, ear_height, ear_number = None, None, None, None, None, None
-
-    wb.save(output_file)
+    # 通过遍历标签信息文件夹来获取表型数据, 按 label 顺序逐行写出
+    with open_result_writer(output_file, RESULT_COLUMNS) as writer:
+        for row in analyze_plants(label_files, args.height_folder, visualize_path, args.workers,
+                                  args.interpolate_heights):
+            writer.write(row)
@@ -0,0 +1,103 @@
+"""
+批处理清单: 记录每个样本的输入视频、平滑高度序列的内容哈希、处理参数及输出路径,
+重复运行时据此跳过输入和参数均未变化的样本。
+
+清单以 JSON Lines 形式追加写入(每处理完一个样本追加一行, 中途崩溃也不会丢失已完成的记录),
+批处理结束后再压缩为每个样本一行。
+
+分布式模式下每个节点只追加写入自己的 manifest.<node>.jsonl, 读取时合并所有清单, 同一样本以记录时间最新的为准。
+"""
+import glob
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from file_staging import atomic_write
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+
+def file_fingerprint(path, previous=None):
+    """计算文件的 sha256; 若大小和修改时间与上次记录一致则直接沿用上次的哈希"""
+    stat = os.stat(path)
+    if previous and previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns:
+        return previous
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    return {'sha256': digest.hexdigest(), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def series_fingerprint(values):
+    """计算高度序列(按 float64 存储)的 sha256"""
+    values = np.ascontiguousarray(values, dtype='<f8')
+    return {'sha256': hashlib.sha256(values.tobytes()).hexdigest(), 'length': len(values)}
+
+
+class BatchManifest:
+    def __init__(self, folder, node=None):
+        self.node = node
+        self.path = os.path.join(folder, MANIFEST_NAME if node is None else f'manifest.{node}.jsonl')
+        self.entries = {}
+        # 本清单文件自身的记录(节点分片压缩时只保留这些)
+        self.own_entries = {}
+
+        paths = [os.path.join(folder, MANIFEST_NAME)] + sorted(glob.glob(os.path.join(folder, 'manifest.*.jsonl')))
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 忽略崩溃时可能写了一半的行
+                        continue
+                    current = self.entries.get(entry['label'])
+                    if current is None or entry.get('recorded', 0) >= current.get('recorded', 0):
+                        self.entries[entry['label']] = entry
+                    if path == self.path:
+                        self.own_entries[entry['label']] = entry
+
+    def fingerprint(self, label, video_file, heights):
+        """获取样本输入视频及高度序列的指纹"""
+        entry = self.entries.get(label, {})
+        return {
+            'video': file_fingerprint(video_file, entry.get('video')),
+            'height': series_fingerprint(heights),
+        }
+
+    def is_up_to_date(self, label, fingerprints, params, outputs):
+        """输入哈希、处理参数均与清单一致且所有输出文件仍然存在时返回 True"""
+        entry = self.entries.get(label)
+        if not entry:
+            return False
+
+        for key, fingerprint in fingerprints.items():
+            if entry.get(key, {}).get('sha256') != fingerprint['sha256']:
+                return False
+        if entry.get('params') != params:
+            return False
+
+        return all(os.path.exists(output) for output in outputs)
+
+    def record(self, label, fingerprints, params, output):
+        """追加一条已完成样本的记录"""
+        entry = {'label': label, **fingerprints, 'params': params, 'output': output, 'recorded': time.time()}
+        self.entries[label] = entry
+        self.own_entries[label] = entry
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def compact(self):
+        """将清单重写为每个样本一行(先写临时文件再替换); 主清单合并所有节点的记录, 节点分片只保留自身的记录"""
+        entries = self.entries if self.node is None else self.own_entries
+        with atomic_write(self.path) as f:
+            for label in sorted(entries):
+                f.write(json.dumps(entries[label]) + '\n')
@@ -0,0 +1,278 @@
+"""
+视频处理流程的基准测试: 用 OpenCV 生成合成的 640x480 测试视频(MJPG/MP4)及对应的单调或带噪声的高度文件,
+在不同的视频长度、并行数和解码后端下运行 2_Video_process.py, 记录每个视频的耗时、吞吐量(视频/分钟)、峰值内存(RSS)
+和写入磁盘的字节数, 结果保存为 JSON 以便在不同提交之间比较。
+
+用法:
+    python benchmark.py -m MODEL_FOLDER --frames 60 240 --workers 1 4 --decoders ffmpeg opencv -- -x png_fast
+
+"--" 之后的参数原样传给 2_Video_process.py。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+import numpy as np
+import psutil
+
+from stage_trace import TRACE_NAME
+
+FRAME_WIDTH = 640
+FRAME_HEIGHT = 480
+FPS = 30
+# 相机每帧在植株上移动的像素数
+SCROLL_STEP = 8
+FOURCC = {'.avi': 'MJPG', '.mp4': 'mp4v'}
+SCRIPT_PATH = Path(__file__).resolve().parent / '2_Video_process.py'
+
+
+def make_texture(height, rng):
+    """生成用于滚动的竖长合成图像: 模糊噪声背景 + 茎秆 + 随机叶片"""
+    texture = rng.integers(0, 256, size=(height // 8 + 1, FRAME_WIDTH // 8, 3), dtype=np.uint8)
+    texture = cv2.resize(texture, (FRAME_WIDTH, height // 8 * 8 + 8), interpolation=cv2.INTER_LINEAR)[:height]
+    texture = cv2.GaussianBlur(texture, (0, 0), 3)
+
+    cv2.rectangle(texture, (FRAME_WIDTH // 2 - 12, 0), (FRAME_WIDTH // 2 + 12, height), (40, 140, 60), -1)
+    for y in range(0, height, 90):
+        side = 1 if rng.random() < 0.5 else -1
+        tip = (FRAME_WIDTH // 2 + side * int(rng.integers(120, 300)), y + int(rng.integers(-60, 60)))
+        cv2.line(texture, (FRAME_WIDTH // 2, y), tip, (50, 170, 70), int(rng.integers(6, 16)))
+    return texture
+
+
+def make_clip(video_path, frames, seed=0):
+    """写出 frames 帧的合成视频, 画面随相机移动逐帧向下滚动"""
+    rng = np.random.default_rng(seed)
+    texture = make_texture(FRAME_HEIGHT + frames * SCROLL_STEP, rng)
+    fourcc = cv2.VideoWriter_fourcc(*FOURCC[Path(video_path).suffix])
+    out = cv2.VideoWriter(str(video_path), fourcc, FPS, (FRAME_WIDTH, FRAME_HEIGHT))
+    try:
+        for frame in range(frames):
+            offset = frame * SCROLL_STEP
+            out.write(np.ascontiguousarray(texture[offset:offset + FRAME_HEIGHT]))
+    finally:
+        out.release()
+
+
+def make_heights(height_path, frames, mode='monotonic', seed=0):
+    """写出与视频帧数相同的高度文件; noisy 模式叠加噪声和少量异常跳变, 随机决定上升或下降方向"""
+    rng = np.random.default_rng(seed)
+    heights = np.linspace(2400, 400, frames)
+    if mode == 'noisy':
+        heights = heights + rng.normal(0, 4, frames)
+        spikes = rng.choice(frames, size=max(1, frames // 60), replace=False)
+        heights[spikes] += rng.choice([-1, 1], size=len(spikes)) * rng.uniform(200, 600, len(spikes))
+    if rng.random() < 0.5:
+        heights = heights[::-1]
+
+    with open(height_path, 'w') as f:
+        f.writelines([f"{dist:.1f}\n" for dist in heights])
+
+
+def generate_dataset(folder, videos, frames, height_mode='mixed', extension='.avi'):
+    """生成一组测试视频和高度文件"""
+    video_folder = Path(folder) / 'videos'
+    height_folder = Path(folder) / 'heights'
+    video_folder.mkdir(parents=True, exist_ok=True)
+    height_folder.mkdir(parents=True, exist_ok=True)
+
+    for index in range(videos):
+        label = f"bench-{frames:04d}-{index:03d}"
+        mode = height_mode if height_mode != 'mixed' else ('monotonic', 'noisy')[index % 2]
+        make_clip(video_folder / (label + extension), frames, seed=index)
+        make_heights(height_folder / (label + '.txt'), frames, mode, seed=index)
+
+
+def folder_size(folder):
+    return sum(path.stat().st_size for path in Path(folder).rglob('*') if path.is_file())
+
+
+class TreeSampler(threading.Thread):
+    """定时采样进程及其全部子进程(进程池、ffmpeg)的 RSS 之和以及写入字节数"""
+
+    def __init__(self, pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.root = psutil.Process(pid)
+        self.interval = interval
+        self.peak_rss = 0
+        self.write_bytes = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                processes = [self.root] + self.root.children(recursive=True)
+            except psutil.NoSuchProcess:
+                break
+
+            rss = 0
+            for process in processes:
+                try:
+                    rss += process.memory_info().rss
+                    # 已退出的子进程保留最后一次采样到的值
+                    self.write_bytes[process.pid] = process.io_counters().write_bytes
+                except (psutil.NoSuchProcess, psutil.AccessDenied, AttributeError):
+                    continue
+            self.peak_rss = max(self.peak_rss, rss)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def read_stage_totals(output_folder):
+    """从 -t 写出的计时轨迹中读取每个视频的整体耗时(stage 为 total 的记录)"""
+    per_video = {}
+    # 分布式模式下各节点的轨迹位于输出文件夹的 trace/<node> 中
+    for trace_path in Path(output_folder).rglob(TRACE_NAME):
+        with open(trace_path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record['stage'] == 'total':
+                    per_video[record['label']] = record['wall']
+    return per_video
+
+
+def run_pipeline(workspace, model_folder, workers, decoder, extra_args, videos):
+    """运行一次完整的视频处理流程, 返回耗时、各视频耗时、峰值内存和写入字节数"""
+    # 各视频的耗时取自流程自身的计时轨迹(-t), 并行的视频在标准输出中会交错, 不能据此计时
+    command = [sys.executable, '-u', str(SCRIPT_PATH), '-v', 'videos', '-d', 'heights', '-m',
+               os.path.abspath(model_folder), '-o', 'images', '-c', str(workers), '--decoder', decoder, '-t']
+    command += list(extra_args)
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=workspace, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    sampler = TreeSampler(process.pid)
+    sampler.start()
+
+    log = [line.rstrip() for line in process.stdout]
+    returncode = process.wait()
+    wall_time = time.perf_counter() - start
+    sampler.stop()
+
+    if returncode != 0:
+        raise RuntimeError(f"Pipeline failed ({returncode}):\n" + '\n'.join(log[-20:]))
+
+    per_video = read_stage_totals(Path(workspace) / 'images')
+    if len(per_video) < videos:
+        raise RuntimeError(f"Only {len(per_video)} of {videos} videos were timed:\n" + '\n'.join(log[-20:]))
+
+    return {
+        'wall_time': wall_time,
+        'per_video': per_video,
+        'peak_rss_mb': sampler.peak_rss / 1024 ** 2,
+        'write_bytes': sum(sampler.write_bytes.values()),
+        'output_bytes': folder_size(workspace) - folder_size(Path(workspace) / 'videos' / 'raw')
+                        - folder_size(Path(workspace) / 'heights' / 'raw'),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_PATH.parent,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark 2_Video_process.py on synthetic videos",
+                                     epilog="Arguments after -- are passed to 2_Video_process.py")
+
+    parser.add_argument('-m', '--model_folder', default='./models/', type=str, required=False,
+                        help='Path to the model folder (ffmpeg and ffprobe, otherwise taken from PATH)')
+    parser.add_argument('-n', '--videos', default=8, type=int, required=False,
+                        help='Number of synthetic videos per run')
+    parser.add_argument('--frames', default=[60, 240], type=int, nargs='+', required=False,
+                        help='Clip lengths (frames) to benchmark')
+    parser.add_argument('--workers', default=[1, 4], type=int, nargs='+', required=False,
+                        help='Worker counts (-c) to benchmark')
+    parser.add_argument('--decoders', default=['ffmpeg'], nargs='+', choices=['ffmpeg', 'opencv', 'pyav'],
+                        required=False, help='Decoder backends (--decoder) to benchmark')
+    parser.add_argument('--heights', default='mixed', choices=['monotonic', 'noisy', 'mixed'], required=False,
+                        help='Synthetic height series: monotonic, noisy (noise and spikes) or alternating')
+    parser.add_argument('--format', default='.avi', choices=list(FOURCC), required=False,
+                        help='Container of the synthetic clips (.avi is MJPG like the capture rigs, .mp4 is MPEG-4)')
+    parser.add_argument('-w', '--work_folder', default='./benchmark/', type=str, required=False,
+                        help='Folder for the synthetic data and pipeline outputs')
+    parser.add_argument('-o', '--output', default=None, type=str, required=False,
+                        help='Result JSON file (default is WORK_FOLDER/results_<commit>_<time>.json)')
+    parser.add_argument('--keep', default=False, action='store_true',
+                        help='Keep the per-run workspaces instead of deleting them')
+
+    args, extra_args = parser.parse_known_args()
+    extra_args = [arg for arg in extra_args if arg != '--']
+
+    work_folder = Path(args.work_folder)
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'memory_gb': round(psutil.virtual_memory().total / 1024 ** 3, 1),
+        'videos': args.videos,
+        'heights': args.heights,
+        'format': args.format,
+        'pipeline_args': extra_args,
+        'runs': [],
+    }
+
+    for frames in args.frames:
+        # 每种长度只生成一次数据, 每次运行复制一份(流程会把输入移动到 raw 文件夹)
+        dataset = work_folder / f"dataset_{frames}"
+        if not dataset.exists():
+            line = f"Generating {args.videos} synthetic videos with {frames} frames"
+            print(line)
+            generate_dataset(dataset, args.videos, frames, args.heights, args.format)
+        input_bytes = folder_size(dataset / 'videos')
+
+        for decoder in args.decoders:
+            for workers in args.workers:
+                workspace = work_folder / f"run_{frames}_{decoder}_{workers}"
+                shutil.rmtree(workspace, ignore_errors=True)
+                shutil.copytree(dataset, workspace)
+
+                line = f"Running {args.videos} videos x {frames} frames with {workers} workers ({decoder} decoder)"
+                print(line)
+                run = run_pipeline(workspace, args.model_folder, workers, decoder, extra_args, args.videos)
+                durations = list(run['per_video'].values())
+                results['runs'].append({
+                    'frames': frames,
+                    'decoder': decoder,
+                    'workers': workers,
+                    'input_bytes': input_bytes,
+                    'wall_time': round(run['wall_time'], 3),
+                    'videos_per_min': round(args.videos / run['wall_time'] * 60, 2),
+                    'per_video_mean': round(statistics.mean(durations), 3) if durations else None,
+                    'per_video_median': round(statistics.median(durations), 3) if durations else None,
+                    'per_video': {label: round(seconds, 3) for label, seconds in sorted(run['per_video'].items())},
+                    'peak_rss_mb': round(run['peak_rss_mb'], 1),
+                    'write_bytes': run['write_bytes'],
+                    'output_bytes': run['output_bytes'],
+                })
+                line = (f"  {run['wall_time']:.2f} s, {results['runs'][-1]['videos_per_min']} videos/min, "
+                        f"peak RSS {run['peak_rss_mb']:.0f} MB")
+                print(line)
+
+                if not args.keep:
+                    shutil.rmtree(workspace, ignore_errors=True)
+
+    output = args.output or work_folder / f"results_{commit or 'unknown'}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=4)
+
+    line = f"Benchmark results are saved to : {output}."
+    print(line)
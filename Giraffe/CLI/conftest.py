@@ -0,0 +1,62 @@
+import importlib.util
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+CLI_FOLDER = Path(__file__).resolve().parent
+
+
+def load_script(file_name):
+    """
+    以模块形式载入文件名不能直接 import 的 CLI 脚本(如 2_Video_process.py), __main__ 部分不会执行。
+    模块登记在 sys.modules 中, 其函数可以提交到进程池。
+    """
+    name = Path(file_name).stem.lstrip('0123456789_')
+    spec = importlib.util.spec_from_file_location(name, CLI_FOLDER / file_name)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='session')
+def video_process():
+    return load_script('2_Video_process.py')
+
+
+@pytest.fixture(scope='session')
+def output_analysis():
+    return load_script('3_Model_output_analysis.py')
+
+
+@pytest.fixture
+def model_folder(tmp_path):
+    """含 ffmpeg(及 ffprobe)的模型文件夹: 使用 PATH 中的 ffmpeg, 或 imageio-ffmpeg 附带的程序, 都没有时跳过"""
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        imageio_ffmpeg = pytest.importorskip('imageio_ffmpeg')
+        try:
+            ffmpeg = imageio_ffmpeg.get_ffmpeg_exe()
+        except RuntimeError:
+            pytest.skip('ffmpeg is not available')
+    folder = tmp_path / 'models'
+    folder.mkdir()
+    (folder / ('ffmpeg.exe' if sys.platform == 'win32' else 'ffmpeg')).symlink_to(ffmpeg)
+    # ffprobe(用于读取帧数和定位所需的帧率)只在 PATH 中有时提供, imageio-ffmpeg 不附带
+    ffprobe = shutil.which('ffprobe')
+    if ffprobe is not None:
+        (folder / ('ffprobe.exe' if sys.platform == 'win32' else 'ffprobe')).symlink_to(ffprobe)
+    return folder
+
+
+@pytest.fixture
+def clip(tmp_path):
+    """40 帧的合成视频"""
+    pytest.importorskip('cv2')
+    from benchmark import make_clip
+
+    video_path = tmp_path / 'clip.avi'
+    make_clip(video_path, 40)
+    return video_path
@@ -0,0 +1,101 @@
+"""
+输入文件的暂存: 在同一文件系统内以硬链接、reflink(写时复制克隆)或符号链接代替完整复制, 不可用时(如跨文件系统)退回到复制。
+
+    auto      依次尝试硬链接、reflink, 最后复制
+    hardlink  硬链接(与源文件共享数据, 源文件被删除后仍然有效)
+    reflink   写时复制克隆, 需要 Linux 上支持 FICLONE 的文件系统(btrfs、XFS 等)
+    symlink   符号链接, 源文件被移动或删除后失效
+    copy      完整复制(原有方式)
+
+写出文件时统一使用 temporary_path / atomic_write: 先写入同一目录中的唯一临时文件, 完成后以 os.replace 原子替换目标文件,
+其他进程或节点不会读到写了一半的文件。
+"""
+import errno
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 上没有 fcntl, 不支持 reflink
+    fcntl = None
+
+STAGE_MODES = ('auto', 'hardlink', 'reflink', 'symlink', 'copy')
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def temporary_path(destination):
+    """与目标文件同目录的唯一临时文件名(以点开头, 保留扩展名), 写完后以 os.replace 原子替换目标文件"""
+    folder, name = os.path.split(destination)
+    stem, extension = os.path.splitext(name)
+    return os.path.join(folder, f".{stem}.{uuid.uuid4().hex}.tmp{extension}")
+
+
+@contextmanager
+def atomic_write(destination, mode='w'):
+    """以 mode 打开临时文件供写入, 正常结束时原子替换 destination, 出错时删除临时文件"""
+    temp_path = temporary_path(destination)
+    try:
+        with open(temp_path, mode) as f:
+            yield f
+        os.replace(temp_path, destination)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def reflink(source, destination):
+    """以写时复制方式克隆文件, 文件系统或平台不支持时抛出 OSError"""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflink is not supported on this platform")
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+    os.remove(destination)
+    raise OSError(errno.EOPNOTSUPP, f"reflink is not supported for {destination}")
+
+
+def link_file(source, destination, method):
+    if method == 'hardlink':
+        os.link(source, destination)
+    elif method == 'reflink':
+        reflink(source, destination)
+    elif method == 'symlink':
+        os.symlink(os.path.abspath(source), destination)
+    else:
+        raise ValueError(f"Unknown staging method: {method}")
+
+
+def stage_file(source, destination, mode='auto'):
+    """
+    将 source 暂存为 destination(已存在时替换), 先在目标目录中生成临时文件再原子替换。
+    返回实际使用的方式; 所选方式不可用时退回到复制。
+    """
+    methods = ('hardlink', 'reflink') if mode == 'auto' else () if mode == 'copy' else (mode,)
+    # 目标已是源文件的硬链接时无需重新暂存(rename 不会替换指向同一文件的链接)
+    if 'hardlink' in methods and os.path.isfile(destination) and not os.path.islink(destination) \
+            and os.path.samefile(source, destination):
+        return 'hardlink'
+
+    temp_path = temporary_path(destination)
+
+    for method in methods:
+        try:
+            link_file(source, temp_path, method)
+        except (OSError, NotImplementedError):
+            continue
+        os.replace(temp_path, destination)
+        return method
+
+    shutil.copy(source, temp_path)
+    os.replace(temp_path, destination)
+    return 'copy'
@@ -0,0 +1,109 @@
+"""
+文件夹监视: 等待同名的视频文件与高度文件都到达且写入完成(大小不再变化并静置一段时间)后, 将其作为一对返回。
+
+安装了 watchdog 时使用系统文件事件(Linux 为 inotify, Windows 为 ReadDirectoryChangesW)即时唤醒,
+否则退回到定时轮询。两种方式下是否写入完成都通过文件大小和修改时间判断, 事件只用于缩短等待。
+"""
+import os
+import threading
+import time
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi')
+HEIGHT_EXTENSION = '.txt'
+
+
+class _WakeHandler(FileSystemEventHandler):
+    def __init__(self, wake_event):
+        super().__init__()
+        self.wake_event = wake_event
+
+    def on_any_event(self, event):
+        self.wake_event.set()
+
+
+def list_files(folder, extensions):
+    """列出文件夹顶层(不含 raw / processed 等子文件夹)中指定扩展名的文件, 返回 {label: 路径}"""
+    files = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(extensions):
+                files[entry.name.split('.')[0]] = entry.path
+    return files
+
+
+class PairWatcher:
+    def __init__(self, video_folder, height_folder, settle_time=2.0, poll_interval=1.0, use_events=True):
+        self.video_folder = video_folder
+        self.height_folder = height_folder
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.wake_event = threading.Event()
+        self.observer = None
+        # label -> 上一次扫描时两个文件的 (大小, 修改时间)
+        self.signatures = {}
+
+        if use_events and Observer is not None:
+            self.observer = Observer()
+            handler = _WakeHandler(self.wake_event)
+            for folder in {os.path.abspath(video_folder), os.path.abspath(height_folder)}:
+                self.observer.schedule(handler, folder, recursive=False)
+
+    @property
+    def mode(self):
+        return 'events' if self.observer is not None else 'polling'
+
+    def __enter__(self):
+        if self.observer is not None:
+            self.observer.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+    def wake(self):
+        """唤醒等待中的 wait(), 例如某个任务完成时"""
+        self.wake_event.set()
+
+    def wait(self):
+        """等待下一次扫描: 有待确认的文件时按轮询间隔复查, 否则在事件模式下一直等到有文件变化"""
+        if self.observer is not None and not self.signatures:
+            timeout = max(self.poll_interval, 30.0)
+        else:
+            timeout = self.poll_interval
+        self.wake_event.wait(timeout)
+        self.wake_event.clear()
+
+    def ready_pairs(self):
+        """返回已写入完成的 (label, 视频路径, 高度文件路径) 列表, 同一对文件只返回一次(除非被重新写入)"""
+        videos = list_files(self.video_folder, VIDEO_EXTENSIONS)
+        heights = list_files(self.height_folder, HEIGHT_EXTENSION)
+        now = time.time()
+
+        ready = []
+        signatures = {}
+        for label in sorted(videos.keys() & heights.keys()):
+            paths = (videos[label], heights[label])
+            try:
+                stats = [os.stat(path) for path in paths]
+            except FileNotFoundError:
+                continue
+            signature = tuple((stat.st_size, stat.st_mtime_ns) for stat in stats)
+
+            # 两次扫描之间大小和修改时间都没有变化, 且最后一次修改已超过静置时间
+            settled = now - max(stat.st_mtime for stat in stats) >= self.settle_time
+            if signature == self.signatures.get(label) and settled and all(stat.st_size > 0 for stat in stats):
+                ready.append((label,) + paths)
+            else:
+                signatures[label] = signature
+
+        self.signatures = signatures
+        return ready
@@ -0,0 +1,199 @@
+"""
+高度序列存储: 以二进制形式保存一个文件夹内所有样本的高度序列, 供高度筛查、视频处理和结果分析共用,
+避免反复解析大量小文本文件。
+
+存储由两个文件组成:
+    heights.f64          所有序列首尾相接的 float64 数据(小端), 以内存映射方式读取
+    heights_index.jsonl  每行一个 {"label", "offset", "length", "recorded"}
+新序列只追加写入, 需要时再压缩去除被覆盖的旧数据。文本文件可通过 export_text 按需重新生成。
+
+多台机器共用同一文件夹时(分布式模式), 每个节点只追加写入自己的分片 heights.<node>.f64 / heights_index.<node>.jsonl,
+读取时合并主存储和所有分片, 同一 label 以写入时间(recorded)最新的为准。
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from file_staging import atomic_write
+
+DATA_NAME = 'heights.f64'
+INDEX_NAME = 'heights_index.jsonl'
+DTYPE = np.dtype('<f8')
+
+
+def store_paths(folder, node=None):
+    """主存储或节点分片的 (数据文件, 索引文件) 路径"""
+    if node is None:
+        return os.path.join(folder, DATA_NAME), os.path.join(folder, INDEX_NAME)
+    return os.path.join(folder, f'heights.{node}.f64'), os.path.join(folder, f'heights_index.{node}.jsonl')
+
+
+def _shard_data_path(index_path):
+    node = os.path.basename(index_path)[len('heights_index.'):-len('.jsonl')]
+    return store_paths(os.path.dirname(index_path), node)[0]
+
+
+class HeightStore:
+    def __init__(self, folder, node=None):
+        self.folder = folder
+        self.node = node
+        self.data_path, self.index_path = store_paths(folder, node)
+        # label -> (数据文件, offset, length, recorded)
+        self.index = {}
+        self._data = {}
+
+        sources = [store_paths(folder)]
+        sources += [(_shard_data_path(path), path)
+                    for path in sorted(glob.glob(os.path.join(folder, 'heights_index.*.jsonl')))]
+        for data_path, index_path in sources:
+            if not os.path.exists(index_path):
+                continue
+            with open(index_path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 忽略崩溃时可能写了一半的行
+                        continue
+                    recorded = entry.get('recorded', 0)
+                    current = self.index.get(entry['label'])
+                    if current is None or recorded >= current[3]:
+                        self.index[entry['label']] = (data_path, entry['offset'], entry['length'], recorded)
+
+    def __contains__(self, label):
+        return label in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def labels(self):
+        return sorted(self.index)
+
+    def _mapped(self, data_path):
+        # 追加写入后需要重新映射
+        if data_path not in self._data:
+            if not os.path.exists(data_path) or os.path.getsize(data_path) == 0:
+                self._data[data_path] = np.empty(0, dtype=DTYPE)
+            else:
+                self._data[data_path] = np.memmap(data_path, dtype=DTYPE, mode='r')
+        return self._data[data_path]
+
+    def get(self, label):
+        """返回 label 对应的高度序列(float64 数组), 不存在时返回 None"""
+        if label not in self.index:
+            return None
+        data_path, offset, length, _ = self.index[label]
+        return np.array(self._mapped(data_path)[offset:offset + length])
+
+    def append(self, label, series):
+        """追加(或覆盖)一个样本的高度序列"""
+        self.update({label: series})
+
+    def update(self, series_by_label):
+        """批量追加多个样本的高度序列"""
+        os.makedirs(self.folder, exist_ok=True)
+        recorded = time.time()
+        entries = []
+        with open(self.data_path, 'ab') as data_file:
+            offset = data_file.tell() // DTYPE.itemsize
+            for label, series in series_by_label.items():
+                values = np.asarray(series, dtype=DTYPE)
+                data_file.write(values.tobytes())
+                entries.append({'label': label, 'offset': offset, 'length': len(values), 'recorded': recorded})
+                offset += len(values)
+
+        # 数据写入完成后再写索引, 保证索引中的每一行都指向完整的数据
+        with open(self.index_path, 'a') as index_file:
+            for entry in entries:
+                index_file.write(json.dumps(entry) + '\n')
+                self.index[entry['label']] = (self.data_path, entry['offset'], entry['length'], recorded)
+        self._data.pop(self.data_path, None)
+
+    def compact(self):
+        """
+        重写存储, 仅保留每个样本最新的序列。主存储合并所有分片的数据; 节点分片只保留本节点写入的序列。
+        """
+        labels = [label for label in self.labels() if self.node is None or self.index[label][0] == self.data_path]
+        series_by_label = {label: self.get(label) for label in labels}
+        recorded = {label: self.index[label][3] for label in labels}
+        # 释放内存映射后才能替换数据文件(Windows)
+        self._data = {}
+        write_store(self.folder, series_by_label, self.node, recorded)
+        self.__init__(self.folder, self.node)
+
+    def export_text(self, output_folder, labels=None, trailing_newline=True):
+        """
+        将高度序列按每行一个数值重新导出为 label.txt 文本文件, 与流程中直接写出的文本逐字节一致:
+        processed 文件每行以换行结尾; smoothed 文件(trailing_newline=False)最后一行没有换行。
+        """
+        os.makedirs(output_folder, exist_ok=True)
+        for label in labels or self.labels():
+            lines = [str(dist) for dist in self.get(label).tolist()]
+            with open(os.path.join(output_folder, label + '.txt'), 'w') as f:
+                f.write(''.join(line + '\n' for line in lines) if trailing_newline else '\n'.join(lines))
+
+
+def write_store(folder, series_by_label, node=None, recorded=None):
+    """用给定的全部序列重写主存储或节点分片(先写临时文件再替换); recorded 为各序列的写入时间, 默认为当前时间"""
+    os.makedirs(folder, exist_ok=True)
+    data_path, index_path = store_paths(folder, node)
+    recorded = recorded or {}
+    now = time.time()
+
+    # 临时文件名唯一, 避免多个进程同时重写时互相覆盖; 数据文件先于索引文件替换
+    offset = 0
+    with atomic_write(index_path) as index_file, atomic_write(data_path, 'wb') as data_file:
+        for label in sorted(series_by_label):
+            values = np.asarray(series_by_label[label], dtype=DTYPE)
+            data_file.write(values.tobytes())
+            entry = {'label': label, 'offset': offset, 'length': len(values), 'recorded': recorded.get(label, now)}
+            index_file.write(json.dumps(entry) + '\n')
+            offset += len(values)
+
+
+def load_heights(folder, label, store=None):
+    """优先从高度存储中读取序列, 不存在时退回到 label.txt 文本文件; 都不存在时返回 None"""
+    store = store if store is not None else HeightStore(folder)
+    if label in store:
+        return store.get(label)
+
+    text_path = os.path.join(folder, label + '.txt')
+    if os.path.exists(text_path):
+        return np.loadtxt(text_path, dtype=float, ndmin=1)
+    return None
+
+
+def heights_at(y, heights, interpolate=False):
+    """
+    将归一化的图像 y 坐标(可为数组)一次换算为实际高度(高度序列以毫米记录, 返回厘米)。
+    拼接图中第 i 帧的条带对应 y 位于 [i / n, (i + 1) / n) 的区间, 默认取该帧的高度, 超出图像范围的坐标取首尾帧;
+    interpolate 为 True 时以各条带的中心为采样点, 在相邻两帧的高度之间线性插值。
+    """
+    heights = np.asarray(heights, dtype=float)
+    position = np.asarray(y, dtype=float) * len(heights)
+    if interpolate:
+        return np.interp(position - 0.5, np.arange(len(heights)), heights) / 10
+
+    index = np.clip(np.trunc(position), 0, len(heights) - 1).astype(int)
+    return heights[index] / 10
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the binary height store of a folder as text files")
+
+    parser.add_argument('-i', '--height_folder', default='./heights/processed/', type=str, required=False,
+                        help='Folder containing heights.f64 and heights_index.jsonl')
+    parser.add_argument('-o', '--output_folder', default=None, type=str, required=False,
+                        help='Folder for the exported label.txt files (default is the height folder)')
+
+    args = parser.parse_args()
+
+    store = HeightStore(args.height_folder)
+    # 平滑后的高度文件最后一行没有换行
+    smoothed = os.path.basename(os.path.normpath(args.height_folder)) == 'smoothed'
+    store.export_text(args.output_folder or args.height_folder, trailing_newline=not smoothed)
+    print(f"Exported {len(store)} height files.")
@@ -0,0 +1,236 @@
+"""
+分布式处理的租约文件: 多台机器共用同一个网络文件夹时, 每个样本在处理前先创建租约文件 <label>.lease,
+创建成功的节点独占处理该样本。持有租约的节点定时确认租约仍属于自己并刷新文件的修改时间(心跳), 节点崩溃后租约不再刷新,
+超过 ttl 秒后即可被其他节点回收。处理完成后租约改写为完成记录(state 为 done), 记录输入指纹、参数和输出。
+
+创建使用 O_CREAT | O_EXCL, 回收时先将过期租约改名为唯一的墓碑文件再检查, 两个节点同时回收时只有一个能改名成功。
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from file_staging import atomic_write
+
+LEASE_FOLDER = '.leases'
+LEASE_SUFFIX = '.lease'
+
+
+def default_node_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def holds_lease(path, node):
+    """租约文件 path 仍是 node 的 running 租约时返回 True; 可在工作进程中调用"""
+    try:
+        with open(path, 'r') as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return record.get('state') == 'running' and record.get('node') == node
+
+
+class LeaseDirectory:
+    def __init__(self, folder, node, ttl=300.0):
+        self.folder = os.path.join(folder, LEASE_FOLDER)
+        self.node = node
+        self.ttl = ttl
+        # 本节点当前持有的租约
+        self.held = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._heartbeat = None
+        os.makedirs(self.folder, exist_ok=True)
+
+    def __enter__(self):
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        # 异常退出时释放仍持有的租约, 其他节点可立即接手
+        for label in list(self.held):
+            self.release(label)
+
+    def path(self, label):
+        return os.path.join(self.folder, label + LEASE_SUFFIX)
+
+    def _beat(self):
+        while not self._stopped.wait(self.ttl / 3):
+            with self._lock:
+                held = list(self.held)
+            for label in held:
+                self.heartbeat(label)
+
+    def heartbeat(self, label):
+        """
+        刷新租约的修改时间。刷新前重新读取租约, 租约已被其他节点回收或改写、或无法刷新时,
+        本节点不再持有该租约(从 held 中移除并输出提示), 返回 False。
+        """
+        record = self.read(label)
+        if record is None or record.get('state') != 'running' or record.get('node') != self.node:
+            reason = f"it is now held by {(record or {}).get('node')}"
+        else:
+            try:
+                os.utime(self.path(label))
+                return True
+            except OSError as e:
+                reason = f"the heartbeat failed: {e}"
+
+        with self._lock:
+            if label not in self.held:
+                # 已正常完成或释放
+                return False
+            self.held.discard(label)
+        line = f"Lost the lease of {label}, {reason}"
+        print(line)
+        return False
+
+    def read(self, label):
+        """读取租约或完成记录, 不存在或正在被改写时返回 None"""
+        try:
+            with open(self.path(label), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_stale(self, path):
+        try:
+            return time.time() - os.path.getmtime(path) > self.ttl
+        except OSError:
+            return False
+
+    def _create(self, label):
+        try:
+            fd = os.open(self.path(label), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'state': 'running', 'node': self.node, 'time': time.time()}, f)
+        with self._lock:
+            self.held.add(label)
+        return True
+
+    def _retire(self, label):
+        """将租约改名为唯一的墓碑文件, 返回墓碑路径; 其他节点已抢先改名时返回 None"""
+        tombstone = f"{self.path(label)}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(self.path(label), tombstone)
+        except OSError:
+            return None
+        return tombstone
+
+    def _reclaim(self, label):
+        """回收过期的租约; 改名后发现租约其实仍有效(刚被刷新)时恢复原样"""
+        tombstone = self._retire(label)
+        if tombstone is None:
+            return
+        if not self.is_stale(tombstone):
+            try:
+                os.link(tombstone, self.path(label))
+            except OSError:
+                pass
+        os.remove(tombstone)
+
+    def claim(self, label):
+        """
+        尝试获取样本的租约。返回 (True, None) 表示获取成功; 返回 (False, record) 表示已被占用,
+        record 为现有的租约或完成记录(state 为 running 或 done)。
+        """
+        for _ in range(2):
+            if self._create(label):
+                return True, None
+
+            record = self.read(label)
+            if record is not None and record.get('state') == 'done':
+                return False, record
+            if not self.is_stale(self.path(label)):
+                return False, record
+
+            line = f"Reclaiming the expired lease of {label} (held by {(record or {}).get('node')})"
+            print(line)
+            self._reclaim(label)
+        return False, self.read(label)
+
+    def reclaim_done(self, label):
+        """输入或参数已变化时, 删除旧的完成记录并重新获取租约"""
+        record = self.read(label)
+        if record is not None and record.get('state') == 'done':
+            tombstone = self._retire(label)
+            if tombstone is None:
+                return False
+            # 其他节点已抢先改写为新的租约时恢复原样
+            with open(tombstone, 'r') as f:
+                retired = json.load(f)
+            if retired.get('state') != 'done':
+                try:
+                    os.link(tombstone, self.path(label))
+                except OSError:
+                    pass
+                os.remove(tombstone)
+                return False
+            os.remove(tombstone)
+        return self._create(label)
+
+    def owns(self, label):
+        """本节点仍持有该样本的租约: 在 held 中, 且租约文件仍是本节点的 running 租约"""
+        return label in self.held and holds_lease(self.path(label), self.node)
+
+    def complete(self, label, record):
+        """
+        以完成记录替换租约(先写临时文件再替换)。本节点已不再持有该租约时不做任何改动并返回 False,
+        避免覆盖其他节点回收后的租约或完成记录。
+        """
+        if not self.owns(label):
+            with self._lock:
+                self.held.discard(label)
+            return False
+        with atomic_write(self.path(label)) as f:
+            json.dump({'state': 'done', 'node': self.node, 'time': time.time(), **record}, f)
+        with self._lock:
+            self.held.discard(label)
+        return True
+
+    def release(self, label):
+        """
+        处理失败时删除租约, 其他节点可以重新尝试。先将租约改名为墓碑文件再检查, 租约已被其他节点回收时恢复原样;
+        本节点未持有该租约时不做任何改动。
+        """
+        with self._lock:
+            if label not in self.held:
+                return
+            self.held.discard(label)
+        tombstone = self._retire(label)
+        if tombstone is None:
+            return
+        try:
+            with open(tombstone, 'r') as f:
+                retired = json.load(f)
+        except (OSError, ValueError):
+            retired = None
+        if retired is None or retired.get('state') != 'running' or retired.get('node') != self.node:
+            try:
+                os.link(tombstone, self.path(label))
+            except OSError:
+                pass
+        os.remove(tombstone)
+
+    def active(self):
+        """其他节点当前持有且未过期的租约"""
+        labels = []
+        for name in os.listdir(self.folder):
+            # 跳过写入中的临时文件
+            if name.startswith('.') or not name.endswith(LEASE_SUFFIX):
+                continue
+            label = name[:-len(LEASE_SUFFIX)]
+            if label in self.held:
+                continue
+            record = self.read(label)
+            if record is not None and record.get('state') == 'running' and not self.is_stale(self.path(label)):
+                labels.append(label)
+        return labels
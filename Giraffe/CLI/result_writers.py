@@ -0,0 +1,171 @@
+"""
+表型结果的流式写出: 结果按行写入, 每攒够一批即追加到输出文件, 内存占用与植株数量无关。
+由输出文件的扩展名选择格式:
+
+    .xlsx     openpyxl 的 write_only 模式, 行数据随写随存入临时文件, 关闭时生成工作簿(原有格式)
+    .csv      CSV 文本(UTF-8), 每批写入后立即 flush, 中途崩溃时已写出的行仍然可读
+    .parquet  Apache Parquet(需另行安装 pyarrow), 每批写为一个 row group, 关闭时写入文件尾
+    .arrow    Arrow IPC 流(需另行安装 pyarrow), 每批写为一个 record batch, 中途崩溃时已写出的批次仍然可读
+
+列由 (列名, 类型) 给出, 类型为 'str'、'int'、'float' 或 'list'(浮点数列表)。
+list 列在 Parquet / Arrow 中保存为真正的 list<double> 列, 在 xlsx / CSV 中与原表格一致写为 "a, b, c" 字符串。
+缺失值(None)在 Parquet / Arrow 中为 null, 在 xlsx / CSV 中写为 na_value。
+
+Giraffe/CLI 与 Lizard/CLI 中各有一份相同的 result_writers.py: 两个目录分别作为独立的脚本目录运行, 并各自打包为单独的程序,
+互不依赖对方的目录。修改时须同时修改两份, Giraffe/CLI/test_result_writers.py 检查两份内容一致。
+"""
+import csv
+import os
+
+from openpyxl import Workbook
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Parquet / Arrow 输出需要 pyarrow, 其他格式不受影响
+    pa = None
+    pq = None
+
+RESULT_FORMATS = ('xlsx', 'csv', 'parquet', 'arrow')
+BATCH_SIZE = 1000
+
+
+def format_cell(value, kind, na_value=None):
+    """xlsx / CSV 单元格的值: list 列拼接为逗号分隔的字符串, 空列表和缺失值写为 na_value"""
+    if value is None or (kind == 'list' and not value):
+        return na_value
+    if kind == 'list':
+        return ', '.join(map(str, value))
+    return value
+
+
+class ResultWriter:
+    """按批写出结果行的基类, 子类实现 _write_batch 和 _finish"""
+
+    def __init__(self, path, columns, batch_size=BATCH_SIZE, na_value=None):
+        self.path = path
+        self.names = [name for name, _ in columns]
+        self.kinds = [kind for _, kind in columns]
+        self.batch_size = batch_size
+        self.na_value = na_value
+        self.rows = []
+        self.written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, row):
+        """追加一行(与列一一对应的值)"""
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self._write_batch(self.rows)
+            self.written += len(self.rows)
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self._finish()
+
+    def text_row(self, row):
+        return [format_cell(value, kind, self.na_value) for value, kind in zip(row, self.kinds)]
+
+    def _write_batch(self, rows):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+
+class XlsxResultWriter(ResultWriter):
+    def __init__(self, path, columns, batch_size=BATCH_SIZE, na_value=None):
+        super().__init__(path, columns, batch_size, na_value)
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+        self.sheet.append(self.names)
+
+    def _write_batch(self, rows):
+        for row in rows:
+            self.sheet.append(self.text_row(row))
+
+    def _finish(self):
+        self.workbook.save(self.path)
+
+
+class CsvResultWriter(ResultWriter):
+    def __init__(self, path, columns, batch_size=BATCH_SIZE, na_value=None):
+        super().__init__(path, columns, batch_size, na_value)
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.names)
+        self.file.flush()
+
+    def _write_batch(self, rows):
+        self.writer.writerows(self.text_row(row) for row in rows)
+        self.file.flush()
+
+    def _finish(self):
+        self.file.close()
+
+
+class ArrowResultWriter(ResultWriter):
+    """Parquet 与 Arrow IPC 流的共同部分: 每批转换为一个 Arrow 表"""
+    ARROW_TYPES = {'str': 'string', 'int': 'int64', 'float': 'float64'}
+
+    def __init__(self, path, columns, batch_size=BATCH_SIZE, na_value=None):
+        if pa is None:
+            raise ImportError(f"Writing {os.path.basename(path)} requires pyarrow (pip install pyarrow)")
+        super().__init__(path, columns, batch_size, na_value)
+        self.schema = pa.schema([(name, pa.list_(pa.float64()) if kind == 'list' else self.ARROW_TYPES[kind])
+                                 for name, kind in columns])
+
+    def table(self, rows):
+        columns = list(zip(*rows))
+        return pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+                                    schema=self.schema)
+
+
+class ParquetResultWriter(ArrowResultWriter):
+    def __init__(self, path, columns, batch_size=BATCH_SIZE, na_value=None):
+        super().__init__(path, columns, batch_size, na_value)
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def _write_batch(self, rows):
+        self.writer.write_table(self.table(rows))
+
+    def _finish(self):
+        self.writer.close()
+
+
+class ArrowStreamResultWriter(ArrowResultWriter):
+    def __init__(self, path, columns, batch_size=BATCH_SIZE, na_value=None):
+        super().__init__(path, columns, batch_size, na_value)
+        self.sink = pa.OSFile(path, 'wb')
+        self.writer = pa.ipc.new_stream(self.sink, self.schema)
+
+    def _write_batch(self, rows):
+        self.writer.write_table(self.table(rows))
+        self.sink.flush()
+
+    def _finish(self):
+        self.writer.close()
+        self.sink.close()
+
+
+WRITERS = {'xlsx': XlsxResultWriter, 'csv': CsvResultWriter, 'parquet': ParquetResultWriter,
+           'arrow': ArrowStreamResultWriter}
+
+
+def open_result_writer(path, columns, batch_size=BATCH_SIZE, na_value=None):
+    """按扩展名创建结果写出器, 用法: with open_result_writer(path, columns) as writer: writer.write(row)"""
+    result_format = os.path.splitext(path)[1].lstrip('.').lower()
+    if result_format not in WRITERS:
+        raise ValueError(f"Unknown result format: {result_format} (choose from {', '.join(RESULT_FORMATS)})")
+    return WRITERS[result_format](path, columns, batch_size, na_value)
@@ -0,0 +1,135 @@
+"""
+分阶段计时: 记录每个视频各处理阶段的墙钟时间、CPU 时间和读写字节数, 写出 JSON Lines 轨迹并按阶段汇总 p50/p95。
+关闭时 stage() 直接返回同一个空的上下文管理器, 几乎没有额外开销。
+
+CPU 时间分为当前线程的 CPU 时间(thread_cpu)和阶段内结束的子进程(ffmpeg / ffprobe)的 CPU 时间(child_cpu,
+Windows 上不可用, 记为 0); 读写字节数取自当前进程的 I/O 计数。child_cpu 和读写字节数按进程统计,
+线程池并行时会混入同时运行的其他视频, 需要精确归属时使用进程池(-e process)。
+"""
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+import psutil
+
+TRACE_NAME = 'stage_trace.jsonl'
+SUMMARY_NAME = 'stage_summary.json'
+METRICS = ('wall', 'thread_cpu', 'child_cpu', 'read_bytes', 'write_bytes')
+
+_DISABLED = nullcontext()
+
+
+def _io_bytes(process):
+    try:
+        counters = process.io_counters()
+        return counters.read_bytes, counters.write_bytes
+    except (AttributeError, psutil.Error):
+        # 部分平台(如 macOS)不提供进程 I/O 计数
+        return 0, 0
+
+
+class StageTrace:
+    def __init__(self, label=None, enabled=True):
+        self.label = label
+        self.enabled = enabled
+        self.process = psutil.Process() if enabled else None
+        # 阶段名 -> 累计值, 同名阶段多次进入(如逐帧解码)时累加
+        self.stages = {}
+        # 从创建到 finish() 的整体计时
+        self.started = self._snapshot() if enabled else None
+
+    def stage(self, name):
+        """以 with 语句包住一个处理阶段"""
+        if not self.enabled:
+            return _DISABLED
+        return self._measure(name)
+
+    def _snapshot(self):
+        return time.perf_counter(), time.thread_time(), os.times(), _io_bytes(self.process)
+
+    def _accumulate(self, name, start):
+        start_wall, start_cpu, start_times, (start_read, start_write) = start
+        end_wall, end_cpu, end_times, (end_read, end_write) = self._snapshot()
+
+        values = self.stages.setdefault(name, dict.fromkeys(METRICS, 0) | {'calls': 0})
+        values['wall'] += end_wall - start_wall
+        values['thread_cpu'] += end_cpu - start_cpu
+        values['child_cpu'] += (end_times.children_user - start_times.children_user
+                                + end_times.children_system - start_times.children_system)
+        values['read_bytes'] += end_read - start_read
+        values['write_bytes'] += end_write - start_write
+        values['calls'] += 1
+
+    @contextmanager
+    def _measure(self, name):
+        start = self._snapshot()
+        try:
+            yield
+        finally:
+            self._accumulate(name, start)
+
+    def finish(self):
+        """结束整体计时, 返回每个阶段一条的记录(total 为整个视频)"""
+        if not self.enabled:
+            return []
+        self._accumulate('total', self.started)
+        return [{'label': self.label, 'stage': name, **values} for name, values in self.stages.items()]
+
+
+NULL_TRACE = StageTrace(enabled=False)
+
+
+def summarize(records):
+    """按阶段统计各视频指标的 p50 / p95 及总和"""
+    by_stage = {}
+    for record in records:
+        by_stage.setdefault(record['stage'], []).append(record)
+
+    summary = {}
+    for stage, stage_records in by_stage.items():
+        entry = {'videos': len(stage_records)}
+        for metric in METRICS:
+            values = np.array([record[metric] for record in stage_records], dtype=float)
+            entry[f'{metric}_p50'] = round(float(np.percentile(values, 50)), 4)
+            entry[f'{metric}_p95'] = round(float(np.percentile(values, 95)), 4)
+            entry[f'{metric}_total'] = round(float(values.sum()), 4)
+        summary[stage] = entry
+    return summary
+
+
+class TraceWriter:
+    """批处理期间逐个视频追加轨迹, 结束时写出并打印按阶段的汇总"""
+
+    def __init__(self, folder, enabled=True):
+        self.enabled = enabled
+        self.records = []
+        if enabled:
+            os.makedirs(folder, exist_ok=True)
+            self.trace_path = os.path.join(folder, TRACE_NAME)
+            self.summary_path = os.path.join(folder, SUMMARY_NAME)
+            open(self.trace_path, 'w').close()
+
+    def write(self, records):
+        if not self.enabled or not records:
+            return
+        self.records.extend(records)
+        with open(self.trace_path, 'a') as f:
+            f.writelines([json.dumps(record) + '\n' for record in records])
+
+    def close(self):
+        if not self.enabled or not self.records:
+            return
+        summary = summarize(self.records)
+        with open(self.summary_path, 'w') as f:
+            json.dump(summary, f, indent=4)
+
+        line = f"{'stage':<16}{'wall p50':>10}{'wall p95':>10}{'cpu p50':>10}{'child p50':>10}{'MB written':>12}"
+        print(line)
+        for stage, entry in summary.items():
+            line = (f"{stage:<16}{entry['wall_p50']:>10.3f}{entry['wall_p95']:>10.3f}{entry['thread_cpu_p50']:>10.3f}"
+                    f"{entry['child_cpu_p50']:>10.3f}{entry['write_bytes_total'] / 1024 ** 2:>12.1f}")
+            print(line)
+        line = f"Stage trace is saved to : {self.trace_path}."
+        print(line)
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+
+def polygon_line(category, center_y, half_height, rng):
+    """以 center_y 为中心、带随机抖动的四边形(归一化坐标)"""
+    center_x = rng.uniform(0.3, 0.7)
+    half_width = rng.uniform(0.01, 0.05)
+    points = [(center_x - half_width, center_y - half_height), (center_x + half_width, center_y - half_height),
+              (center_x + half_width, center_y + half_height), (center_x - half_width, center_y + half_height)]
+    points = np.clip(np.array(points) + rng.normal(0, 0.002, (4, 2)), 0, 1)
+    return f"{category} " + ' '.join(f"{value:.6f}" for value in points.ravel())
+
+
+def plant_labels(seed):
+    """随机植株的 YOLO 标签: 雄穗在上, 雌穗在下, 叶节点分布其间, 含重复识别、漏检和范围外的叶节点"""
+    rng = np.random.default_rng(seed)
+    lines = []
+    for _ in range(rng.choice([0, 1, 1, 1, 2])):
+        lines.append(polygon_line(2, rng.uniform(0.08, 0.15), rng.uniform(0.03, 0.06), rng))
+    for _ in range(rng.choice([0, 1, 1, 1, 2])):
+        lines.append(polygon_line(1, rng.uniform(0.6, 0.8), rng.uniform(0.02, 0.04), rng))
+
+    spacing = rng.uniform(0.04, 0.09)
+    leaves = np.arange(rng.uniform(0.18, 0.25), 0.85, spacing)
+    # 漏检的叶节点, 靠得很近的重复识别
+    leaves = leaves[rng.random(len(leaves)) > 0.25]
+    leaves = np.concatenate([leaves, leaves[rng.random(len(leaves)) < 0.15] + rng.uniform(0, 0.005)])
+    for leaf in rng.permutation(leaves):
+        lines.append(polygon_line(0, leaf, 0.005, rng))
+    return '\n'.join(rng.permutation(lines))
+
+
+def test_batch_engine_matches_per_plant_reference(output_analysis, tmp_path):
+    label_files = []
+    for seed in range(300):
+        label_file = tmp_path / f'plant-{seed:03d}.txt'
+        if seed % 37 != 5:
+            # 个别植株没有标签文件(模型未检测到任何目标)
+            label_file.write_text(plant_labels(seed))
+        label_files.append(str(label_file))
+    (tmp_path / 'plant-empty.txt').write_text('')
+    label_files.append(str(tmp_path / 'plant-empty.txt'))
+
+    batch = output_analysis.extract_architecture_batch(*output_analysis.load_detections(label_files))
+
+    for plant, label_file in enumerate(label_files):
+        expected = output_analysis.extract_plant_architecture_data(label_file)
+        assert output_analysis.plant_architecture(batch, plant) == expected, label_file
+
+
+POLYGONS = {
+    'convex': [(0.2, 0.1), (0.6, 0.15), (0.7, 0.5), (0.4, 0.8), (0.1, 0.45)],
+    'concave': [(0.1, 0.1), (0.9, 0.1), (0.9, 0.3), (0.35, 0.3), (0.35, 0.9), (0.1, 0.9)],
+    'clockwise': [(0.1, 0.45), (0.4, 0.8), (0.7, 0.5), (0.6, 0.15), (0.2, 0.1)],
+    'clockwise_concave': [(0.1, 0.9), (0.35, 0.9), (0.35, 0.3), (0.9, 0.3), (0.9, 0.1), (0.1, 0.1)],
+    'collinear': [(0.1, 0.2), (0.3, 0.4), (0.6, 0.7)],
+    'repeated_edge': [(0.5, 0.5), (0.5, 0.5), (0.8, 0.5), (0.5, 0.5)],
+    'single_point': [(0.4, 0.6), (0.4, 0.6), (0.4, 0.6)],
+}
+
+
+def test_polygon_geometry_matches_shapely(output_analysis):
+    geometry = pytest.importorskip('shapely.geometry')
+    rng = np.random.default_rng(0)
+    # 叶节点标签形状的随机四边形, 两种点序
+    quads = [np.array(polygon_line(0, rng.uniform(0.1, 0.9), 0.005, rng).split()[1:], dtype=float).reshape(-1, 2)
+             for _ in range(20)]
+    polygons = [np.array(points, dtype=float) for points in POLYGONS.values()] + quads + [quad[::-1] for quad in quads]
+
+    min_y, max_y, min_x, max_x, centroid_x, centroid_y = output_analysis.polygon_geometry(polygons)
+
+    for index, points in enumerate(polygons):
+        shape = geometry.Polygon(points)
+        bounds_x, bounds_y, bounds_x1, bounds_y1 = shape.bounds
+        assert (min_x[index], min_y[index], max_x[index], max_y[index]) == (bounds_x, bounds_y, bounds_x1, bounds_y1)
+        assert centroid_x[index] == pytest.approx(shape.centroid.x, abs=1e-12), index
+        assert centroid_y[index] == pytest.approx(shape.centroid.y, abs=1e-12), index
+
+
+@pytest.mark.parametrize('interpolate', [False, True])
+def test_parallel_analysis_matches_serial(output_analysis, tmp_path, capfd, interpolate):
+    from height_store import write_store
+
+    label_folder, height_folder = tmp_path / 'labels', tmp_path / 'heights'
+    label_folder.mkdir()
+    height_folder.mkdir()
+    label_files = []
+    series = {}
+    for seed in range(120):
+        label = f'plant-{seed:03d}'
+        (label_folder / f'{label}.txt').write_text(plant_labels(seed))
+        label_files.append(str(label_folder / f'{label}.txt'))
+        heights = np.round(np.linspace(2400, 300, 40 + seed % 7) + seed, 1)
+        # 个别植株缺少高度数据, 部分植株的高度只有文本文件
+        if seed % 29 == 3:
+            continue
+        if seed % 5 == 0:
+            (height_folder / f'{label}.txt').write_text(''.join(f"{height}\n" for height in heights))
+        else:
+            series[label] = heights
+    write_store(str(height_folder), series)
+
+    results = {}
+    for workers in (1, 3):
+        visualize_path = tmp_path / f'visualize-{workers}'
+        visualize_path.mkdir()
+        rows = list(output_analysis.analyze_plants(label_files, str(height_folder), str(visualize_path), workers,
+                                                   interpolate))
+        files = {path.name: path.read_bytes() for path in visualize_path.iterdir()}
+        results[workers] = rows, files, capfd.readouterr().out
+
+    serial, parallel = results[1], results[3]
+    # 行的内容和顺序与串行分析完全一致(每批 10 个植株, 分为多批由进程池分析)
+    assert len(serial[0]) == 120 - 5
+    assert [row[0] for row in serial[0]] == sorted(row[0] for row in serial[0])
+    assert repr(parallel[0]) == repr(serial[0])
+    assert parallel[1] == serial[1]
+    assert sorted(parallel[2].splitlines()) == sorted(serial[2].splitlines())
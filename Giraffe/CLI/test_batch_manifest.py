@@ -0,0 +1,203 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+from batch_manifest import BatchManifest
+from conftest import CLI_FOLDER
+
+PARAMS = {'pipeline': 'stream', 'row_width': 29}
+
+
+@pytest.fixture
+def sample(tmp_path):
+    video_file = tmp_path / 'plant.avi'
+    video_file.write_bytes(b'video')
+    output_file = tmp_path / 'plant.png'
+    output_file.write_bytes(b'png')
+    return str(video_file), str(output_file), np.linspace(2000, 500, 50)
+
+
+def test_recorded_sample_is_up_to_date(tmp_path, sample):
+    video_file, output_file, heights = sample
+    manifest = BatchManifest(str(tmp_path))
+    fingerprints = manifest.fingerprint('plant', video_file, heights)
+    assert not manifest.is_up_to_date('plant', fingerprints, PARAMS, [output_file])
+
+    manifest.record('plant', fingerprints, PARAMS, output_file)
+    manifest.compact()
+
+    reloaded = BatchManifest(str(tmp_path))
+    assert reloaded.is_up_to_date('plant', reloaded.fingerprint('plant', video_file, heights), PARAMS, [output_file])
+
+
+def test_changes_invalidate_the_record(tmp_path, sample):
+    video_file, output_file, heights = sample
+    manifest = BatchManifest(str(tmp_path))
+    manifest.record('plant', manifest.fingerprint('plant', video_file, heights), PARAMS, output_file)
+    manifest = BatchManifest(str(tmp_path))
+
+    # 高度序列变化
+    changed_heights = heights.copy()
+    changed_heights[10] += 0.1
+    assert not manifest.is_up_to_date('plant', manifest.fingerprint('plant', video_file, changed_heights), PARAMS,
+                                      [output_file])
+    # 处理参数变化
+    fingerprints = manifest.fingerprint('plant', video_file, heights)
+    assert not manifest.is_up_to_date('plant', fingerprints, dict(PARAMS, row_width=31), [output_file])
+    # 输出文件被删除
+    os.remove(output_file)
+    assert not manifest.is_up_to_date('plant', fingerprints, PARAMS, [output_file])
+
+
+def test_rewritten_video_is_rehashed(tmp_path, sample):
+    video_file, output_file, heights = sample
+    manifest = BatchManifest(str(tmp_path))
+    manifest.record('plant', manifest.fingerprint('plant', video_file, heights), PARAMS, output_file)
+
+    # 内容变化但大小不变, 修改时间不同时重新计算哈希
+    with open(video_file, 'wb') as f:
+        f.write(b'VIDEO')
+    os.utime(video_file, ns=(1, 1))
+    manifest = BatchManifest(str(tmp_path))
+    assert not manifest.is_up_to_date('plant', manifest.fingerprint('plant', video_file, heights), PARAMS,
+                                      [output_file])
+
+
+def test_node_shards_are_merged_newest_first(tmp_path, sample):
+    video_file, output_file, heights = sample
+    first = BatchManifest(str(tmp_path), node='a')
+    fingerprints = first.fingerprint('plant', video_file, heights)
+    first.record('plant', fingerprints, dict(PARAMS, row_width=31), output_file)
+    second = BatchManifest(str(tmp_path), node='b')
+    second.record('plant', fingerprints, PARAMS, output_file)
+    first.compact()
+    second.compact()
+
+    merged = BatchManifest(str(tmp_path))
+    assert merged.is_up_to_date('plant', fingerprints, PARAMS, [output_file])
+    assert not merged.is_up_to_date('plant', fingerprints, dict(PARAMS, row_width=31), [output_file])
+
+
+def test_rerun_skips_unchanged_videos(video_process, tmp_path, capsys):
+    pytest.importorskip('cv2')
+    from benchmark import make_clip, make_heights
+
+    video_folder, height_folder, output_folder = tmp_path / 'videos', tmp_path / 'heights', tmp_path / 'images'
+    video_folder.mkdir()
+    height_folder.mkdir()
+    for index, label in enumerate(['plant-a', 'plant-b']):
+        make_clip(video_folder / f'{label}.avi', 20, seed=index)
+        make_heights(height_folder / f'{label}.txt', 20, seed=index)
+    options = video_process.ProcessOptions(decoder='opencv', encoder=video_process.encoder_options('npy'))
+
+    def run(options=options, force=False, new_heights=False):
+        if new_heights:
+            video_process.filter_heights(str(height_folder), 1)
+        capsys.readouterr()
+        video_process.process_video_thread(str(video_folder), str(height_folder), str(output_folder), 2, options,
+                                           force=force)
+        out = capsys.readouterr().out
+        return sorted(label for label in ['plant-a', 'plant-b'] if f"Processing started for {label}" in out)
+
+    assert run(new_heights=True) == ['plant-a', 'plant-b']
+    assert run() == []
+    assert run(force=True) == ['plant-a', 'plant-b']
+
+    # 输出格式变化时全部重新处理
+    png = video_process.ProcessOptions(decoder='opencv', encoder=video_process.encoder_options('png_fast'))
+    assert run(png) == ['plant-a', 'plant-b']
+    assert run(png) == []
+
+    # 输出被删除或高度文件更新时只重新处理该样本
+    os.remove(output_folder / 'plant-a.png')
+    assert run(png) == ['plant-a']
+    # 已移入 raw 文件夹的高度文件被修正后重新筛查
+    make_heights(height_folder / 'raw' / 'plant-b.txt', 20, mode='noisy', seed=7)
+    assert run(png, new_heights=True) == ['plant-b']
+    assert run(png) == []
+
+
+def test_shard_records_and_skips(video_process, tmp_path, capsys):
+    pytest.importorskip('cv2')
+    from benchmark import make_clip, make_heights
+    from leases import LeaseDirectory
+
+    video_folder, height_folder, output_folder = tmp_path / 'videos', tmp_path / 'heights', tmp_path / 'images'
+    video_folder.mkdir()
+    height_folder.mkdir()
+    for index, label in enumerate(['plant-a', 'plant-b', 'plant-c']):
+        make_clip(video_folder / f'{label}.avi', 20, seed=index)
+        make_heights(height_folder / f'{label}.txt', 20, seed=index)
+    # 高度筛查不通过的样本
+    (height_folder / 'plant-c.txt').write_text('1500.0\n' * 150)
+    options = video_process.ProcessOptions(decoder='opencv', encoder=video_process.encoder_options('npy'))
+
+    def run(node):
+        capsys.readouterr()
+        video_process.process_video_shard(str(video_folder), str(height_folder), str(output_folder), 2, options, node,
+                                          poll_interval=0.1)
+        out = capsys.readouterr().out
+        return sorted(label for label in ['plant-a', 'plant-b', 'plant-c'] if f"Processing started for {label}" in out)
+
+    assert run('a') == ['plant-a', 'plant-b']
+    leases = LeaseDirectory(str(output_folder), 'check')
+    for label in ['plant-a', 'plant-b']:
+        record = leases.read(label)
+        assert (record['state'], record['status'], record['node']) == ('done', 'processed', 'a')
+        assert record['outputs'] == [str(output_folder / f'{label}.npy')]
+        assert os.path.exists(record['outputs'][0])
+    assert (leases.read('plant-c')['status'], leases.read('plant-c')['outputs']) == ('abnormal', [])
+
+    # 清单和高度存储分片由其他节点合并读取
+    merged = BatchManifest(str(output_folder))
+    assert sorted(merged.entries) == ['plant-a', 'plant-b']
+    assert video_process.HeightStore(str(height_folder / 'processed')).labels() == ['plant-a', 'plant-b']
+    assert run('b') == []
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='sends SIGINT to the process group')
+@pytest.mark.parametrize('mode', [['-w', '--settle_time', '0.2', '--poll_interval', '0.1'], ['-n', 'node-a']],
+                         ids=['watch', 'shard'])
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_interrupt_waits_for_running_videos(model_folder, tmp_path, mode, executor):
+    pytest.importorskip('cv2')
+    from benchmark import make_clip, make_heights
+
+    video_folder, height_folder, output_folder = tmp_path / 'videos', tmp_path / 'heights', tmp_path / 'images'
+    video_folder.mkdir()
+    height_folder.mkdir()
+    make_clip(video_folder / 'plant.avi', 300)
+    make_heights(height_folder / 'plant.txt', 300)
+
+    command = [sys.executable, str(CLI_FOLDER / '2_Video_process.py'), '-v', str(video_folder),
+               '-d', str(height_folder), '-m', str(model_folder), '-o', str(output_folder), '-c', '1', '-e', executor,
+               '-x', 'npy', *mode]
+    process = subprocess.Popen(command, cwd=tmp_path, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                               env=dict(os.environ, PYTHONUNBUFFERED='1'), start_new_session=True)
+    timer = threading.Timer(120, process.kill)
+    timer.start()
+    output = []
+    try:
+        for line in process.stdout:
+            output.append(line)
+            if line.startswith('Processing started for plant'):
+                # 与终端中的 Ctrl+C 相同, SIGINT 发给整个前台进程组(主进程和进程池的工作进程); ffmpeg 不在该进程组中
+                os.killpg(process.pid, signal.SIGINT)
+                break
+        output += process.stdout.readlines()
+        process.wait()
+    finally:
+        timer.cancel()
+        process.stdout.close()
+    output = ''.join(output)
+
+    assert process.returncode == 0, output
+    assert 'waiting for 1 running videos' in output, output
+    assert 'Processing completed for plant' in output, output
+    assert (output_folder / 'plant.npy').exists()
+    assert 'plant' in BatchManifest(str(output_folder)).entries
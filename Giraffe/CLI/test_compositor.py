@@ -0,0 +1,217 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+ROW_WIDTH = 29
+
+
+def random_strips(frames, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, size=(ROW_WIDTH, 640, 3), dtype=np.uint8) for _ in range(frames)]
+
+
+def pil_composite(video_process, strips):
+    """原始 png 流程的拼接方式: 每帧加上透明度模板后, 依次 alpha_composite 到逐帧增大的画布上"""
+    alpha = video_process.template_alpha(ROW_WIDTH, (ROW_WIDTH - 1) / 2)
+    frames = [Image.fromarray(np.dstack([strip, alpha]), mode="RGBA") for strip in strips]
+
+    composite_image = frames[0]
+    splice_offset = ROW_WIDTH // 2
+    for frame in range(1, len(frames)):
+        temp_composite = Image.new('RGBA', (640, ROW_WIDTH + frame * splice_offset), (0, 0, 0, 0))
+        temp_composite.alpha_composite(composite_image, (0, 0))
+        temp_composite.alpha_composite(frames[frame], (0, frame * splice_offset))
+        composite_image = temp_composite
+    return composite_image
+
+
+@pytest.mark.parametrize('frames', [1, 2, 3, 40])
+@pytest.mark.parametrize('reverse', [False, True])
+def test_splice_compositor_matches_pil(video_process, frames, reverse):
+    strips = random_strips(frames)
+    # 预估帧数偏小, 同时检查画布扩容
+    compositor = video_process.SpliceCompositor(max(frames // 2, 1), ROW_WIDTH, reverse=reverse)
+    for strip in strips:
+        compositor.add(strip)
+
+    # 倒序放置等同于对倒放的视频按正序拼接
+    expected = pil_composite(video_process, strips[::-1] if reverse else strips)
+    assert np.array_equal(np.asarray(compositor.result()), np.asarray(expected))
+
+
+@pytest.mark.parametrize('frames', [1, 2, 40, 97])
+@pytest.mark.parametrize('reverse', [False, True])
+def test_spilling_compositor_matches_pil(video_process, tmp_path, frames, reverse):
+    strips = random_strips(frames, seed=frames)
+    # 最小的画布窗口, 拼接过程中多次写出已完成的行
+    compositor = video_process.SpillingCompositor(tmp_path / 'composite.rgb', ROW_WIDTH, reverse=reverse, window=0)
+    for strip in strips:
+        compositor.add(strip)
+
+    expected = pil_composite(video_process, strips[::-1] if reverse else strips).convert('RGB')
+    assert np.array_equal(np.asarray(compositor.result()), np.asarray(expected))
+
+
+@pytest.mark.parametrize('height', [29, 1440, 2057, 6000])
+def test_resize_rows_matches_pil_lanczos(video_process, height):
+    rgb = np.random.default_rng(height).integers(0, 256, size=(height, 640, 3), dtype=np.uint8)
+    expected = Image.fromarray(rgb).resize((640, 1440), Image.Resampling.LANCZOS)
+    assert np.array_equal(np.asarray(video_process.resize_rows(rgb)), np.asarray(expected))
+
+
+@pytest.mark.parametrize('band_decode', [True, False])
+@pytest.mark.parametrize('reverse', [False, True])
+def test_decoded_composite_matches_png_pipeline(video_process, model_folder, clip, tmp_path, reverse, band_decode):
+    ffmpeg = video_process.find_tool(model_folder, 'ffmpeg')
+    decoder = video_process.create_decoder('ffmpeg', model_folder, band_decode)
+    stream = video_process.splice_video_stream(decoder, str(clip), ROW_WIDTH, 40, reverse=reverse)
+
+    source = str(clip)
+    if reverse:
+        # 倒放的参照: 无损抽出的帧按倒序编号, 作为图像序列输入 png 流程
+        frames_folder = tmp_path / 'frames'
+        frames_folder.mkdir()
+        video_process.run_command([ffmpeg, '-i', clip, frames_folder / 'frame%03d.png'])
+        frame_files = sorted(frames_folder.glob('frame*.png'))
+        for number, frame_file in enumerate(frame_files[::-1], start=1):
+            frame_file.rename(frames_folder / f'reversed{number:03d}.png')
+        source = str(frames_folder / 'reversed%03d.png')
+    scratch_folder = tmp_path / 'scratch'
+    scratch_folder.mkdir()
+    expected = video_process.splice_video_png(ffmpeg, scratch_folder / clip.name, source, ROW_WIDTH,
+                                              keep_intermediates=False)
+
+    assert np.array_equal(np.asarray(stream), np.asarray(expected))
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+def test_stream_pipeline_matches_png_pipeline(video_process, model_folder, clip, tmp_path, reverse):
+    heights = np.linspace(2000, 500, 40)
+    outputs = {}
+    for pipeline in ['stream', 'png']:
+        options = video_process.ProcessOptions(model_folder=str(model_folder), pipeline=pipeline,
+                                               encoder=video_process.encoder_options('npy'), skip_intermediates=True)
+        task = video_process.VideoTask(file=str(clip), height_file=None, pic_path=str(tmp_path / pipeline),
+                                       target_video_path=None, target_height_path=None,
+                                       heights=heights[::-1] if reverse else heights)
+        output_path, _, _ = video_process.process_file(task, options)
+        outputs[pipeline] = np.load(output_path)
+
+    if reverse:
+        # png 流程拼接重新编码的倒放视频, 流式流程直接按倒序放置原视频的帧, 两者只有编码损失带来的细微差别
+        assert video_process.image_difference(outputs['stream'], outputs['png']) < 4
+    else:
+        assert np.array_equal(outputs['stream'], outputs['png'])
+
+
+@pytest.fixture
+def segment_clip(tmp_path):
+    """足够分为 3 段的合成视频(每段不少于 SEGMENT_MIN_FRAMES 帧)"""
+    pytest.importorskip('cv2')
+    from benchmark import make_clip
+
+    video_path = tmp_path / 'segments.avi'
+    make_clip(video_path, 120)
+    return video_path
+
+
+def segment_decoder(video_process, model_folder, decoder_name):
+    if decoder_name == 'pyav':
+        pytest.importorskip('av')
+    decoder = video_process.create_decoder(decoder_name, model_folder)
+    if decoder_name == 'ffmpeg' and not decoder.ffprobe.exists():
+        # ffmpeg 后端按 ffprobe 读取的帧率定位
+        pytest.skip('ffprobe is not available')
+    return decoder
+
+
+# 抽帧后剩余 100 帧, 其中有连续和间隔的帧
+DECIMATED = [index for index in range(120) if index % 6 != 3]
+
+
+@pytest.mark.parametrize('decoder_name', ['ffmpeg', 'opencv', 'pyav'])
+@pytest.mark.parametrize('frame_indices', [None, DECIMATED])
+@pytest.mark.parametrize('reverse', [False, True])
+def test_segmented_composite_matches_serial(video_process, model_folder, segment_clip, capsys, decoder_name,
+                                            frame_indices, reverse):
+    decoder = segment_decoder(video_process, model_folder, decoder_name)
+    frame_count = len(frame_indices) if frame_indices else 120
+    serial = video_process.splice_video_stream(decoder, str(segment_clip), ROW_WIDTH, frame_count, reverse=reverse,
+                                               frame_indices=frame_indices)
+    for segments in [2, 3]:
+        assert len(video_process.segment_bounds(frame_count, segments)) == segments
+        capsys.readouterr()
+        segmented = video_process.splice_video_segments(decoder, str(segment_clip), ROW_WIDTH, frame_count, segments,
+                                                        reverse=reverse, frame_indices=frame_indices)
+        # 接缝校验通过, 没有退回到串行拼接
+        output = capsys.readouterr().out
+        assert 'could not be verified' not in output and 'failed' not in output
+        assert np.array_equal(np.asarray(segmented), np.asarray(serial))
+
+
+class LateSeekDecoder:
+    """模拟定位不准确的解码器: 从中间开始解码时比请求的位置晚一帧"""
+
+    def __init__(self, decoder):
+        self.decoder = decoder
+
+    def frames(self, video_path, rows=None, frame_indices=None, frame_range=None):
+        frames = self.decoder.frames(video_path, rows=rows, frame_indices=frame_indices, frame_range=frame_range)
+        if frame_range and frame_range[0] > 0:
+            next(frames, None)
+        yield from frames
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+def test_segments_fall_back_to_serial_when_seams_differ(video_process, model_folder, segment_clip, capsys, reverse):
+    decoder = segment_decoder(video_process, model_folder, 'opencv')
+    serial = video_process.splice_video_stream(decoder, str(segment_clip), ROW_WIDTH, 120, reverse=reverse)
+
+    capsys.readouterr()
+    segmented = video_process.splice_video_segments(LateSeekDecoder(decoder), str(segment_clip), ROW_WIDTH, 120, 3,
+                                                    reverse=reverse)
+    assert 'could not be verified, splicing it serially' in capsys.readouterr().out
+    assert np.array_equal(np.asarray(segmented), np.asarray(serial))
+
+
+def test_seams_match(video_process):
+    strips = random_strips(12, seed=3)
+    lead_overlap = 4
+    # (RGB, Alpha, 帧数, 最先解码的条带, 最后解码的条带), 只有条带参与校验
+    first = (None, None, 6, strips[:lead_overlap], strips[4:8])
+    second = (None, None, 6, strips[4:8], strips[8:])
+    assert video_process.seams_match([first, second], lead_overlap)
+    # 末尾的空段可以忽略, 中间的空段不行
+    assert video_process.seams_match([first, second, None], lead_overlap)
+    assert not video_process.seams_match([first, None, second], lead_overlap)
+    # 重复解码的帧不一致(定位偏差)
+    assert not video_process.seams_match([first, (None, None, 6, strips[5:9], strips[8:])], lead_overlap)
+    # 画面静止时无法确认定位准确
+    still = [strips[0]] * lead_overlap
+    assert not video_process.seams_match([(None, None, 6, still, still), (None, None, 6, still, still)],
+                                         lead_overlap)
+
+
+@pytest.mark.parametrize('output_format', ['png', 'png_fast', 'webp', 'jpeg', 'npy'])
+def test_save_composite_round_trip(video_process, tmp_path, output_format):
+    # 平滑渐变加少量噪声, 接近真实的拼接图, JPEG 的损失较小
+    rows, columns = np.mgrid[0:1440, 0:640]
+    rgb = np.dstack([rows * 255 // 1439, columns * 255 // 639, (rows + columns) % 256]).astype(np.int16)
+    rgb += np.random.default_rng(0).integers(-3, 4, size=rgb.shape)
+    rgb = np.clip(rgb, 0, 255).astype(np.uint8)
+    encoder = video_process.encoder_options(output_format)
+    output_path = video_process.save_composite(Image.fromarray(rgb), tmp_path / 'plant', encoder)
+    assert output_path.endswith(video_process.OUTPUT_EXTENSIONS[output_format])
+
+    if output_format == 'npy':
+        decoded = np.load(output_path)
+    else:
+        with Image.open(output_path) as image:
+            decoded = np.asarray(image.convert('RGB'))
+    assert decoded.shape == (1440, 640, 3)
+    if output_format == 'jpeg':
+        # 有损编码, 只检查大致相同
+        assert video_process.image_difference(decoded, rgb) < 4
+    else:
+        # png、png_fast、无损 WebP 和 npy 逐位还原
+        assert np.array_equal(decoded, rgb)
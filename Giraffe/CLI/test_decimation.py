@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('heights, step, kept', [
+    ([0, 1, 2, 5, 6, 10, 10.5, 11], 3, [0, 3, 5, 7]),
+    # 高度下降时按高度差的绝对值判断
+    ([11, 10.5, 10, 6, 5, 2, 1, 0], 3, [0, 3, 5, 7]),
+    # 与上一保留帧(而非上一帧)比较, 缓慢移动时仍会累积到步长
+    ([0, 1, 2, 3, 4, 5, 6], 2.5, [0, 3, 6]),
+    # 首尾帧始终保留
+    ([0, 0.1, 0.2], 10, [0, 2]),
+    ([5], 1, [0]),
+    ([0, 1, 2, 3], 0, [0, 1, 2, 3]),
+])
+def test_select_frames(video_process, heights, step, kept):
+    assert video_process.select_frames(heights, step) == kept
+
+
+def run(video_process, model_folder, clip, folder, heights, **settings):
+    options = video_process.ProcessOptions(model_folder=str(model_folder), encoder=video_process.encoder_options('npy'),
+                                           **settings)
+    task = video_process.VideoTask(file=str(clip), height_file=None, pic_path=str(folder), target_video_path=None,
+                                   target_height_path=None, heights=heights)
+    output_path, spliced_heights, _ = video_process.process_file(task, options)
+    return np.load(output_path), spliced_heights
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+def test_decimate_tolerance(video_process, model_folder, clip, tmp_path, capsys, reverse):
+    heights = list(np.linspace(2000, 500, 40))
+    if reverse:
+        heights = heights[::-1]
+    processed = sorted(heights, reverse=True)
+    kept = video_process.select_frames(processed, 100)
+    full, full_heights = run(video_process, model_folder, clip, tmp_path / 'full', heights)
+    assert full_heights == processed
+
+    # 容差足够大时保留抽帧结果, 高度序列只包含保留的帧
+    decimated, decimated_heights = run(video_process, model_folder, clip, tmp_path / 'decimated', heights,
+                                       min_height_step=100, decimate_tolerance=255)
+    assert decimated_heights == [processed[index] for index in kept]
+    assert 0 < len(kept) < len(heights)
+    assert not np.array_equal(decimated, full)
+    assert 'using all frames' not in capsys.readouterr().out
+
+    # 超出容差时改用全部帧的拼接结果和高度序列
+    checked, checked_heights = run(video_process, model_folder, clip, tmp_path / 'checked', heights,
+                                   min_height_step=100, decimate_tolerance=0)
+    assert 'difference exceeds tolerance 0, using all frames' in capsys.readouterr().out
+    assert checked_heights == processed
+    assert np.array_equal(checked, full)
+
+
+def test_index_expressions():
+    from video_decoders import drop_expressions, index_ranges, select_filter
+
+    indices = [0, 1, 2, 5, 7, 8, 20]
+    assert index_ranges(indices) == [(0, 2), (5, 5), (7, 8), (20, 20)]
+    assert select_filter(indices) == \
+        "select=between(n\\,0\\,2)+eq(n\\,5)+between(n\\,7\\,8)+eq(n\\,20)"
+    # 过长的表达式分为多个, 合起来保留全部帧
+    expressions = drop_expressions(list(range(0, 3000, 2)))
+    assert len(expressions) > 1
+    assert all(len(expression) <= 8000 + len('not()') for expression, _ in expressions)
+    assert [count for _, count in drop_expressions([0, 1, 2, 5, 7, 8, 20], limit=40)] == [4, 3]
+    assert sum(count for _, count in expressions) == 1500
+
+
+@pytest.fixture
+def long_clip(tmp_path, request):
+    pytest.importorskip('cv2')
+    from benchmark import make_clip
+
+    video_path = tmp_path / f'long{request.param}'
+    make_clip(video_path, 150)
+    return video_path
+
+
+# 间隔各不相同: 相邻、稀疏, 以及超过 OpenCV 定位阈值的长间隔
+FRAME_INDICES = [0, 1, 2, 5, 9, 10, 11, 30, 31, 99, 100, 149]
+
+
+@pytest.mark.parametrize('long_clip', ['.avi', '.mp4'], indirect=True)
+@pytest.mark.parametrize('decoder_name', ['ffmpeg', 'opencv', 'pyav'])
+@pytest.mark.parametrize('band_decode', [True, False])
+def test_decoders_return_the_selected_frames(video_process, model_folder, long_clip, monkeypatch, decoder_name,
+                                             band_decode):
+    import video_decoders
+
+    if decoder_name == 'pyav':
+        pytest.importorskip('av')
+    decoder = video_decoders.create_decoder(decoder_name, model_folder, band_decode)
+    rows = (226, 255)
+    everything = [pixels.copy() for pixels in decoder.frames(str(long_clip), rows)]
+
+    calls = []
+    read_raw_frames = video_decoders.read_raw_frames
+
+    def recording_read(*args, **kwargs):
+        calls.append(kwargs)
+        return read_raw_frames(*args, **kwargs)
+
+    monkeypatch.setattr(video_decoders, 'read_raw_frames', recording_read)
+    # 限制表达式长度, 丢包表达式分为多次运行, select 滤镜经由 -filter_script 传入
+    monkeypatch.setattr(video_decoders, 'ARGUMENT_LIMIT', 60)
+    selected = [pixels.copy() for pixels in decoder.frames(str(long_clip), rows, frame_indices=FRAME_INDICES)]
+
+    assert len(selected) == len(FRAME_INDICES)
+    assert all(np.array_equal(a, everything[index]) for a, index in zip(selected, FRAME_INDICES))
+    if decoder_name == 'ffmpeg':
+        # MJPG(avi)在解码之前丢包, mp4v 在解码之后由 select 滤镜选帧
+        dropped = any('-bsf:v' in call.get('input_args', ()) for call in calls)
+        assert dropped == (long_clip.suffix == '.avi' and decoder.drops_packets(str(long_clip)))
+        if dropped:
+            assert len(calls) > 1
+        else:
+            assert len(calls) == 1 and len(calls[0]['video_filter']) > 60
@@ -0,0 +1,87 @@
+import os
+import shutil
+
+import pytest
+
+import file_staging
+from file_staging import atomic_write, stage_file
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(b'video data')
+    return path
+
+
+def fail(*args, **kwargs):
+    raise OSError('not supported')
+
+
+def leftovers(folder):
+    return [name for name in os.listdir(folder) if name.startswith('.')]
+
+
+def test_auto_prefers_a_hardlink(tmp_path, source):
+    destination = tmp_path / 'raw.mp4'
+    assert stage_file(source, destination) == 'hardlink'
+    assert os.path.samefile(source, destination)
+    # 目标已是源文件的硬链接时不重新暂存
+    assert stage_file(source, destination) == 'hardlink'
+    assert leftovers(tmp_path) == []
+
+
+def test_auto_falls_back_to_reflink_then_copy(tmp_path, source, monkeypatch):
+    destination = tmp_path / 'raw.mp4'
+    monkeypatch.setattr(os, 'link', fail)
+    # 模拟支持 reflink 的文件系统
+    monkeypatch.setattr(file_staging, 'reflink', shutil.copyfile)
+    assert stage_file(source, destination) == 'reflink'
+    assert destination.read_bytes() == b'video data'
+
+    monkeypatch.setattr(file_staging, 'reflink', fail)
+    destination.write_bytes(b'old data')
+    assert stage_file(source, destination) == 'copy'
+    assert destination.read_bytes() == b'video data'
+    assert not os.path.samefile(source, destination)
+    assert leftovers(tmp_path) == []
+
+
+def test_symlink_and_its_fallback(tmp_path, source, monkeypatch):
+    destination = tmp_path / 'raw.mp4'
+    assert stage_file(source, destination, 'symlink') == 'symlink'
+    assert os.readlink(destination) == str(source)
+
+    monkeypatch.setattr(os, 'symlink', fail)
+    assert stage_file(source, destination, 'symlink') == 'copy'
+    assert not destination.is_symlink() and destination.read_bytes() == b'video data'
+
+    assert stage_file(source, tmp_path / 'copied.mp4', 'copy') == 'copy'
+    assert leftovers(tmp_path) == []
+
+
+def test_atomic_write_replaces_the_target(tmp_path):
+    target = tmp_path / 'heights.txt'
+    target.write_text('old\n')
+    with atomic_write(target) as f:
+        f.write('new\n')
+        # 写入过程中目标文件仍是完整的旧内容
+        assert target.read_text() == 'old\n'
+        assert len(leftovers(tmp_path)) == 1
+    assert target.read_text() == 'new\n'
+    assert leftovers(tmp_path) == []
+
+    with atomic_write(tmp_path / 'data.f64', 'wb') as f:
+        f.write(b'\x00' * 8)
+    assert (tmp_path / 'data.f64').read_bytes() == b'\x00' * 8
+
+
+def test_atomic_write_keeps_the_target_on_error(tmp_path):
+    target = tmp_path / 'heights.txt'
+    target.write_text('old\n')
+    with pytest.raises(RuntimeError):
+        with atomic_write(target) as f:
+            f.write('partial')
+            raise RuntimeError('interrupted')
+    assert target.read_text() == 'old\n'
+    assert leftovers(tmp_path) == []
@@ -0,0 +1,101 @@
+import statistics
+
+import numpy as np
+import pytest
+
+interpolate = pytest.importorskip('scipy.interpolate')
+
+
+def baseline_replace_abnormal_data(data):
+    """原有的逐点实现"""
+    replaced_data = []
+    start_position_median = statistics.median(data[0:4])
+    end_position_median = statistics.median(data[-5:-1])
+    replaced_data.append(data[0])
+
+    if start_position_median > end_position_median:
+        for i in range(len(data) - 1):
+            replaced_data.append(data[i + 1] if data[i] > data[i + 1] else np.nan)
+    elif start_position_median < end_position_median:
+        for i in range(len(data) - 1):
+            replaced_data.append(data[i + 1] if data[i] < data[i + 1] else np.nan)
+    else:
+        for i in range(len(data) - 1):
+            replaced_data.append(np.nan)
+
+    return replaced_data
+
+
+def baseline_fill_nan(data):
+    """原有的 scipy interp1d 实现"""
+    nan_indices = np.isnan(data)
+    indices = np.arange(len(data))
+    non_nan_indices = indices[~nan_indices]
+    non_nan_values = np.array(data)[~nan_indices]
+    interp_func = interpolate.interp1d(non_nan_indices, non_nan_values, kind='linear', fill_value='extrapolate')
+    filled_values = interp_func(indices)
+    last_valid_index = np.max(non_nan_indices)
+    if nan_indices[-1]:
+        filled_values[last_valid_index:] = filled_values[non_nan_indices[-1]]
+
+    return filled_values
+
+
+def height_series(seed, frames=300):
+    """带噪声和异常跳变的高度序列, 随机上升或下降, 部分序列末尾违反变化趋势"""
+    rng = np.random.default_rng(seed)
+    heights = np.linspace(2400, 400, frames) + rng.normal(0, 4, frames)
+    spikes = rng.choice(frames, size=5, replace=False)
+    heights[spikes] += rng.choice([-1, 1], size=5) * rng.uniform(200, 600, 5)
+    if seed % 3 == 1:
+        heights[-3:] = heights[-4] + 50
+    if seed % 2:
+        heights = heights[::-1]
+    return np.round(heights, 1)
+
+
+@pytest.mark.parametrize('seed', range(12))
+def test_smooth_height_file_matches_baseline(video_process, tmp_path, seed):
+    raw_file = tmp_path / f'plant-{seed}.txt'
+    raw_file.write_text(''.join(f"{height}\n" for height in height_series(seed)))
+    smoothed_folder = tmp_path / 'smoothed'
+    smoothed_folder.mkdir()
+
+    report = video_process.smooth_height_file(str(raw_file), str(smoothed_folder), write_text=True)
+
+    with open(raw_file) as f:
+        heights = [float(line.strip()) for line in f.readlines()]
+    expected = baseline_fill_nan(baseline_replace_abnormal_data(heights))
+    expected_text = '\n'.join(str(round(x, 1)) for x in expected)
+
+    assert report['status'] == 'smoothed'
+    assert (smoothed_folder / raw_file.name).read_text() == expected_text
+    assert np.array_equal(report['heights'], [round(x, 1) for x in expected])
+
+
+def test_abnormal_height_file_is_reported(video_process, tmp_path):
+    raw_file = tmp_path / 'stuck.txt'
+    raw_file.write_text(''.join(f"{height}\n" for height in [1500.0] * 40 + list(np.linspace(1400, 400, 200))))
+
+    report = video_process.smooth_height_file(str(raw_file), str(tmp_path))
+
+    assert report['status'] == 'abnormal'
+    assert [reason['check'] for reason in report['reasons']] == ['head_repeat']
+
+
+@pytest.mark.parametrize('heights', [
+    # 起止中位数相同, 除第一个值外全部标为 NaN
+    [1500.0, 1400.0, 1500.0, 1400.0, 1500.0, 1400.0, 1500.0, 1400.0],
+    [1500.0, 1500.0],
+    [1500.0, np.nan, np.nan, np.nan, np.nan, np.nan],
+])
+def test_single_valid_value_is_abnormal(video_process, tmp_path, heights):
+    raw_file = tmp_path / 'single.txt'
+    raw_file.write_text(''.join(f"{height}\n" for height in heights))
+
+    report = video_process.smooth_height_file(str(raw_file), str(tmp_path), write_text=True)
+
+    assert report['status'] == 'abnormal'
+    assert report['reasons'] == [{'check': 'valid_values', 'count': 1}]
+    assert 'heights' not in report
+    assert raw_file.read_text() == ''.join(f"{height}\n" for height in heights)
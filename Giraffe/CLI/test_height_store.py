@@ -0,0 +1,106 @@
+import json
+
+from height_store import HeightStore, load_heights, store_paths, write_store
+
+
+def index_lines(folder, node=None):
+    with open(store_paths(str(folder), node)[1]) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_later_update_overrides_earlier(tmp_path):
+    store = HeightStore(str(tmp_path))
+    store.append('plant-1', [1000.0, 900.0])
+    store.update({'plant-1': [800.0, 700.0, 600.0], 'plant-2': [500.0]})
+
+    assert store.get('plant-1').tolist() == [800.0, 700.0, 600.0]
+    # 重新读取时同样以后写入的为准, 旧数据仍留在数据文件中
+    reloaded = HeightStore(str(tmp_path))
+    assert reloaded.get('plant-1').tolist() == [800.0, 700.0, 600.0]
+    assert reloaded.get('plant-2').tolist() == [500.0]
+    assert [entry['label'] for entry in index_lines(tmp_path)] == ['plant-1', 'plant-1', 'plant-2']
+    assert reloaded.get('plant-3') is None
+
+
+def test_shards_merge_by_recorded(tmp_path):
+    write_store(str(tmp_path), {'plant-1': [1.0], 'plant-2': [2.0]}, recorded={'plant-1': 10, 'plant-2': 30})
+    write_store(str(tmp_path), {'plant-1': [11.0], 'plant-2': [12.0]}, node='a',
+                recorded={'plant-1': 20, 'plant-2': 20})
+    write_store(str(tmp_path), {'plant-1': [21.0], 'plant-3': [23.0]}, node='b', recorded={'plant-1': 15, 'plant-3': 5})
+
+    store = HeightStore(str(tmp_path))
+    # 按写入时间取最新的序列, 与主存储和分片的读取顺序无关
+    assert {label: store.get(label).tolist() for label in store.labels()} == \
+        {'plant-1': [11.0], 'plant-2': [2.0], 'plant-3': [23.0]}
+    # 节点读取时同样合并所有分片, 写入只追加到本节点的分片
+    node_store = HeightStore(str(tmp_path), node='b')
+    assert node_store.get('plant-1').tolist() == [11.0]
+    node_store.append('plant-1', [31.0])
+    assert HeightStore(str(tmp_path)).get('plant-1').tolist() == [31.0]
+    assert [entry['label'] for entry in index_lines(tmp_path, 'b')] == ['plant-1', 'plant-3', 'plant-1']
+
+
+def test_compact_keeps_the_newest_record(tmp_path):
+    write_store(str(tmp_path), {'plant-1': [1.0, 2.0], 'plant-2': [3.0]}, recorded={'plant-1': 10, 'plant-2': 10})
+    write_store(str(tmp_path), {'plant-1': [4.0]}, node='a', recorded={'plant-1': 20})
+    store = HeightStore(str(tmp_path))
+    store.update({'plant-2': [5.0, 6.0]})
+    store.update({'plant-2': [7.0]})
+    newest = {label: (store.get(label).tolist(), store.index[label][3]) for label in store.labels()}
+
+    store.compact()
+    # 主存储合并分片的数据, 每个样本只保留一条记录, 写入时间不变
+    assert [entry['label'] for entry in index_lines(tmp_path)] == ['plant-1', 'plant-2']
+    assert newest == {'plant-1': ([4.0], 20), 'plant-2': ([7.0], newest['plant-2'][1])}
+    for store in (store, HeightStore(str(tmp_path))):
+        assert {label: (store.get(label).tolist(), store.index[label][3]) for label in store.labels()} == newest
+    assert (tmp_path / 'heights.f64').stat().st_size == 2 * 8
+
+    # 节点压缩只保留本节点写入的序列
+    HeightStore(str(tmp_path), node='a').compact()
+    assert [entry['label'] for entry in index_lines(tmp_path, 'a')] == ['plant-1']
+
+
+def test_export_text_matches_the_text_files(video_process, tmp_path):
+    raw = tmp_path / 'raw'
+    raw.mkdir()
+    (raw / 'plant-1.txt').write_text('\n'.join(['1500.04', '1480.0', '1490.0', '1400.0', '1333.333', '1300.0', '1250.0',
+                                                 '1200.0']) + '\n')
+    (raw / 'plant-2.txt').write_text('\n'.join(str(1000 + 0.1 * i) for i in range(40)))
+
+    # 流程直接写出的 smoothed / processed 文本文件
+    text = {'smoothed': tmp_path / 'smoothed', 'processed': tmp_path / 'processed'}
+    series = {}
+    for folder in text.values():
+        folder.mkdir()
+    for path in sorted(raw.iterdir()):
+        report = video_process.smooth_height_file(str(path), str(text['smoothed']), write_text=True)
+        assert report['status'] == 'smoothed'
+        series[report['label']] = report['heights']
+        video_process.write_processed_heights(str(text['processed'] / path.name), report['heights'][::-1].tolist())
+
+    write_store(str(tmp_path / 'store'), series)
+    store = HeightStore(str(tmp_path / 'store'))
+    store.export_text(str(tmp_path / 'exported' / 'smoothed'), trailing_newline=False)
+    store.update({label: values[::-1] for label, values in series.items()})
+    store.export_text(str(tmp_path / 'exported' / 'processed'))
+
+    for name, folder in text.items():
+        for path in sorted(folder.iterdir()):
+            assert (tmp_path / 'exported' / name / path.name).read_bytes() == path.read_bytes()
+
+
+def test_load_heights_falls_back_to_text(tmp_path):
+    (tmp_path / 'plant-1.txt').write_text('1200.0\n1100.5\n')
+    (tmp_path / 'plant-2.txt').write_text('999.0\n')
+    write_store(str(tmp_path), {'plant-2': [900.0, 800.0]})
+
+    assert load_heights(str(tmp_path), 'plant-1').tolist() == [1200.0, 1100.5]
+    # 存储中已有的样本优先于文本文件
+    assert load_heights(str(tmp_path), 'plant-2').tolist() == [900.0, 800.0]
+    store = HeightStore(str(tmp_path))
+    assert load_heights(str(tmp_path), 'plant-2', store).tolist() == [900.0, 800.0]
+    assert load_heights(str(tmp_path), 'plant-3', store) is None
+    # 单行文本文件同样读为一维序列
+    (tmp_path / 'plant-4.txt').write_text('1000.0')
+    assert load_heights(str(tmp_path), 'plant-4', store).tolist() == [1000.0]
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from height_store import heights_at
+
+
+def baseline_height(y, heights):
+    """原有的 get_height_from_y"""
+    height_index = int(y * len(heights))
+    return float(heights[height_index]) / 10
+
+
+@pytest.mark.parametrize('frames', [1, 7, 40, 1440])
+def test_default_matches_baseline(frames):
+    rng = np.random.default_rng(frames)
+    heights = list(rng.uniform(400, 2400, frames))
+    # 随机位置, 各条带的边界 i / n, 以及紧挨 1.0 的最后一个浮点数
+    y = np.concatenate([rng.random(500), np.arange(frames) / frames, [np.nextafter(1.0, 0.0)]])
+
+    expected = [baseline_height(value, heights) for value in y]
+    assert heights_at(y, heights).tolist() == expected
+    assert [float(heights_at(value, heights)) for value in y[:20]] == expected[:20]
+
+    # y = 1.0 原先越界(IndexError), 现在取最后一帧
+    with pytest.raises(IndexError):
+        baseline_height(1.0, heights)
+    assert heights_at(1.0, heights) == heights[-1] / 10
+    assert heights_at([-0.1, 1.5], heights).tolist() == [heights[0] / 10, heights[-1] / 10]
+
+
+def test_interpolate():
+    heights = [1000, 2000, 3000, 4000]
+    # 各条带中心取该帧的高度, 中心之间线性插值, 首尾条带中心之外取首尾帧
+    y = [0, 0.125, 0.25, 0.375, 0.5, 0.875, 1.0]
+    assert heights_at(y, heights, interpolate=True).tolist() == [100, 100, 150, 200, 250, 400, 400]
+
+    rng = np.random.default_rng(0)
+    heights = rng.uniform(400, 2400, 300)
+    y = rng.random(1000)
+    expected = np.interp(y * len(heights) - 0.5, np.arange(len(heights)), heights) / 10
+    assert np.array_equal(heights_at(y, heights, interpolate=True), expected)
+
+
+@pytest.mark.parametrize('interpolate', [False, True])
+def test_plant_row(output_analysis, tmp_path, interpolate):
+    heights = np.random.default_rng(1).uniform(400, 2400, 200)
+    architecture = (0.1, [0.3, 0.45, 0.6], 3, 0.7, 1, [0.7])
+    row = output_analysis.plant_row('plant', heights, architecture, str(tmp_path), interpolate)
+
+    if interpolate:
+        def convert(y):
+            return float(np.interp(y * len(heights) - 0.5, np.arange(len(heights)), heights)) / 10
+    else:
+        def convert(y):
+            return baseline_height(y, heights)
+    assert row == ['plant', round(convert(0.1), 2), [round(convert(y), 2) for y in [0.3, 0.45, 0.6]], 3,
+                   round(convert(0.7), 2), 1]
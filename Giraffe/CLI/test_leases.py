@@ -0,0 +1,148 @@
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from leases import LeaseDirectory, holds_lease
+
+LABELS = [f'plant-{index:02d}' for index in range(40)]
+
+
+def expire(leases, label):
+    """将租约的修改时间改到 ttl 之前, 模拟持有节点崩溃后不再刷新"""
+    past = time.time() - leases.ttl - 10
+    os.utime(leases.path(label), (past, past))
+
+
+def test_claim_and_conflict(tmp_path):
+    first = LeaseDirectory(str(tmp_path), 'a')
+    second = LeaseDirectory(str(tmp_path), 'b')
+
+    assert first.claim('plant') == (True, None)
+    assert first.held == {'plant'}
+
+    claimed, record = second.claim('plant')
+    assert not claimed
+    assert (record['state'], record['node']) == ('running', 'a')
+    assert second.active() == ['plant']
+    assert first.active() == []
+
+    # 释放后其他节点可以立即接手
+    first.release('plant')
+    assert first.held == set()
+    assert second.claim('plant') == (True, None)
+
+
+def test_expired_lease_is_reclaimed(tmp_path, capsys):
+    crashed = LeaseDirectory(str(tmp_path), 'a', ttl=60)
+    crashed.claim('plant')
+    other = LeaseDirectory(str(tmp_path), 'b', ttl=60)
+
+    expire(crashed, 'plant')
+    assert other.claim('plant') == (True, None)
+    assert other.read('plant')['node'] == 'b'
+
+    # 原节点的心跳发现租约已被回收, 不再持有该租约
+    capsys.readouterr()
+    assert not crashed.heartbeat('plant')
+    assert crashed.held == set()
+    assert 'Lost the lease of plant' in capsys.readouterr().out
+    assert other.heartbeat('plant')
+
+
+def test_lost_lease_is_not_released_or_completed(tmp_path, capsys):
+    stale = LeaseDirectory(str(tmp_path), 'a', ttl=60)
+    stale.claim('plant')
+    other = LeaseDirectory(str(tmp_path), 'b', ttl=60)
+    expire(stale, 'plant')
+    assert other.claim('plant') == (True, None)
+
+    # 原节点未察觉租约已被回收, 释放和完成都不能改动其他节点的租约
+    assert not stale.owns('plant')
+    stale.release('plant')
+    assert stale.held == set()
+    assert (other.read('plant')['state'], other.read('plant')['node']) == ('running', 'b')
+    assert LeaseDirectory(str(tmp_path), 'c', ttl=60).claim('plant')[0] is False
+
+    stale.held.add('plant')
+    assert not stale.complete('plant', {'status': 'processed', 'outputs': []})
+    assert stale.held == set()
+    assert (other.read('plant')['state'], other.read('plant')['node']) == ('running', 'b')
+    assert holds_lease(other.path('plant'), 'b') and not holds_lease(other.path('plant'), 'a')
+
+    # 持有租约的节点照常完成
+    assert other.owns('plant')
+    assert other.complete('plant', {'status': 'processed', 'outputs': []})
+    assert other.read('plant')['state'] == 'done'
+    stale.held.add('plant')
+    stale.release('plant')
+    assert other.read('plant')['node'] == 'b'
+    assert not [name for name in os.listdir(tmp_path / '.leases') if not name.endswith('.lease')]
+
+
+def test_failed_heartbeat_drops_the_lease(tmp_path, monkeypatch, capsys):
+    leases = LeaseDirectory(str(tmp_path), 'a')
+    leases.claim('plant')
+
+    def utime(*args, **kwargs):
+        raise PermissionError('read-only share')
+
+    monkeypatch.setattr(os, 'utime', utime)
+    assert not leases.heartbeat('plant')
+    assert leases.held == set()
+    assert 'read-only share' in capsys.readouterr().out
+
+
+def test_heartbeat_keeps_the_lease_alive(tmp_path):
+    with LeaseDirectory(str(tmp_path), 'a', ttl=0.6) as leases:
+        leases.claim('plant')
+        time.sleep(1.2)
+        assert leases.held == {'plant'}
+        assert LeaseDirectory(str(tmp_path), 'b', ttl=0.6).claim('plant')[0] is False
+    # 退出时释放仍持有的租约
+    assert leases.read('plant') is None
+
+
+def test_done_records(tmp_path):
+    first = LeaseDirectory(str(tmp_path), 'a')
+    first.claim('plant')
+    first.complete('plant', {'status': 'processed', 'outputs': ['plant.png']})
+    assert first.held == set()
+
+    second = LeaseDirectory(str(tmp_path), 'b', ttl=60)
+    expire(second, 'plant')
+    # 完成记录不会过期, 也不计入其他节点的活动租约
+    claimed, record = second.claim('plant')
+    assert not claimed
+    assert (record['state'], record['node'], record['outputs']) == ('done', 'a', ['plant.png'])
+    assert second.active() == []
+
+    # 输入或参数变化后重新获取
+    assert second.reclaim_done('plant')
+    assert second.read('plant')['state'] == 'running'
+    assert not first.reclaim_done('plant')
+
+
+def claim_all(folder, node):
+    leases = LeaseDirectory(folder, node, ttl=60)
+    labels = random.Random(node).sample(LABELS, len(LABELS))
+    return [label for label in labels if leases.claim(label)[0]]
+
+
+@pytest.mark.parametrize('expired', [False, True])
+def test_processes_claim_each_label_once(tmp_path, expired):
+    if expired:
+        # 所有样本都由已崩溃的节点持有, 各进程同时回收
+        crashed = LeaseDirectory(str(tmp_path), 'crashed', ttl=60)
+        for label in LABELS:
+            crashed.claim(label)
+            expire(crashed, label)
+
+    nodes = [f'node-{index}' for index in range(4)]
+    with ProcessPoolExecutor(max_workers=len(nodes)) as executor:
+        claimed = list(executor.map(claim_all, [str(tmp_path)] * len(nodes), nodes))
+
+    assert sorted(label for labels in claimed for label in labels) == LABELS
+    assert not [name for name in os.listdir(tmp_path / '.leases') if not name.endswith('.lease')]
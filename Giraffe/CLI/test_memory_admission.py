@@ -0,0 +1,111 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+
+class FakeRunner:
+    """代替 process_file: 记录同时运行的任务及其预估内存之和, 文件名含 'broken' 的任务抛出异常"""
+
+    def __init__(self, estimates):
+        self.estimates = estimates
+        self.lock = threading.Lock()
+        self.running = set()
+        self.overlaps = []
+
+    def __call__(self, task, options):
+        with self.lock:
+            self.running.add(task.file)
+            self.overlaps.append(set(self.running))
+        time.sleep(0.02)
+        with self.lock:
+            self.running.remove(task.file)
+        if 'broken' in task.file:
+            raise RuntimeError('decoder failed')
+        return task.file.upper()
+
+    def peak_memory(self):
+        return max(sum(self.estimates[file] for file in running) for running in self.overlaps)
+
+
+def admit(video_process, monkeypatch, estimates, max_workers, memory_budget):
+    runner = FakeRunner(estimates)
+    monkeypatch.setattr(video_process, 'process_file', runner)
+    tasks = [video_process.VideoTask(file=file, height_file=None, pic_path=None, target_video_path=None,
+                                     target_height_path=None) for file in estimates]
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        video_process.run_admitted_tasks(pool, tasks, None, list(estimates.values()), max_workers, memory_budget,
+                                         on_success=lambda task, result: results.append((task.file, result)))
+    return runner, sorted(results)
+
+
+def test_admitted_memory_stays_within_budget(video_process, monkeypatch):
+    estimates = {'a': 40, 'b': 30, 'c': 30, 'd': 20, 'e': 50, 'f': 10, 'g': 10, 'h': 25}
+    runner, results = admit(video_process, monkeypatch, estimates, 4, 60)
+
+    assert runner.peak_memory() <= 60
+    # 预算允许时同时运行多个任务
+    assert max(len(running) for running in runner.overlaps) > 1
+    assert results == [(file, file.upper()) for file in sorted(estimates)]
+
+
+def test_oversized_video_runs_alone(video_process, monkeypatch):
+    estimates = {'small-1': 10, 'huge': 100, 'small-2': 10, 'small-3': 10}
+    runner, results = admit(video_process, monkeypatch, estimates, 4, 50)
+
+    # 超出预算的视频仍会处理, 但只在没有其他任务运行时开始, 运行期间也不再接纳新任务
+    assert [running for running in runner.overlaps if 'huge' in running] == [{'huge'}]
+    assert runner.peak_memory() == 100
+    assert [file for file, _ in results] == sorted(estimates)
+
+
+def test_errors_are_reported_per_video(video_process, monkeypatch, capsys):
+    estimates = {'plant-1': 10, 'broken-1': 10, 'plant-2': 10, 'broken-2': 10}
+    _, results = admit(video_process, monkeypatch, estimates, 2, 100)
+
+    out = capsys.readouterr().out
+    assert 'Error processing broken-1: decoder failed' in out
+    assert 'Error processing broken-2: decoder failed' in out
+    assert 'plant-1' not in out and 'plant-2' not in out
+    assert results == [('plant-1', 'PLANT-1'), ('plant-2', 'PLANT-2')]
+
+
+def test_probed_frame_count_is_passed_to_the_task(video_process, tmp_path, monkeypatch):
+    pytest.importorskip('cv2')
+    from benchmark import make_clip, make_heights
+
+    video_folder, height_folder = tmp_path / 'videos', tmp_path / 'heights'
+    video_folder.mkdir()
+    height_folder.mkdir()
+    for index, frames in enumerate([20, 30]):
+        make_clip(video_folder / f'plant-{index}.avi', frames, seed=index)
+        make_heights(height_folder / f'plant-{index}.txt', frames, seed=index)
+    video_process.filter_heights(str(height_folder), 1)
+    options = video_process.ProcessOptions(decoder='opencv', encoder=video_process.encoder_options('npy'), trace=True)
+
+    admitted = []
+    run_admitted_tasks = video_process.run_admitted_tasks
+
+    def recording_run(executor, tasks, options, estimates, *args, **kwargs):
+        admitted.extend(zip(tasks, estimates))
+        return run_admitted_tasks(executor, tasks, options, estimates, *args, **kwargs)
+
+    monkeypatch.setattr(video_process, 'run_admitted_tasks', recording_run)
+    video_process.process_video_thread(str(video_folder), str(height_folder), str(tmp_path / 'images'), 2, options)
+
+    assert sorted((task.label, task.frame_count, estimate) for task, estimate in admitted) == \
+        [('plant-0', 20, video_process.estimate_video_memory(20)),
+         ('plant-1', 30, video_process.estimate_video_memory(30))]
+
+    # process_file 使用任务中的帧数, 不再读取一次
+    task = admitted[0][0]
+    _, heights, records = video_process.process_file(task, options)
+    assert len(heights) == task.frame_count
+    assert 'probe' not in {record['stage'] for record in records}
+    task.frame_count = None
+    _, _, records = video_process.process_file(task, options)
+    assert 'probe' in {record['stage'] for record in records}
+    assert np.load(tmp_path / 'images' / f'{task.label}.npy').shape[0] > 0
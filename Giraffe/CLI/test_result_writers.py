@@ -0,0 +1,42 @@
+from pathlib import Path
+
+import pytest
+from openpyxl import load_workbook
+
+from result_writers import open_result_writer
+
+COLUMNS = [("Labels", 'str'), ("Height", 'float'), ("Leaf_Heights", 'list')]
+
+
+def test_lizard_copy_is_identical():
+    # 两个 CLI 目录各自独立运行, 共用的写出模块必须保持一致
+    giraffe = Path(__file__).with_name('result_writers.py')
+    lizard = Path(__file__).resolve().parents[2] / 'Lizard' / 'CLI' / 'result_writers.py'
+    assert giraffe.read_bytes() == lizard.read_bytes()
+
+
+def test_xlsx_is_saved_when_analysis_fails(tmp_path):
+    path = tmp_path / 'results.xlsx'
+    with pytest.raises(RuntimeError):
+        with open_result_writer(str(path), COLUMNS, na_value='NA') as writer:
+            writer.write(['plant-1', 1520.5, [310.0, 620.5]])
+            writer.write(['plant-2', None, []])
+            raise RuntimeError("analysis failed")
+
+    rows = list(load_workbook(path).active.values)
+    assert rows == [("Labels", "Height", "Leaf_Heights"), ('plant-1', 1520.5, '310.0, 620.5'),
+                    ('plant-2', 'NA', 'NA')]
+
+
+def test_parquet_footer_is_written_when_analysis_fails(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = tmp_path / 'results.parquet'
+    with pytest.raises(RuntimeError):
+        with open_result_writer(str(path), COLUMNS, batch_size=1) as writer:
+            writer.write(['plant-1', 1520.5, [310.0, 620.5]])
+            writer.write(['plant-2', None, []])
+            raise RuntimeError("analysis failed")
+
+    table = pq.read_table(path)
+    assert table.to_pydict() == {'Labels': ['plant-1', 'plant-2'], 'Height': [1520.5, None],
+                                 'Leaf_Heights': [[310.0, 620.5], []]}
@@ -0,0 +1,69 @@
+import json
+import time
+
+import pytest
+
+from stage_trace import METRICS, NULL_TRACE, StageTrace, TraceWriter, summarize
+
+
+def record(label, stage, wall):
+    return {'label': label, 'stage': stage, **dict.fromkeys(METRICS, 0), 'wall': wall, 'calls': 1}
+
+
+def test_stage_trace_accumulates_stages():
+    trace = StageTrace('plant')
+    for _ in range(3):
+        with trace.stage('decode'):
+            time.sleep(0.01)
+    with trace.stage('encode'), open(__file__, 'rb') as f:
+        f.read()
+
+    records = {entry['stage']: entry for entry in trace.finish()}
+    assert list(records) == ['decode', 'encode', 'total']
+    assert all(entry['label'] == 'plant' and set(METRICS) < set(entry) for entry in records.values())
+    # 同名阶段多次进入时累加
+    assert records['decode']['calls'] == 3
+    assert records['decode']['wall'] >= 0.03
+    assert records['total']['wall'] >= records['decode']['wall'] + records['encode']['wall']
+
+
+def test_disabled_trace_records_nothing():
+    with NULL_TRACE.stage('decode'):
+        pass
+    assert NULL_TRACE.finish() == []
+    assert StageTrace('plant', enabled=False).finish() == []
+
+
+def test_summarize_percentiles():
+    records = [record(f'plant-{index}', 'decode', wall) for index, wall in enumerate(range(1, 11))]
+    records.append(record('plant-0', 'encode', 2.5))
+
+    summary = summarize(records)
+    assert summary['decode']['videos'] == 10
+    # numpy 线性插值的百分位数: 1..10 的 p50 为 5.5, p95 为 9.55
+    assert summary['decode']['wall_p50'] == 5.5
+    assert summary['decode']['wall_p95'] == pytest.approx(9.55)
+    assert summary['decode']['wall_total'] == 55
+    encode = summary['encode']
+    assert (encode['videos'], encode['wall_p50'], encode['wall_p95']) == (1, 2.5, 2.5)
+    assert summary['encode']['read_bytes_p95'] == 0
+
+
+def test_trace_writer(tmp_path, capsys):
+    writer = TraceWriter(str(tmp_path))
+    writer.write([record('plant-0', 'decode', 1.0), record('plant-0', 'total', 2.0)])
+    writer.write([])
+    writer.write([record('plant-1', 'decode', 3.0), record('plant-1', 'total', 5.0)])
+    writer.close()
+
+    lines = (tmp_path / 'stage_trace.jsonl').read_text().splitlines()
+    assert [(entry['label'], entry['stage'], entry['wall']) for entry in map(json.loads, lines)] == \
+        [('plant-0', 'decode', 1.0), ('plant-0', 'total', 2.0), ('plant-1', 'decode', 3.0), ('plant-1', 'total', 5.0)]
+
+    summary = json.loads((tmp_path / 'stage_summary.json').read_text())
+    assert (summary['decode']['wall_p50'], summary['total']['wall_p50']) == (2.0, 3.5)
+    assert 'Stage trace is saved to' in capsys.readouterr().out
+
+    # 关闭计时时不写出任何文件
+    TraceWriter(str(tmp_path / 'off'), enabled=False).close()
+    assert not (tmp_path / 'off').exists()
@@ -0,0 +1,416 @@
+"""
+视频解码后端: 逐帧返回 RGB 数组(可只返回中间的若干行), 供流式拼接使用。
+
+    ffmpeg  通过 rawvideo 管道调用 ffmpeg 子进程解码, 可在解码阶段完成抽帧和裁剪(原有方式)
+    opencv  使用 OpenCV 的 VideoCapture 在进程内解码, 不启动任何子进程
+    pyav    使用 PyAV(需另行安装 av)在进程内解码, 不启动任何子进程
+
+不同后端的 YUV→RGB 转换实现不同, 解码结果之间可能存在少量像素差异。
+
+frames() 可通过 frame_indices 只返回指定序号的帧, 或通过 frame_range=(start, stop) 只返回一段连续的帧(stop 为 None
+时到视频末尾)。start 大于 0 时各后端按时间戳定位(seek)到该帧附近再开始解码, 不再解码之前的全部帧;
+定位依赖于恒定帧率的时间戳, 调用方需自行校验(见 2_Video_process.splice_video_segments)。
+
+抽帧时, 只含关键帧的编码格式(如采集使用的 MJPG)每个数据包都可单独解码, 各后端在解码之前即丢弃未选中的数据包:
+ffmpeg 使用 noise 比特流滤镜的 drop 表达式, PyAV 只解码选中的数据包, OpenCV 在间隔较大时直接定位到下一帧。
+其他编码格式的帧相互参照, 仍需解码全部帧, 只是跳过未选中帧的裁剪和颜色转换。
+"""
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from collections import deque
+from fractions import Fraction
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# 视频帧尺寸
+FRAME_WIDTH = 640
+FRAME_HEIGHT = 480
+
+# Windows 下隐藏子进程的终端窗口。子进程放入新的进程组(Windows)或会话(start_new_session, 其他平台),
+# 终端中的 Ctrl+C 不会中断正在运行的 ffmpeg, 由主进程等待正在处理的视频完成后再退出
+CREATION_FLAGS = getattr(subprocess, 'CREATE_NO_WINDOW', 0) | getattr(subprocess, 'CREATE_NEW_PROCESS_GROUP', 0)
+
+# 单个滤镜或表达式参数的长度上限: Windows 的整条命令行不能超过 32767 个字符,
+# 更长的滤镜写入临时文件(-filter_script), 更长的丢包表达式分为多次运行
+ARGUMENT_LIMIT = 8000
+# 只含关键帧的编码格式(ffprobe / PyAV 的编码名称)
+INTRA_ONLY_CODECS = {'mjpeg', 'png', 'rawvideo', 'prores', 'dnxhd', 'huffyuv', 'ffvhuff', 'utvideo'}
+INTRA_ONLY_FOURCCS = {'MJPG', 'mjpg', 'jpeg', 'AVRn'}
+# OpenCV 定位时从目标之前约 16 帧处开始逐帧解码, 间隔超过该帧数时定位才比逐帧 grab 更快
+OPENCV_SEEK_GAP = 48
+
+
+def find_tool(model_folder, name):
+    """在模型文件夹中查找 ffmpeg / ffprobe(name.exe 或 name), 找不到时使用 PATH 中的同名程序"""
+    for candidate in (Path(model_folder) / f"{name}.exe", Path(model_folder) / name):
+        if candidate.exists():
+            return candidate
+    found = shutil.which(name)
+    return Path(found) if found else Path(model_folder) / f"{name}.exe"
+
+
+def band_filter(crop_offset, row_width, width=FRAME_WIDTH, margin=2):
+    """
+    构造只保留中间条带的 ffmpeg 滤镜: 先在 YUV 域按偶数行对齐裁出略大的区域(420 色度按两行采样),
+    转换为 RGB 后再精确裁剪到 row_width 行, 结果与整帧转换后再裁剪逐像素一致。
+    """
+    top = max(crop_offset - margin, 0) // 2 * 2
+    height = crop_offset + row_width + margin - top
+    height += height % 2
+
+    return f"crop={width}:{height}:0:{top},format=rgb24,crop={width}:{row_width}:0:{crop_offset - top}"
+
+
+def index_ranges(frame_indices):
+    """将递增的帧序号合并为连续的区间 [(first, last), ...]"""
+    ranges = []
+    for index in frame_indices:
+        if ranges and index == ranges[-1][1] + 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return [tuple(bounds) for bounds in ranges]
+
+
+def index_terms(ranges):
+    """ffmpeg 表达式中匹配各区间内帧序号 n 的各项, 相加后非零即为选中"""
+    return [f"eq(n\\,{first})" if first == last else f"between(n\\,{first}\\,{last})" for first, last in ranges]
+
+
+def select_filter(frame_indices):
+    """构造只保留指定帧序号的 ffmpeg select 滤镜(连续的序号合并为区间), 未选中的帧在裁剪和格式转换之前即被丢弃"""
+    return "select=" + "+".join(index_terms(index_ranges(frame_indices)))
+
+
+def drop_expressions(frame_indices, limit=None):
+    """
+    noise 比特流滤镜的 drop 表达式: 丢弃未选中的数据包, 返回 [(表达式, 保留的帧数), ...]。
+    每个表达式不超过 limit 个字符(默认为 ARGUMENT_LIMIT), 超出时按帧序号分为多个表达式, 每个表达式只保留其中一部分帧。
+    """
+    limit = limit or ARGUMENT_LIMIT
+    ranges = index_ranges(frame_indices)
+    expressions = []
+    terms, count, length = [], 0, 0
+    for term, (first, last) in zip(index_terms(ranges), ranges):
+        if terms and length + len(term) + 1 > limit:
+            expressions.append((f"not({'+'.join(terms)})", count))
+            terms, count, length = [], 0, 0
+        terms.append(term)
+        count += last - first + 1
+        length += len(term) + 1
+    if terms:
+        expressions.append((f"not({'+'.join(terms)})", count))
+    return expressions
+
+
+def trim_filter(start, stop):
+    """构造只保留第 [start, stop) 帧的 ffmpeg trim 滤镜; 到达 stop 后 ffmpeg 即停止解码"""
+    options = ([f"start_frame={start}"] if start > 0 else []) + ([f"end_frame={stop}"] if stop is not None else [])
+    return "trim=" + ":".join(options)
+
+
+def read_raw_frames(ffmpeg, video_path, width=FRAME_WIDTH, height=FRAME_HEIGHT, video_filter=None, input_args=(),
+                    output_args=()):
+    """通过 rawvideo 管道解码视频, 逐帧返回 HxWx3 的 RGB 数组(不落盘)"""
+    frame_bytes = width * height * 3
+    filter_args = ['-vf', video_filter] if video_filter else []
+    script_path = None
+    if video_filter and len(video_filter) > ARGUMENT_LIMIT:
+        # 过长的滤镜(如选帧很多的 select)从文件读取, 避免超出命令行长度限制
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as script:
+            script.write(video_filter)
+        script_path = script.name
+        filter_args = ['-filter_script:v', script_path]
+    # passthrough: 不按帧率补帧, 经 select 滤镜丢弃的帧不会被重复输出
+    try:
+        process = subprocess.Popen(
+            [ffmpeg, '-v', 'error', *input_args, '-i', video_path, *filter_args, *output_args, '-vsync', 'passthrough',
+             '-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:1'],
+            stdout=subprocess.PIPE, creationflags=CREATION_FLAGS, start_new_session=True
+        )
+        try:
+            while True:
+                buffer = process.stdout.read(frame_bytes)
+                if len(buffer) < frame_bytes:
+                    break
+                yield np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+    finally:
+        if script_path:
+            os.remove(script_path)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, process.args)
+
+
+def is_intra_only(video_path):
+    """按容器中的 FOURCC(不解码)判断视频是否只含关键帧"""
+    capture = cv2.VideoCapture(str(video_path))
+    try:
+        fourcc = int(capture.get(cv2.CAP_PROP_FOURCC))
+    finally:
+        capture.release()
+    return fourcc.to_bytes(4, 'little').decode('ascii', 'replace') in INTRA_ONLY_FOURCCS
+
+
+def count_frames(ffprobe, video_path):
+    """使用 ffprobe 解码统计视频帧数"""
+    ffprobe_output = subprocess.check_output(
+        [ffprobe, '-v', 'error', '-count_frames', '-select_streams', 'v:0', '-show_entries', 'stream=nb_read_frames',
+         '-of', 'default=nokey=1:noprint_wrappers=1', video_path],
+        creationflags=CREATION_FLAGS, start_new_session=True
+    )
+    return int(ffprobe_output.strip())
+
+
+def probe_frame_count(ffprobe, video_path, fallback=True):
+    """
+    优先读取容器元数据中的帧数(无需解码), 元数据缺失或无效时才退回到 ffprobe 解码计数;
+    fallback=False 时不进行解码, 直接返回 None
+    """
+    ffprobe_output = subprocess.check_output(
+        [ffprobe, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=nb_frames',
+         '-of', 'default=nokey=1:noprint_wrappers=1', video_path],
+        creationflags=CREATION_FLAGS, start_new_session=True
+    )
+    nb_frames = ffprobe_output.strip()
+    if nb_frames.isdigit() and int(nb_frames) > 0:
+        return int(nb_frames)
+
+    if not fallback:
+        return None
+    return count_frames(ffprobe, video_path)
+
+
+class FFmpegDecoder:
+    """ffmpeg 子进程解码; band_decode 为 True 时在解码阶段裁出条带, 管道中只传输这些行"""
+    name = 'ffmpeg'
+
+    def __init__(self, model_folder, band_decode=True):
+        self.ffmpeg = find_tool(model_folder, 'ffmpeg')
+        self.ffprobe = find_tool(model_folder, 'ffprobe')
+        self.band_decode = band_decode
+        self._drop_supported = None
+
+    def frame_count(self, video_path, fallback=True):
+        return probe_frame_count(self.ffprobe, video_path, fallback)
+
+    def drops_packets(self, video_path):
+        """
+        视频只含关键帧, 且 ffmpeg 支持输入端的比特流滤镜(ffmpeg 7.0 起)和 noise 的 drop 表达式时,
+        可在解码之前丢弃未选中的帧
+        """
+        if self._drop_supported is None:
+            # 对一段极短的测试输入使用输入端的 noise=drop, 不支持时 ffmpeg 报错退出
+            try:
+                self._drop_supported = subprocess.run(
+                    [self.ffmpeg, '-v', 'error', '-bsf:v', 'noise=drop=0', '-f', 'lavfi', '-i', 'color=s=16x16:d=0.04',
+                     '-f', 'null', '-'], capture_output=True, creationflags=CREATION_FLAGS, start_new_session=True
+                ).returncode == 0
+            except OSError:
+                self._drop_supported = False
+        return self._drop_supported and is_intra_only(video_path)
+
+    def frame_timing(self, video_path):
+        """容器中的基础帧率和起始时间(秒), 无效时返回 None"""
+        ffprobe_output = subprocess.check_output(
+            [self.ffprobe, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=r_frame_rate,start_time',
+             '-of', 'json', video_path], creationflags=CREATION_FLAGS, start_new_session=True
+        )
+        try:
+            stream = json.loads(ffprobe_output)['streams'][0]
+            numerator, _, denominator = stream['r_frame_rate'].partition('/')
+            frame_rate = Fraction(int(numerator), int(denominator or 1))
+            start_time = Fraction(stream.get('start_time', '0'))
+        except (ValueError, TypeError, KeyError, IndexError, ZeroDivisionError):
+            return None
+        return (frame_rate, start_time) if frame_rate > 0 else None
+
+    def frames(self, video_path, rows=None, frame_indices=None, frame_range=None):
+        start, stop = frame_range or (0, None)
+        if frame_indices and start == 0 and stop is None and self.drops_packets(video_path):
+            # 未选中的数据包由输入端的比特流滤镜在解码之前丢弃; 每个表达式一次运行, 输出其保留的帧数后即停止
+            passes = [(['-bsf:v', f"noise=drop={expression}"], ['-frames:v', str(count)], [])
+                      for expression, count in drop_expressions(frame_indices)]
+        else:
+            passes = [self.filter_pass(video_path, start, stop, frame_indices)]
+
+        for input_args, output_args, filters in passes:
+            if rows and self.band_decode:
+                first_row, last_row = rows
+                filters = filters + [band_filter(first_row, last_row - first_row)]
+                yield from read_raw_frames(self.ffmpeg, video_path, height=last_row - first_row,
+                                           video_filter=",".join(filters), input_args=input_args,
+                                           output_args=output_args)
+                continue
+
+            for pixels in read_raw_frames(self.ffmpeg, video_path, video_filter=",".join(filters),
+                                          input_args=input_args, output_args=output_args):
+                yield pixels[slice(*rows)] if rows else pixels
+
+    def filter_pass(self, video_path, start, stop, frame_indices):
+        """以定位和滤镜选出 [start, stop) 中的帧(及其中的 frame_indices), 返回 (输入参数, 输出参数, 滤镜列表)"""
+        timing = self.frame_timing(video_path) if start > 0 else None
+        if timing:
+            frame_rate, start_time = timing
+
+            def frame_time(index):
+                # 第 index 帧与前一帧时间戳的中点, 容忍时间戳取整
+                return float(start_time + (index - Fraction(1, 2)) / frame_rate)
+
+            # 定位到 start 之前的一帧(ffmpeg 会保留与定位时间重叠的帧), 保留原始时间戳(-copyts)后按时间戳选出 [start, stop)
+            input_args = ['-copyts', '-ss', f"{max(float((start - 1.5) / frame_rate), 0):.6f}"]
+            if stop is None:
+                filters = [f"select=gte(t\\,{frame_time(start):.6f})"]
+            else:
+                # trim 只用于提前结束解码(留出一帧余量, 其边界可能按帧的结束时间判断), 由 select 精确截取
+                filters = [f"trim=end={frame_time(stop + 1):.6f}",
+                           f"select=gte(t\\,{frame_time(start):.6f})*lt(t\\,{frame_time(stop):.6f})"]
+        else:
+            input_args = []
+            filters = [trim_filter(start, stop)] if start > 0 or stop is not None else []
+        # 经过上面的滤镜后帧从 start 开始重新计数, select 使用相对于 start 的序号
+        if frame_indices:
+            filters.append(select_filter([index - start for index in frame_indices]))
+        return input_args, [], filters
+
+
+class OpenCVDecoder:
+    """OpenCV 进程内解码; 未选中的帧只 grab 不转换颜色, 只含关键帧的视频在长间隔处直接定位"""
+    name = 'opencv'
+
+    def __init__(self, model_folder=None, band_decode=True):
+        pass
+
+    def frame_count(self, video_path, fallback=True):
+        capture = cv2.VideoCapture(str(video_path))
+        try:
+            count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            if count > 0 or not fallback:
+                return count if count > 0 else None
+            count = 0
+            while capture.grab():
+                count += 1
+            return count
+        finally:
+            capture.release()
+
+    def frames(self, video_path, rows=None, frame_indices=None, frame_range=None):
+        capture = cv2.VideoCapture(str(video_path))
+        if not capture.isOpened():
+            raise IOError(f"Cannot open {video_path}")
+        wanted = set(frame_indices) if frame_indices else None
+        start, stop = frame_range or (0, None)
+        rows = slice(*rows) if rows else slice(None)
+        # grab() 也会解码; 只含关键帧的视频在距下一个选中帧较远时直接定位过去, 跳过其间的帧
+        upcoming = deque(sorted(index for index in wanted if index >= start)) if wanted else None
+        seek_ahead = upcoming is not None and is_intra_only(video_path)
+        try:
+            index = 0
+            # 定位失败时从头逐帧跳过
+            if start > 0 and capture.set(cv2.CAP_PROP_POS_FRAMES, start):
+                index = start
+            while stop is None or index < stop:
+                if upcoming is not None:
+                    while upcoming and upcoming[0] < index:
+                        upcoming.popleft()
+                    if not upcoming:
+                        # 选中的帧都已返回
+                        break
+                    if seek_ahead and upcoming[0] - index > OPENCV_SEEK_GAP and \
+                            capture.set(cv2.CAP_PROP_POS_FRAMES, upcoming[0]):
+                        index = upcoming[0]
+                if not capture.grab():
+                    break
+                if index >= start and (wanted is None or index in wanted):
+                    ok, bgr = capture.retrieve()
+                    if not ok:
+                        break
+                    # 只对需要的行做 BGR→RGB 转换
+                    yield cv2.cvtColor(bgr[rows], cv2.COLOR_BGR2RGB)
+                index += 1
+        finally:
+            capture.release()
+
+
+class PyAVDecoder:
+    """PyAV 进程内解码, 使用 FFmpeg 的多线程解码"""
+    name = 'pyav'
+
+    def __init__(self, model_folder=None, band_decode=True):
+        if av is None:
+            raise ImportError("The pyav decoder requires PyAV (pip install av)")
+
+    def frame_count(self, video_path, fallback=True):
+        with av.open(str(video_path)) as container:
+            count = container.streams.video[0].frames
+            if count > 0 or not fallback:
+                return count if count > 0 else None
+            return sum(1 for packet in container.demux(video=0) if packet.size)
+
+    def frames(self, video_path, rows=None, frame_indices=None, frame_range=None):
+        wanted = set(frame_indices) if frame_indices else None
+        start, stop = frame_range or (0, None)
+        rows = slice(*rows) if rows else slice(None)
+        with av.open(str(video_path)) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = 'AUTO'
+            start_pts = stream.start_time or 0
+            seek = start > 0 and bool(stream.average_rate) and stream.time_base is not None
+            if seek:
+                # 定位到 start 帧之前的关键帧, 之后按时间戳换算帧序号
+                container.seek(start_pts + int((start - 0.5) / stream.average_rate / stream.time_base), stream=stream)
+
+            def index_of(item, index):
+                if not seek:
+                    return index
+                pts = item.pts if item.pts is not None else getattr(item, 'dts', None)
+                if pts is None:
+                    raise ValueError(f"Cannot seek in {video_path}: frames have no timestamps")
+                return round((pts - start_pts) * stream.time_base * stream.average_rate)
+
+            # 最后一个选中的帧之后不再解码
+            last = max(wanted) if wanted else None
+            index = 0
+            if wanted is not None and stream.codec_context.codec.intra_only:
+                # 只含关键帧: 只解码选中的数据包(及末尾用于取出缓冲帧的空包)
+                for packet in container.demux(stream):
+                    if packet.size:
+                        position = index_of(packet, index)
+                        index = position + 1
+                        if position > last or (stop is not None and position >= stop):
+                            # 取出解码器中缓冲的帧后结束
+                            packet = None
+                        elif position < start or position not in wanted:
+                            continue
+                    for frame in stream.codec_context.decode(packet):
+                        yield frame.to_ndarray(format='rgb24')[rows]
+                    if packet is None:
+                        break
+                return
+
+            for frame in container.decode(stream):
+                index = index_of(frame, index)
+                if (stop is not None and index >= stop) or (last is not None and index > last):
+                    break
+                if index >= start and (wanted is None or index in wanted):
+                    yield frame.to_ndarray(format='rgb24')[rows]
+                index += 1
+
+
+DECODERS = {'ffmpeg': FFmpegDecoder, 'opencv': OpenCVDecoder, 'pyav': PyAVDecoder}
+
+
+def create_decoder(name, model_folder, band_decode=True):
+    return DECODERS[name](model_folder, band_decode)
@@ -1,10 +1,10 @@
-from openpyxl import Workbook
 import cv2
 from shapely.geometry import LineString, Polygon
 import numpy as np
 import os
 import argparse
 import glob
+from result_writers import RESULT_FORMATS, open_result_writer
 
 if __name__ == "__main__":
     # 创建解析器
@@ -13,48 +13,46 @@ if __name__ == "__main__":
     # 添加参数
     parser.add_argument('-l', '--label_folder', default='./leaf/labels/', type=str, required=False, help='Path to the label folder')
     parser.add_argument('-o', '--output_path', default='./', type=str, required=False, help='Output file path')
+    parser.add_argument('--format', default='xlsx', choices=RESULT_FORMATS, required=False,
+                        help='Result file format: Excel workbook, CSV, or Parquet / Arrow stream (need pyarrow)')
 
     # 解析参数
     args = parser.parse_args()
 
     LABELPATHS = sorted(glob.glob(args.label_folder + '*.txt'))
-    outputfile = os.path.join(args.output_path, 'results.xlsx')
+    outputfile = os.path.join(args.output_path, f'results.{args.format}')
 
     horizontal_ratio = 25
 
-    wb = Workbook()
+    # 结果随分析进度分批写出; 未检测到叶片时在 xlsx / CSV 中标为 NA, 在 Parquet / Arrow 中为空值
+    columns = [("Labels", 'str'), ("Predicted_Leaf_Width", 'float')]
+    with open_result_writer(outputfile, columns, na_value='NA') as writer:
+        for labelpath in sorted(LABELPATHS):
+            polygon = []
 
-    ws = wb.active
-    ws.append(["Labels", "Predicted_Leaf_Width"])
+            with open(labelpath, 'r') as file:
+                data = file.readline().split()
+                for i in range(1, len(data), 2):
+                    x = float(data[i])
+                    y = float(data[i + 1])
+                    polygon.append((x, y))
 
-    for labelpath in sorted(LABELPATHS):
-        polygon = []
+            polygon = np.array(polygon, dtype=np.float32)
 
-        with open(labelpath, 'r') as file:
-            data = file.readline().split()
-            for i in range(1, len(data), 2):
-                x = float(data[i])
-                y = float(data[i + 1])
-                polygon.append((x, y))
+            # 当检测到了叶片的情况下再计算叶宽，否则标为缺失
+            if not polygon.any():
+                leaf_width = None
 
-        polygon = np.array(polygon, dtype=np.float32)
+            else:
+                (cx, cy), (l, w), theta = cv2.minAreaRect(polygon)
+                cutting_line = LineString([(cx - 1, cy), (cx + 1, cy)])
 
-        # 当检测到了叶片的情况下再计算叶宽，否则标为缺失
-        if not polygon.any():
-            leaf_width = 'NA'
+                # 获取线段与多边形边界的交点
+                leaf_polygon = Polygon(polygon)
+                intersection_line = cutting_line.intersection(leaf_polygon)
 
-        else:
-            (cx, cy), (l, w), theta = cv2.minAreaRect(polygon)
-            cutting_line = LineString([(cx - 1, cy), (cx + 1, cy)])
+                leaf_width = round(intersection_line.length * horizontal_ratio, 1)
 
-            # 获取线段与多边形边界的交点
-            leaf_polygon = Polygon(polygon)
-            intersection_line = cutting_line.intersection(leaf_polygon)
+            file_name = labelpath.split('/')[-1].split('.')[0]
 
-            leaf_width = round(intersection_line.length * horizontal_ratio, 1)
-
-        file_name = labelpath.split('/')[-1].split('.')[0]
-
-        ws.append([file_name, leaf_width])
-
-    wb.save(outputfile)
+            writer.write([file_name, leaf_width])